@@ -13,3 +13,29 @@ app = Celery('attpcdaq')
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings')
 app.autodiscover_tasks(lambda: settings.INSTALLED_APPS)
+
+
+@app.on_after_configure.connect
+def setup_periodic_tasks(sender, **kwargs):
+    """Schedule the periodic tasks.
+
+    This is done here rather than in the settings so that loading the settings doesn't import the app's modules.
+    The status checks run faster while the system is busy and slower while it's idle (see
+    :mod:`attpcdaq.daq.schedules`). The intervals are in seconds for busy, active, and idle.
+
+    """
+    from datetime import timedelta
+    from attpcdaq.daq.schedules import AdaptiveSchedule
+
+    sender.add_periodic_task(AdaptiveSchedule(busy=0.5, active=5, idle=60),
+                             sender.signature('attpcdaq.daq.tasks.eccserver_refresh_all_batched_task'),
+                             name='update-state')
+    sender.add_periodic_task(AdaptiveSchedule(busy=5, active=15, idle=120),
+                             sender.signature('attpcdaq.daq.tasks.check_ecc_server_online_all_task'),
+                             name='check-ecc-server-online')
+    sender.add_periodic_task(AdaptiveSchedule(busy=5, active=15, idle=120),
+                             sender.signature('attpcdaq.daq.tasks.check_data_router_status_all_task'),
+                             name='check-data-router-status')
+    sender.add_periodic_task(timedelta(hours=1),
+                             sender.signature('attpcdaq.logs.tasks.prune_log_entries_task'),
+                             name='prune-log-entries')
@@ -0,0 +1,44 @@
+"""Database helper functions
+
+These functions perform bulk operations on model instances that the ORM in the version of Django
+used by this project does not provide directly.
+
+"""
+
+from django.db.models import Case, When, Value
+
+
+def bulk_update(instances, field_names):
+    """Write the given fields of many model instances back to the database in one UPDATE query.
+
+    This is equivalent to ``QuerySet.bulk_update`` from newer versions of Django. Each field is
+    set using a ``CASE`` expression on the primary key, so the number of queries does not depend on
+    the number of instances. No signals are sent and ``save()`` is not called on the instances.
+
+    Parameters
+    ----------
+    instances : iterable of django.db.models.Model
+        The instances to update. They must all be of the same model class, and they must have
+        already been saved to the database.
+    field_names : iterable of str
+        The names of the fields to write.
+
+    Returns
+    -------
+    int
+        The number of rows that were updated.
+
+    """
+    instances = list(instances)
+    if len(instances) == 0:
+        return 0
+
+    model = type(instances[0])
+    cases = {}
+    for name in field_names:
+        field = model._meta.get_field(name)
+        whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname), output_field=field))
+                 for obj in instances]
+        cases[field.attname] = Case(*whens, output_field=field)
+
+    return model._default_manager.filter(pk__in=[obj.pk for obj in instances]).update(**cases)
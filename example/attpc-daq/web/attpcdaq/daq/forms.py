@@ -1,9 +1,12 @@
 from django import forms
+from django.db import transaction
 from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Submit, Layout, Fieldset, HTML
 from crispy_forms.bootstrap import FormActions, AppendedText
 
 from .models import DataSource, ECCServer, DataRouter, Experiment, ConfigId, RunMetadata, Observable, Measurement
+from .dbutils import bulk_update
+from .pivot import bump_pivot_version
 
 
 class CrispyModelFormBase(forms.ModelForm):
@@ -122,7 +125,8 @@ class RunMetadataForm(CrispyModelFormBase):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        observables = Observable.objects.filter(experiment=self.instance.experiment)
+        observables = list(Observable.objects.filter(experiment=self.instance.experiment))
+        self.measurements = self._load_measurements(observables)
 
         field_type_map = {
             Observable.INTEGER: forms.IntegerField,
@@ -131,7 +135,7 @@ class RunMetadataForm(CrispyModelFormBase):
         }
 
         for obs in observables:
-            measurement, created = Measurement.objects.get_or_create(run_metadata=self.instance, observable=obs)
+            measurement = self.measurements[obs.name]
             field_type = field_type_map[obs.value_type]
             self.fields[obs.name] = field_type(initial=measurement.value, required=False, help_text=obs.comment)
 
@@ -161,17 +165,52 @@ class RunMetadataForm(CrispyModelFormBase):
             buttons,
         )
 
+    def _load_measurements(self, observables):
+        """Get the measurement of each observable for this run, creating any that don't exist yet.
+
+        Returns a dict mapping observable names to measurements.
+
+        """
+        measurements = {m.observable_id: m for m in Measurement.objects.filter(run_metadata=self.instance)}
+
+        missing = [Measurement(run_metadata=self.instance, observable=obs)
+                   for obs in observables if obs.pk not in measurements]
+        if missing:
+            Measurement.objects.bulk_create(missing)
+            if any(m.pk is None for m in missing):
+                # Only some databases give us the primary keys of the new rows, so look them up
+                measurements = {m.observable_id: m for m in Measurement.objects.filter(run_metadata=self.instance)}
+            else:
+                measurements.update((m.observable_id, m) for m in missing)
+
+        result = {}
+        for obs in observables:
+            measurement = measurements[obs.pk]
+            measurement.observable = obs  # So the value setter doesn't need to fetch it
+            result[obs.name] = measurement
+
+        return result
+
     def save(self, commit=True):
-        for name, value in self.cleaned_data.items():
-            if name in self.Meta.fields:
+        changed = []
+        for name, measurement in self.measurements.items():
+            if name not in self.cleaned_data:
                 continue
 
-            observable = Observable.objects.get(name=name, experiment=self.instance.experiment)
-            measurement = Measurement.objects.get(run_metadata=self.instance, observable=observable)
-            measurement.value = value
-            measurement.save()
+            value = self.cleaned_data[name]
+            if value == '':
+                value = None  # Blank text fields mean no value, like blank number fields
+
+            if value != measurement.value:
+                measurement.value = value
+                changed.append(measurement)
+
+        with transaction.atomic():
+            if changed:
+                bulk_update(changed, Measurement.VALUE_FIELDS.values())
+                transaction.on_commit(bump_pivot_version)  # bulk_update doesn't send the signal that would do this
 
-        return super().save(commit=commit)
+            return super().save(commit=commit)
 
 
 class ObservableForm(CrispyModelFormBase):
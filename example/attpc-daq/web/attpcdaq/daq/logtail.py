@@ -0,0 +1,250 @@
+"""Shared tails of the log files on the DAQ worker nodes
+
+This module lets several viewers watch the same remote log file without each of them opening their own
+SSH connection. The remote file is followed by one background thread per file, and the text it reads
+is buffered so that each viewer can pick up the new text at its own pace.
+
+"""
+
+from collections import deque, namedtuple
+import threading
+import logging
+
+from .workertasks import WorkerInterface
+
+logger = logging.getLogger(__name__)
+
+#: A piece of text read from a log file by a :class:`RemoteLogTail`. ``seq`` is its sequence number in that tail,
+#: and ``start`` and ``end`` are the byte offsets in the file where the text begins and ends.
+LogChunk = namedtuple('LogChunk', ['seq', 'start', 'end', 'text'])
+
+
+class RemoteLogTail(object):
+    """Follows a log file on a remote host in a background thread.
+
+    The file is read using :meth:`~attpcdaq.daq.workertasks.WorkerInterface.follow_file`. The first read
+    gets the last ``initial_lines`` lines of the file, and each later read gets the lines appended since the
+    previous one. Each piece of text that is read is stored as a :class:`LogChunk` with an increasing sequence
+    number, and viewers use :meth:`read_since` to get the pieces they haven't seen yet.
+
+    The sequence numbers only mean something to this tail, but the chunks also record where they are in the
+    file. A viewer that has lost its place, for example because it reconnected after the tail it was using was
+    stopped, can use :meth:`read_from_offset` to continue from the last text it saw.
+
+    Instances should be obtained from a :class:`LogTailRegistry` rather than created directly, so that they
+    can be shared.
+
+    Parameters
+    ----------
+    hostname : str
+        The host where the log file is.
+    path : str
+        The path to the log file on the remote host.
+    poll_interval : float, optional
+        The number of seconds to wait between reads of the file.
+    initial_lines : int, optional
+        The number of lines to read from the end of the file when the tail starts.
+    max_chunks : int, optional
+        The number of pieces of text to keep in the buffer. Older pieces are discarded.
+
+    Attributes
+    ----------
+    error : str or None
+        A description of the error that stopped the tail, if any.
+
+    """
+    #: The encoding of the log files
+    encoding = 'utf-8'
+
+    def __init__(self, hostname, path, poll_interval=1.0, initial_lines=50, max_chunks=500):
+        self.hostname = hostname
+        self.path = path
+        self.poll_interval = poll_interval
+        self.initial_lines = initial_lines
+
+        self.error = None
+        self._chunks = deque(maxlen=max_chunks)  # Pairs of a LogChunk and the bytes it was decoded from
+        self._last_seq = 0
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def is_running(self):
+        """Whether the background thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start following the file, if this isn't being done already."""
+        if self.is_running:
+            return
+
+        self.error = None
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='tail {}:{}'.format(self.hostname, self.path),
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Tell the background thread to stop. This does not wait for the thread to finish."""
+        self._stop_event.set()
+
+    def _run(self):
+        offset = None
+        try:
+            with WorkerInterface(self.hostname) as wint:
+                while not self._stop_event.is_set():
+                    data, offset = wint.follow_file(self.path, offset, num_lines=self.initial_lines, encoding=None)
+                    if data:
+                        self._publish(data, offset)
+                    self._stop_event.wait(self.poll_interval)
+        except Exception as e:
+            logger.exception('Failed to follow log file %s on %s', self.path, self.hostname)
+            self.error = str(e)
+        finally:
+            with self._condition:
+                self._condition.notify_all()
+
+    def _publish(self, data, end):
+        # The offsets come from the bytes that were read, since decoding may change the length of invalid text
+        start = max(0, end - len(data))
+        text = data.decode(self.encoding, errors='replace')
+        with self._condition:
+            self._last_seq += 1
+            self._chunks.append((LogChunk(self._last_seq, start, end, text), data))
+            self._condition.notify_all()
+
+    def read_since(self, seq, timeout=None):
+        """Get the text read after the given sequence number.
+
+        If there is no new text, this waits up to ``timeout`` seconds for some to arrive.
+
+        Parameters
+        ----------
+        seq : int
+            The sequence number of the last piece of text the caller has seen. Use 0 to get everything
+            in the buffer.
+        timeout : float, optional
+            The maximum number of seconds to wait. If None, wait until there is new text or the tail stops.
+
+        Returns
+        -------
+        list of LogChunk
+            The new text, in order. This is empty if nothing new arrived in time.
+
+        """
+        with self._condition:
+            if self._last_seq <= seq and self.is_running:
+                self._condition.wait(timeout)
+            return [chunk for chunk, _ in self._chunks if chunk.seq > seq]
+
+    def read_from_offset(self, offset, timeout=None):
+        """Get the buffered text that comes after the given position in the file.
+
+        This is for viewers that know how far through the file they have read, but not which chunk of this tail
+        they saw last. If the position is inside a chunk, the part of it before the position is cut off. If the
+        position isn't in the buffer at all (for example, if the file was rotated), all of the buffered text is
+        returned. If nothing has been read yet, this waits up to ``timeout`` seconds for the first text.
+
+        Parameters
+        ----------
+        offset : int
+            The offset in the file of the end of the last text the caller has seen.
+        timeout : float, optional
+            The maximum number of seconds to wait for the first text. If None, wait until there is some text or
+            the tail stops.
+
+        Returns
+        -------
+        seq : int
+            The sequence number to pass to :meth:`read_since` to get the text that arrives after this.
+        chunks : list of LogChunk
+            The text after ``offset``, in order.
+
+        """
+        with self._condition:
+            if not self._chunks and self.is_running:
+                self._condition.wait(timeout)
+            chunks = list(self._chunks)
+            seq = self._last_seq
+
+        # Search from the newest chunk, since the offsets start again from 0 if the file is rotated
+        for i in range(len(chunks) - 1, -1, -1):
+            chunk, data = chunks[i]
+            later_chunks = [c for c, _ in chunks[i + 1:]]
+            if chunk.end == offset:
+                return seq, later_chunks
+            elif chunk.start <= offset < chunk.end:
+                rest_data = data[offset - chunk.start:]
+                rest = chunk._replace(start=offset, text=rest_data.decode(self.encoding, errors='replace'))
+                return seq, [rest] + later_chunks
+
+        return seq, [c for c, _ in chunks]
+
+
+class LogTailRegistry(object):
+    """Keeps track of the :class:`RemoteLogTail` objects in use in this process.
+
+    Viewers call :meth:`subscribe` to get the tail of a file, which is created and started if nobody is
+    following that file yet. When a viewer is done, it calls :meth:`unsubscribe`, and the tail is stopped once
+    its last viewer has left.
+
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tails = {}
+
+    def subscribe(self, hostname, path):
+        """Start watching the given log file.
+
+        Parameters
+        ----------
+        hostname : str
+            The host where the log file is.
+        path : str
+            The path to the log file on the remote host.
+
+        Returns
+        -------
+        RemoteLogTail
+            The tail of the file. Pass this to :meth:`unsubscribe` when done with it.
+
+        """
+        key = (hostname, path)
+        with self._lock:
+            try:
+                tail, count = self._tails[key]
+            except KeyError:
+                tail, count = RemoteLogTail(hostname, path), 0
+
+            self._tails[key] = (tail, count + 1)
+            tail.start()
+
+        return tail
+
+    def unsubscribe(self, tail):
+        """Stop watching a log file.
+
+        Parameters
+        ----------
+        tail : RemoteLogTail
+            The object returned by :meth:`subscribe`.
+
+        """
+        key = (tail.hostname, tail.path)
+        with self._lock:
+            _, count = self._tails[key]
+            if count > 1:
+                self._tails[key] = (tail, count - 1)
+            else:
+                del self._tails[key]
+                tail.stop()
+
+    def subscriber_count(self, hostname, path):
+        """Get the number of viewers of the given log file."""
+        with self._lock:
+            return self._tails.get((hostname, path), (None, 0))[1]
+
+
+#: The registry of log tails shared by all requests in this process
+log_tail_registry = LogTailRegistry()
@@ -1,7 +1,14 @@
 from django.utils.functional import SimpleLazyObject
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.core.cache import cache
+from django.dispatch import receiver
 from functools import wraps
+import threading
+import copy
+import time
 
 from .models import Experiment
 
@@ -9,16 +16,106 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class ActiveExperimentCache(object):
+    """Caches the active experiment for all requests handled by this process.
+
+    The active experiment rarely changes, but it is needed by almost every request. This keeps the result
+    of the database lookup until :meth:`invalidate` is called, which happens automatically whenever an
+    :class:`~attpcdaq.daq.models.Experiment` is saved or deleted.
+
+    Since the web server may run in several processes, each copy is tagged with a generation number that is kept
+    in Django's cache. Invalidating increases the shared number, so every process looks the experiment up again
+    on its next request. The receiver does this once the transaction commits, so that no process can cache the
+    old experiment under the new generation in the meantime.
+
+    ..  note::
+
+        Changes made with ``QuerySet.update()`` don't send signals, so :meth:`invalidate` must be called
+        by hand after using it to change :attr:`Experiment.is_active <attpcdaq.daq.models.Experiment.is_active>`.
+
+    """
+
+    #: The cache key where the shared generation number is stored
+    generation_key = 'daq:active_experiment:generation'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = None
+        self._experiment = None
+
+    def _get_shared_generation(self):
+        generation = cache.get(self.generation_key)
+        if generation is None:
+            # Start from the current time so that a generation can't be reused if the key is evicted
+            cache.add(self.generation_key, int(time.time() * 1000), timeout=None)
+            generation = cache.get(self.generation_key)
+        return generation
+
+    def get(self):
+        """Get the active experiment.
+
+        Returns
+        -------
+        Experiment or None
+            A copy of the cached experiment, so that changes made by one request aren't seen by others. This is
+            None if no experiment is active.
+
+        """
+        generation = self._get_shared_generation()
+
+        with self._lock:
+            valid = self._generation is not None and self._generation == generation
+            experiment = self._experiment
+
+        if not valid:
+            # If the generation changes while we're querying the database, it won't match the next time
+            # and the experiment will be looked up again.
+            try:
+                experiment = Experiment.objects.get(is_active=True)
+            except Experiment.DoesNotExist:
+                experiment = None
+
+            with self._lock:
+                self._generation, self._experiment = generation, experiment
+
+        return copy.copy(experiment)
+
+    def forget(self):
+        """Forget the copy of the experiment cached in this process, without affecting other processes."""
+        with self._lock:
+            self._generation = None
+            self._experiment = None
+
+    def invalidate(self):
+        """Make every process look the experiment up again on its next request."""
+        self.forget()
+        try:
+            cache.incr(self.generation_key)
+        except ValueError:
+            # The key didn't exist yet, so no process can have a valid copy
+            pass
+
+
+#: The cache of the active experiment shared by all requests in this process
+active_experiment_cache = ActiveExperimentCache()
+
+
+@receiver(post_save, sender=Experiment)
+@receiver(post_delete, sender=Experiment)
+def _experiment_changed(sender, **kwargs):
+    # Forgetting the local copy now lets the rest of this transaction see the change
+    active_experiment_cache.forget()
+    transaction.on_commit(active_experiment_cache.invalidate)
+
+
 def get_current_experiment():
-    """Returns the experiment listed in the current session."""
-    try:
-        return Experiment.objects.get(is_active=True)
-    except Experiment.DoesNotExist:
-        return None
+    """Returns the active experiment, or None if there isn't one."""
+    return active_experiment_cache.get()
 
 
-def _can_get_experiment():
-    return Experiment.objects.filter(is_active=True).exists()
+def _can_get_experiment(request):
+    # This evaluates the lazy request.experiment, so the view can use it without looking it up again
+    return bool(request.experiment)
 
 
 class CurrentExperimentMiddleware(object):
@@ -35,7 +132,7 @@ def needs_experiment(func):
     """
     @wraps(func)
     def wrapped_func(request, *args, **kwargs):
-        if _can_get_experiment():
+        if _can_get_experiment(request):
             return func(request, *args, **kwargs)
         else:
             return redirect(reverse('daq/choose_experiment'))
@@ -45,7 +142,7 @@ def needs_experiment(func):
 
 class NeedsExperimentMixin:
     def dispatch(self, request, *args, **kwargs):
-        if _can_get_experiment():
+        if _can_get_experiment(request):
             return super().dispatch(request, *args, **kwargs)
         else:
             return redirect(reverse('daq/choose_experiment'))
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0040_experiment_is_active'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datarouter',
+            name='pid',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='working_directory',
+            field=models.CharField(blank=True, max_length=500),
+        ),
+    ]
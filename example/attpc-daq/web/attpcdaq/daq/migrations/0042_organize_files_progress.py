@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0041_datarouter_working_directory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datarouter',
+            name='organize_files_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='datarouter',
+            name='organize_files_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='runmetadata',
+            name='graw_file_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='runmetadata',
+            name='graw_total_bytes',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:03
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_current_runs(apps, schema_editor):
+    Experiment = apps.get_model('daq', 'Experiment')
+    RunMetadata = apps.get_model('daq', 'RunMetadata')
+
+    for expt in Experiment.objects.all():
+        try:
+            latest_run = RunMetadata.objects.filter(experiment=expt).latest('start_datetime')
+        except RunMetadata.DoesNotExist:
+            continue
+
+        expt.current_run = latest_run
+        expt.run_counter = latest_run.run_number + 1
+        expt.save()
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0042_organize_files_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='experiment',
+            name='current_run',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='daq.RunMetadata'),
+        ),
+        migrations.AddField(
+            model_name='experiment',
+            name='run_counter',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(set_current_runs, reverse_code=migrations.RunPython.noop),
+    ]
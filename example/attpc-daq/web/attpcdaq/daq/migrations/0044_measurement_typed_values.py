@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:41
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+import logging
+logger = logging.getLogger(__name__)
+
+# Maps Observable.value_type to the new field and the type to convert to
+VALUE_FIELDS = {
+    'I': ('integer_value', int),
+    'F': ('float_value', float),
+    'S': ('string_value', str),
+}
+
+
+def parse_serialized_values(apps, schema_editor):
+    Measurement = apps.get_model('daq', 'Measurement')
+
+    measurements = Measurement.objects.filter(serialized_value__isnull=False).select_related('observable')
+    not_converted = 0
+    for measurement in measurements.iterator():
+        field_name, python_type = VALUE_FIELDS[measurement.observable.value_type]
+        try:
+            value = python_type(measurement.serialized_value)
+        except ValueError:
+            # Keep values that don't match the observable's type rather than losing them
+            field_name, value = 'string_value', measurement.serialized_value
+            not_converted += 1
+        Measurement.objects.filter(pk=measurement.pk).update(**{field_name: value})
+
+    if not_converted:
+        logger.warning('%d measurements did not match the type of their observable, so they were kept as strings',
+                       not_converted)
+
+
+def serialize_values(apps, schema_editor):
+    Measurement = apps.get_model('daq', 'Measurement')
+
+    for measurement in Measurement.objects.iterator():
+        for value in (measurement.integer_value, measurement.float_value, measurement.string_value):
+            if value is not None:
+                Measurement.objects.filter(pk=measurement.pk).update(serialized_value=str(value))
+                break
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('daq', '0043_experiment_current_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='measurement',
+            name='float_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='integer_value',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='measurement',
+            name='string_value',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.RunPython(parse_serialized_values, reverse_code=serialize_values),
+        migrations.RemoveField(
+            model_name='measurement',
+            name='serialized_value',
+        ),
+    ]
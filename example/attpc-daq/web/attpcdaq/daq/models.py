@@ -6,14 +6,26 @@ subclasses attached as attributes will be the columns in the database table.
 
 """
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.cache import cache
 import xml.etree.ElementTree as ET
 from zeep.client import Client as SoapClient
+from zeep.transports import Transport
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from collections import defaultdict
+from functools import lru_cache
 from datetime import datetime
 
+from .dbutils import bulk_update
+from .statuscache import bump_status_version
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -61,9 +73,8 @@ class EccClient(object):
             The full URL of the ECC server (i.e. "http://{address}:{port}").
 
         """
-        wsdl_url = os.path.join(settings.BASE_DIR, 'attpcdaq', 'daq', 'ecc.wsdl')
-        client = SoapClient(wsdl_url)  # Loads the service definition from ecc.wsdl
-        self.service = client.create_service('{urn:ecc}ecc', ecc_url)  # This overrides the default URL from the file
+        # The parsed WSDL and the bound service are shared through the registry, so this is cheap to construct.
+        self.service = ecc_client_registry.get_service(ecc_url)
 
         # This is a list of valid operations which is used in __getattr__ below.
         self.operations = ['GetState',
@@ -84,6 +95,119 @@ class EccClient(object):
             raise AttributeError('EccClient has no attribute {}'.format(item))
 
 
+class EccClientRegistry(object):
+    """A process-wide cache of the SOAP services used to talk to the ECC servers.
+
+    Loading the WSDL file is by far the most expensive part of creating a SOAP client, so this class parses it
+    only once and then keeps one bound service for each ECC server URL. All of the services share a single
+    transport, so the underlying HTTP connections are kept alive between requests.
+
+    The registry is thread-safe. An instance is available as the module-level attribute
+    ``ecc_client_registry``, and that instance is used by :class:`EccClient`.
+
+    Attributes
+    ----------
+    hits : int
+        The number of lookups that were served from the cache.
+    misses : int
+        The number of lookups that required a new service to be created.
+
+    """
+    #: The path to the WSDL file describing the ECC server's SOAP interface
+    wsdl_path = os.path.join(settings.BASE_DIR, 'attpcdaq', 'daq', 'ecc.wsdl')
+
+    #: The qualified name of the SOAP binding defined in the WSDL file
+    binding_name = '{urn:ecc}ecc'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._soap_client = None
+        self._services = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _get_soap_client(self):
+        # Must be called with the lock held
+        if self._soap_client is None:
+            transport = Transport(timeout=getattr(settings, 'ECC_SOAP_TIMEOUT', 10),
+                                  operation_timeout=getattr(settings, 'ECC_SOAP_OPERATION_TIMEOUT', 10))
+            self._soap_client = SoapClient(self.wsdl_path, transport=transport)
+        return self._soap_client
+
+    def get_service(self, ecc_url):
+        """Get the SOAP service bound to the given ECC server URL, creating it if necessary.
+
+        Parameters
+        ----------
+        ecc_url : str
+            The full URL of the ECC server (i.e. "http://{address}:{port}").
+
+        Returns
+        -------
+        zeep.client.ServiceProxy
+            The bound service. Its methods are the SOAP operations listed in :class:`EccClient`.
+
+        """
+        with self._lock:
+            try:
+                service = self._services[ecc_url]
+            except KeyError:
+                self.misses += 1
+                service = self._get_soap_client().create_service(self.binding_name, ecc_url)
+                self._services[ecc_url] = service
+            else:
+                self.hits += 1
+
+        return service
+
+    def evict(self, ecc_url):
+        """Forget the service bound to the given URL, if there is one.
+
+        This should be called when an ECC server's address changes.
+
+        Parameters
+        ----------
+        ecc_url : str
+            The URL to remove from the cache.
+
+        """
+        with self._lock:
+            self._services.pop(ecc_url, None)
+
+    def clear(self):
+        """Remove all cached services and reset the counters. The parsed WSDL is kept."""
+        with self._lock:
+            self._services.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __contains__(self, ecc_url):
+        return ecc_url in self._services
+
+    def __len__(self):
+        return len(self._services)
+
+
+#: The registry of SOAP services shared by all :class:`EccClient` instances in this process
+ecc_client_registry = EccClientRegistry()
+
+
+@lru_cache(maxsize=256)
+def _config_id_xml(describe, prepare, configure):
+    """Build the XML for :meth:`ConfigId.as_xml`.
+
+    The result only depends on the names of the three configs, so it's cached using them as the key.
+
+    """
+    root = ET.Element('ConfigId')
+
+    for tag, value in zip(('describe', 'prepare', 'configure'), (describe, prepare, configure)):
+        node = ET.SubElement(root, 'SubConfigId', attrib={'type': tag})
+        node.text = value
+
+    return ET.tostring(root, encoding='unicode')
+
+
 class ConfigId(models.Model):
     """Represents a configuration file set as seen by the ECC servers.
 
@@ -142,13 +266,7 @@ class ConfigId(models.Model):
             The XML representation.
 
         """
-        root = ET.Element('ConfigId')
-
-        for tag, value in zip(('describe', 'prepare', 'configure'), (self.describe, self.prepare, self.configure)):
-            node = ET.SubElement(root, 'SubConfigId', attrib={'type': tag})
-            node.text = value
-
-        return ET.tostring(root, encoding='unicode')
+        return _config_id_xml(self.describe, self.prepare, self.configure)
 
     @classmethod
     def from_xml(cls, node):
@@ -267,6 +385,24 @@ class ECCServer(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Override to remember the URL the object was loaded with, so address changes can be detected."""
+        instance = super().from_db(db, field_names, values)
+        if 'ip_address' in field_names and 'port' in field_names:
+            instance._loaded_ecc_url = instance.ecc_url
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Override of save to drop the cached SOAP service if the IP address or port changed."""
+        super().save(*args, **kwargs)
+
+        loaded_url = getattr(self, '_loaded_ecc_url', None)
+        current_url = self.ecc_url
+        if loaded_url is not None and loaded_url != current_url:
+            ecc_client_registry.evict(loaded_url)
+        self._loaded_ecc_url = current_url
+
     @property
     def ecc_url(self):
         """Get the URL of the ECC server as a string.
@@ -294,8 +430,9 @@ class ECCServer(models.Model):
     def _get_soap_client(self):
         """Creates a SOAP client for communicating with the ECC server.
 
-        The client loads the WSDL file, which describes the SOAP services, from the local disk. The
-        target URL of the client is then set to the ECC server's address.
+        The client uses the WSDL file, which describes the SOAP services, from the local disk. The
+        target URL of the client is then set to the ECC server's address. The parsed WSDL and the
+        service bound to this address are cached in :data:`ecc_client_registry`, so repeated calls are cheap.
 
         Returns
         -------
@@ -374,27 +511,89 @@ class ECCServer(models.Model):
                 </DataLink>
             </DataLinkSet>
 
+        The XML is kept in the cache until one of the data sources or data routers is changed, or for at most
+        ``ECC_DATA_LINK_CACHE_TTL`` seconds. If it isn't in the cache, it's built from the data sources and their
+        data routers using one query. If the XML was already loaded with :meth:`load_data_link_xml`, that copy is
+        used without checking the cache.
+
         Returns
         -------
         str
             The XML data.
 
         """
+        xml = self.__dict__.get('_data_link_xml')
+        if xml is not None:
+            return xml
+
+        key = self._data_link_cache_key()
+        xml = cache.get(key)
+        if xml is None:
+            xml = self._build_data_link_xml(DataSource.objects.filter(ecc_server=self).select_related('data_router'))
+            cache.set(key, xml, self._data_link_cache_ttl())
+
+        return xml
+
+    @classmethod
+    def load_data_link_xml(cls, ecc_servers):
+        """Load the data link XML of many ECC servers at once.
+
+        The XML of all of the servers is read from the cache with one request, and the XML of the servers that
+        weren't in the cache is built using a single query. The XML is then stored on each of the given objects,
+        so :meth:`get_data_link_xml_from_clients` won't need to use the cache or the database again for them.
+        Like ``prefetch_related``, this means that later changes to the data sources won't be seen by these objects.
+
+        Parameters
+        ----------
+        ecc_servers : iterable of ECCServer
+            The ECC servers.
+
+        """
+        servers_by_key = {ecc._data_link_cache_key(): ecc for ecc in ecc_servers}
+        if not servers_by_key:
+            return
+
+        found = cache.get_many(servers_by_key.keys())
+        missing = [ecc for key, ecc in servers_by_key.items() if key not in found]
+
+        if missing:
+            sources = defaultdict(list)
+            for source in DataSource.objects.filter(ecc_server__in=missing).select_related('data_router'):
+                sources[source.ecc_server_id].append(source)
+
+            built = {ecc._data_link_cache_key(): cls._build_data_link_xml(sources[ecc.pk]) for ecc in missing}
+            cache.set_many(built, cls._data_link_cache_ttl())
+            found.update(built)
+
+        for key, ecc in servers_by_key.items():
+            ecc._data_link_xml = found[key]
+
+    @staticmethod
+    def _build_data_link_xml(sources):
         datalink_set = ET.Element('DataLinkSet')
-        for source in self.datasource_set.all():
+        for source in sources:
             source_node = source.get_data_link_xml()
             datalink_set.append(source_node)
 
         return ET.tostring(datalink_set, encoding='unicode')
 
+    def _data_link_cache_key(self):
+        return 'daq:datalinks:{}'.format(self.pk)
+
+    @staticmethod
+    def _data_link_cache_ttl():
+        return getattr(settings, 'ECC_DATA_LINK_CACHE_TTL', 3600)
+
     def refresh_configs(self):
         """Fetches the list of configs from the ECC server and updates the database.
 
         If new configs are present on the ECC server, they will be added to the database. If configs are present
         in the database but are no longer known to the ECC server, they will be deleted.
 
-        The old configs are deleted based on their ``last_fetched`` field. Therefore, this field will be updated for
-        each existing config set that is still present on the ECC server when this function is called.
+        The list from the ECC server is compared with the configs already in the database, which are loaded with
+        one query. The new configs are then created with one query, the ``last_fetched`` field of the configs that
+        are still present is updated with another, and the outdated configs are deleted together. Afterwards, the
+        list is considered up to date for ``ECC_CONFIG_LIST_TTL`` seconds (see :attr:`configs_are_stale`).
 
         """
         client = self._get_soap_client()
@@ -403,14 +602,49 @@ class ECCServer(models.Model):
 
         config_list_xml = ET.fromstring(result.Text)
         configs = [ConfigId.from_xml(s) for s in config_list_xml.findall('ConfigId')]
+
+        existing = {}
+        stale_pks = []
+        for config in self.configid_set.all():
+            key = (config.describe, config.prepare, config.configure)
+            if key in existing:
+                stale_pks.append(config.pk)  # Remove duplicates left behind by older versions
+            else:
+                existing[key] = config.pk
+
+        new_configs = {}
         for config in configs:
-            ConfigId.objects.update_or_create(describe=config.describe,
-                                              prepare=config.prepare,
-                                              configure=config.configure,
-                                              ecc_server=self,
-                                              defaults={'last_fetched': fetch_time})
+            key = (config.describe, config.prepare, config.configure)
+            if key not in existing and key not in new_configs:
+                config.ecc_server = self
+                config.last_fetched = fetch_time
+                new_configs[key] = config
+
+        fetched_keys = {(c.describe, c.prepare, c.configure) for c in configs}
+        kept_pks = [pk for key, pk in existing.items() if key in fetched_keys]
+        stale_pks += [pk for key, pk in existing.items() if key not in fetched_keys]
+
+        with transaction.atomic():
+            if new_configs:
+                ConfigId.objects.bulk_create(new_configs.values())
+            if kept_pks:
+                ConfigId.objects.filter(pk__in=kept_pks).update(last_fetched=fetch_time)
+            if stale_pks:
+                ConfigId.objects.filter(pk__in=stale_pks).delete()
+
+        cache.set(self._config_list_cache_key(), fetch_time, getattr(settings, 'ECC_CONFIG_LIST_TTL', 60))
 
-        self.configid_set.filter(last_fetched__lt=fetch_time).delete()
+    def _config_list_cache_key(self):
+        return 'daq:configs:fetched:{}'.format(self.pk)
+
+    @property
+    def configs_are_stale(self):
+        """Whether the list of configs should be fetched from the ECC server again.
+
+        This is True if :meth:`refresh_configs` hasn't been called in the last ``ECC_CONFIG_LIST_TTL`` seconds.
+
+        """
+        return cache.get(self._config_list_cache_key()) is None
 
     def refresh_state(self):
         """Gets the current state of the data source from the ECC server and updates the database.
@@ -418,6 +652,24 @@ class ECCServer(models.Model):
         This will update the :attr:`~ECCServer.state` and :attr:`~ECCServer.is_transitioning` fields of the
         :class:`ECCServer`.
 
+        Raises
+        ------
+        ECCError
+            If the return code from the ECC server is nonzero.
+        """
+        self.state, self.is_transitioning = self.fetch_state()
+        self.save()
+
+    def fetch_state(self):
+        """Gets the current state of the data source from the ECC server without touching the database.
+
+        Returns
+        -------
+        state : int
+            The state of the ECC state machine.
+        is_transitioning : bool
+            Whether the ECC server is currently performing a transition.
+
         Raises
         ------
         ECCError
@@ -429,9 +681,144 @@ class ECCServer(models.Model):
         if int(result.ErrorCode) != 0:
             raise ECCError(result.ErrorMessage)
 
-        self.state = int(result.State)
-        self.is_transitioning = int(result.Transition) != 0
-        self.save()
+        return int(result.State), int(result.Transition) != 0
+
+    @classmethod
+    def refresh_state_many(cls, ecc_servers, max_workers=8, timeout=None):
+        """Refresh the state of many ECC servers at once.
+
+        The ``GetState`` requests are sent concurrently using a pool of at most ``max_workers`` threads. The
+        threads only talk to the ECC servers; the results are written back to the database afterwards with a
+        single UPDATE query. Servers whose state did not change are not written at all.
+
+        If the request to one ECC server fails, the error is logged and that server is skipped. The same happens
+        to servers that haven't answered after ``timeout`` seconds. The results that did arrive are still written,
+        even if waiting is interrupted (e.g. by a Celery soft time limit), and this doesn't wait for the requests
+        that are still running. Those end after the ``ECC_SOAP_OPERATION_TIMEOUT`` setting.
+
+        Parameters
+        ----------
+        ecc_servers : iterable of ECCServer
+            The ECC servers to refresh. The instances are updated in place.
+        max_workers : int, optional
+            The maximum number of concurrent requests.
+        timeout : float, optional
+            The maximum number of seconds to wait for the responses. If None, there is no limit beyond the
+            timeout of each request.
+
+        Returns
+        -------
+        list of ECCServer
+            The servers whose state changed.
+
+        """
+        ecc_servers = list(ecc_servers)
+        if len(ecc_servers) == 0:
+            return []
+
+        changed = []
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(ecc_servers)))
+        futures = {executor.submit(ecc.fetch_state): ecc for ecc in ecc_servers}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                ecc = futures[future]
+                try:
+                    state, is_transitioning = future.result()
+                except Exception:
+                    logger.exception('Failed to refresh state of ECC server %s', ecc.name)
+                    continue
+
+                if state != ecc.state or is_transitioning != ecc.is_transitioning:
+                    ecc.state = state
+                    ecc.is_transitioning = is_transitioning
+                    changed.append(ecc)
+        except FuturesTimeoutError:
+            logger.error('Timed out refreshing state of ECC server(s): %s',
+                         ', '.join(sorted(ecc.name for future, ecc in futures.items() if not future.done())))
+        finally:
+            cls._abandon(executor, futures)
+            bulk_update(changed, ['state', 'is_transitioning'])
+            if changed:
+                transaction.on_commit(bump_status_version)
+
+        return changed
+
+    @classmethod
+    def change_state_many(cls, ecc_servers, target_state, max_workers=8, timeout=None):
+        """Tell many ECC servers to transition to a new state at once.
+
+        This calls :meth:`change_state` for each server using a pool of at most ``max_workers`` threads. The
+        servers' selected configs should be loaded beforehand (e.g. with ``select_related``), and their data link
+        XML is loaded here with :meth:`load_data_link_xml`, so that the threads only talk to the ECC servers.
+        Afterwards, the servers whose transition failed have :attr:`is_transitioning` set back to False with a
+        single UPDATE query.
+
+        Servers that haven't answered after ``timeout`` seconds count as failures. As in :meth:`refresh_state_many`,
+        the failures are written even if waiting is interrupted, and requests that are still running aren't waited
+        for.
+
+        Parameters
+        ----------
+        ecc_servers : iterable of ECCServer
+            The ECC servers to transition.
+        target_state : int
+            The desired final state.
+        max_workers : int, optional
+            The maximum number of concurrent requests.
+        timeout : float, optional
+            The maximum number of seconds to wait for the responses. If None, there is no limit beyond the
+            timeout of each request.
+
+        Returns
+        -------
+        dict
+            Maps the ECC servers whose transition failed to a description of the error. This is empty if all
+            of the servers accepted the transition.
+
+        """
+        ecc_servers = list(ecc_servers)
+        if len(ecc_servers) == 0:
+            return {}
+
+        cls.load_data_link_xml(ecc_servers)
+
+        failures = {}
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(ecc_servers)))
+        futures = {executor.submit(ecc.change_state, target_state): ecc for ecc in ecc_servers}
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                ecc = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.exception('Failed to change state of ECC server %s', ecc.name)
+                    failures[ecc] = str(e)
+        except FuturesTimeoutError:
+            for future, ecc in futures.items():
+                if not future.done():
+                    logger.error('Timed out changing state of ECC server %s', ecc.name)
+                    failures[ecc] = 'Timed out waiting for a response'
+        finally:
+            cls._abandon(executor, futures)
+            if failures:
+                for ecc in failures:
+                    ecc.is_transitioning = False
+                cls.objects.filter(pk__in=[ecc.pk for ecc in failures]).update(is_transitioning=False)
+                transaction.on_commit(bump_status_version)
+
+        return failures
+
+    @staticmethod
+    def _abandon(executor, futures):
+        """Shut down a thread pool without waiting for the requests that are still running.
+
+        Requests that haven't started are cancelled. The ones in progress end on their own when the SOAP
+        operation timeout expires.
+
+        """
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=False)
 
     def change_state(self, target_state):
         """Tells the ECC server to transition the data source to a new state.
@@ -524,6 +911,19 @@ class DataRouter(models.Model):
     #: Whether the directory where the data router is running contains any GRAW files.
     staging_directory_is_clean = models.BooleanField(default=True)
 
+    #: The PID of the data router process when it was last found. This is used along with
+    #: :attr:`~DataRouter.working_directory` to avoid looking up the working directory again.
+    pid = models.PositiveIntegerField(null=True, blank=True)
+
+    #: The working directory of the data router process when it was last found.
+    working_directory = models.CharField(max_length=500, blank=True)
+
+    #: The number of GRAW files found in the staging directory by the most recent file organization.
+    organize_files_total = models.PositiveIntegerField(default=0)
+
+    #: The number of GRAW files moved so far by the most recent file organization.
+    organize_files_done = models.PositiveIntegerField(default=0)
+
     class Meta:
         ordering = ('name',)
         unique_together = ('name', 'experiment')
@@ -531,6 +931,17 @@ class DataRouter(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def organize_files_progress(self):
+        """The fraction of files moved by the most recent file organization.
+
+        This is None if there were no files to organize.
+
+        """
+        if self.organize_files_total == 0:
+            return None
+        return self.organize_files_done / self.organize_files_total
+
 
 class DataSource(models.Model):
     """A source of data, probably a CoBo or a MuTAnT.
@@ -607,13 +1018,22 @@ class Experiment(models.Model):
     #: Is this the active experiment? Only one experiment may be active at a time.
     is_active = models.BooleanField(default=False)
 
+    #: The most recent run in this experiment. This is set when a run is added, and it is found again by
+    #: :meth:`update_current_run` when a run is deleted or moved. Use :attr:`latest_run` to read it.
+    current_run = models.ForeignKey('RunMetadata', null=True, blank=True, editable=False, related_name='+',
+                                    on_delete=models.SET_NULL)
+
+    #: The number that the next run will have. This is kept up to date along with :attr:`current_run`.
+    run_counter = models.PositiveIntegerField(default=0, editable=False)
+
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
         """Override of save to enforce only one active experiment at a time."""
         # http://stackoverflow.com/a/1455507/3820658
-        if self.is_active:
+        update_fields = kwargs.get('update_fields')
+        if self.is_active and (update_fields is None or 'is_active' in update_fields):
             try:
                 currently_active = Experiment.objects.get(is_active=True)
                 if currently_active != self:
@@ -632,12 +1052,18 @@ class Experiment(models.Model):
 
         This will return the current run if a run is ongoing, or the most recent run if the DAQ is stopped.
 
+        The run is found using the :attr:`current_run` pointer, so this is a lookup by primary key. If the pointer
+        isn't set, the runs are searched instead in case this instance was loaded before a run was added.
+
         Returns
         -------
         RunMetadata or None
             The most recent or current run. If there are no runs for this experiment, None will be returned instead.
 
         """
+        if self.current_run_id is not None:
+            return self.current_run
+
         try:
             return self.runmetadata_set.latest('start_datetime')
         except RunMetadata.DoesNotExist:
@@ -673,36 +1099,72 @@ class Experiment(models.Model):
         int
             The next run number.
         """
+        if self.current_run_id is not None:
+            return self.run_counter
+
         latest_run = self.latest_run
         if latest_run is not None:
             return latest_run.run_number + 1
         else:
             return 0
 
+    def update_current_run(self):
+        """Find the most recent run and store it in :attr:`current_run` and :attr:`run_counter`.
+
+        This is called automatically when a run is deleted or moved to a different experiment, run number, or
+        start time. The experiment's row is locked while this is done, and it is only saved if something changed.
+
+        """
+        with transaction.atomic():
+            experiment = Experiment.objects.select_for_update().get(pk=self.pk)
+
+            try:
+                latest_run = experiment.runmetadata_set.latest('start_datetime')
+            except RunMetadata.DoesNotExist:
+                latest_run = None
+
+            run_counter = latest_run.run_number + 1 if latest_run is not None else 0
+            latest_run_pk = latest_run.pk if latest_run is not None else None
+
+            if experiment.current_run_id != latest_run_pk or experiment.run_counter != run_counter:
+                experiment.current_run = latest_run
+                experiment.run_counter = run_counter
+                experiment.save(update_fields=['current_run', 'run_counter'])
+
+        self.current_run = latest_run
+        self.run_counter = run_counter
+
     def start_run(self):
         """Creates and saves a new :class:`RunMetadata` object with the next run number for the experiment.
 
         The :attr:`~RunMetadata.start_datetime` field of the created :class:`RunMetadata` instance is set to the
         current date and time.
 
+        The experiment's row is locked while the run is created, so two simultaneous requests can't start runs
+        with the same number.
+
         Raises
         ------
         RuntimeError
             If there is already a run that has started but not stopped.
 
         """
-        if self.is_running:
-            raise RuntimeError('Stop the current run before starting a new one')
+        with transaction.atomic():
+            experiment = Experiment.objects.select_for_update().get(pk=self.pk)
+            if experiment.is_running:
+                raise RuntimeError('Stop the current run before starting a new one')
 
-        config_names = {ecc.selected_config.configure for ecc in self.eccserver_set.all()}
-        config_names_str = ', '.join(config_names)
+            config_names = {ecc.selected_config.configure for ecc in self.eccserver_set.all()}
+            config_names_str = ', '.join(config_names)
 
-        RunMetadata.objects.create(
-            experiment=self,
-            run_number=self.next_run_number,
-            start_datetime=datetime.now(),
-            config_name=config_names_str,
-        )
+            RunMetadata.objects.create(
+                experiment=self,
+                run_number=experiment.next_run_number,
+                start_datetime=datetime.now(),
+                config_name=config_names_str,
+            )
+
+        self.refresh_from_db(fields=['current_run', 'run_counter'])
 
     def stop_run(self):
         """Stops the current run.
@@ -716,12 +1178,16 @@ class Experiment(models.Model):
             If there is no current run.
 
         """
-        if not self.is_running:
-            raise RuntimeError('Not running')
+        with transaction.atomic():
+            experiment = Experiment.objects.select_for_update().get(pk=self.pk)
+            if not experiment.is_running:
+                raise RuntimeError('Not running')
 
-        current_run = self.latest_run
-        current_run.stop_datetime = datetime.now()
-        current_run.save()
+            current_run = experiment.latest_run
+            current_run.stop_datetime = datetime.now()
+            current_run.save(update_fields=['stop_datetime'])
+
+        self.refresh_from_db(fields=['current_run', 'run_counter'])
 
 
 class RunMetadata(models.Model):
@@ -779,9 +1245,43 @@ class RunMetadata(models.Model):
     #: The type of run this represents. Use one of the constants attached to this class.
     run_class = models.CharField(max_length=4, choices=run_class_choices)
 
+    #: The number of GRAW files recorded in this run, summed over all data routers. This is counted
+    #: when the files are organized at the end of the run.
+    graw_file_count = models.PositiveIntegerField(default=0)
+
+    #: The total size of the GRAW files recorded in this run, in bytes.
+    graw_total_bytes = models.BigIntegerField(default=0)
+
     def __str__(self):
         return "{} run {}".format(self.experiment.name, self.run_number)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Override to remember the position the run was loaded with, so that moved runs can be detected."""
+        instance = super().from_db(db, field_names, values)
+        if all(f in field_names for f in ('experiment_id', 'run_number', 'start_datetime')):
+            instance._loaded_position = instance._position()
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Override of save to remember the position that was saved. See :meth:`has_moved`."""
+        self._moved = self._position() != getattr(self, '_loaded_position', None)
+        super().save(*args, **kwargs)
+        self._loaded_position = self._position()
+
+    def _position(self):
+        return self.experiment_id, self.run_number, self.start_datetime
+
+    @property
+    def has_moved(self):
+        """Whether the last save added this run or changed its experiment, run number, or start time.
+
+        Only these saves can change which run is the most recent one in an experiment, so the other saves (like
+        editing the title or stopping the run) don't need to update :attr:`Experiment.current_run`.
+
+        """
+        return getattr(self, '_moved', True)
+
     @property
     def duration(self):
         """Get the duration of the run.
@@ -860,6 +1360,98 @@ class Observable(models.Model):
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Override to remember the value type the object was loaded with, so type changes can be detected."""
+        instance = super().from_db(db, field_names, values)
+        if 'value_type' in field_names:
+            instance._loaded_value_type = instance.value_type
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Override of save to move the values of the measurements if the value type changed.
+
+        See :meth:`convert_measurements`.
+
+        """
+        loaded_value_type = getattr(self, '_loaded_value_type', None)
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if loaded_value_type is not None and loaded_value_type != self.value_type:
+                self.convert_measurements(loaded_value_type)
+
+        self._loaded_value_type = self.value_type
+
+    def convert_measurements(self, old_value_type):
+        """Move the values of this observable's measurements to the field for its current value type.
+
+        Each value is converted to the new type. Values that can't be converted, like text that isn't a number or
+        a float that isn't a whole number, are stored as strings instead so that they aren't lost, and a warning
+        is logged with the number of them. The measurements are updated with one query.
+
+        Parameters
+        ----------
+        old_value_type : str
+            The value type that the measurements were stored with.
+
+        Returns
+        -------
+        int
+            The number of values that couldn't be converted.
+
+        """
+        old_field = Measurement.VALUE_FIELDS[old_value_type]
+        new_field = Measurement.VALUE_FIELDS[self.value_type]
+        new_type = Measurement._type_map[self.value_type]
+
+        measurements = list(Measurement.objects.filter(observable=self, **{old_field + '__isnull': False}))
+        not_converted = 0
+        for measurement in measurements:
+            old_value = getattr(measurement, old_field)
+            try:
+                if new_type is int and isinstance(old_value, float) and not old_value.is_integer():
+                    raise ValueError('Not a whole number')
+                field_name, value = new_field, new_type(old_value)
+            except ValueError:
+                field_name, value = 'string_value', str(old_value)
+                not_converted += 1
+
+            for name in Measurement.VALUE_FIELDS.values():
+                setattr(measurement, name, value if name == field_name else None)
+
+        bulk_update(measurements, Measurement.VALUE_FIELDS.values())
+
+        if not_converted:
+            logger.warning('%d measurements of %s could not be converted to %s, so they were kept as strings',
+                           not_converted, self.name, self.get_value_type_display())
+
+        return not_converted
+
+    def statistics(self):
+        """Find the minimum, maximum, and mean of the measurements of this observable.
+
+        This is computed by the database. Runs where the observable wasn't measured are ignored.
+
+        Returns
+        -------
+        dict
+            The keys are ``count``, ``min``, ``max``, and ``mean``. For string observables, only ``count`` is given.
+
+        """
+        value_field = Measurement.VALUE_FIELDS[self.value_type]
+        measurements = Measurement.objects.filter(observable=self, **{value_field + '__isnull': False})
+
+        if self.value_type == self.STRING:
+            return {'count': measurements.count()}
+
+        return measurements.aggregate(
+            count=models.Count(value_field),
+            min=models.Min(value_field),
+            max=models.Max(value_field),
+            mean=models.Avg(value_field),
+        )
+
 
 class Measurement(models.Model):
     """A measurement of an Observable.
@@ -875,8 +1467,14 @@ class Measurement(models.Model):
     #: The Observable that this is a measurement of
     observable = models.ForeignKey(Observable, on_delete=models.CASCADE)
 
-    #: The value as a string
-    serialized_value = models.CharField(max_length=100, null=True, blank=True)
+    #: The value, if the observable is an integer
+    integer_value = models.BigIntegerField(null=True, blank=True)
+
+    #: The value, if the observable is a floating-point number
+    float_value = models.FloatField(null=True, blank=True)
+
+    #: The value, if the observable is a string
+    string_value = models.CharField(max_length=100, null=True, blank=True)
 
     _type_map = {
         Observable.INTEGER: int,
@@ -884,6 +1482,14 @@ class Measurement(models.Model):
         Observable.STRING: str,
     }
 
+    #: Maps each :attr:`Observable.value_type` to the name of the field where values of that type are stored.
+    #: This can be used to filter or aggregate the measurements of an observable in the database.
+    VALUE_FIELDS = {
+        Observable.INTEGER: 'integer_value',
+        Observable.FLOAT: 'float_value',
+        Observable.STRING: 'string_value',
+    }
+
     @property
     def python_type(self):
         """The Python data type we expect for this measurement."""
@@ -891,19 +1497,119 @@ class Measurement(models.Model):
 
     @property
     def value(self):
-        """The value, converted to the expected data type."""
-        if self.serialized_value is not None:
-            return self.python_type(self.serialized_value)
-        else:
-            return None
+        """The value, in the data type of the observable.
+
+        Only the field matching the observable's type is ever set, so this doesn't need to look at the observable.
+
+        """
+        for field_name in ('integer_value', 'float_value', 'string_value'):
+            value = getattr(self, field_name)
+            if value is not None:
+                return value
+        return None
 
     @value.setter
     def value(self, new_value):
-        if isinstance(new_value, self.python_type):
-            self.serialized_value = str(new_value)
-        elif new_value is None:
-            self.serialized_value = None
-        else:
+        if new_value is not None and not isinstance(new_value, self.python_type):
             received_type = type(new_value)
             raise ValueError('New value was of type{:s}. Expected {:s}.'.format(
                 str(received_type), str(self.python_type)))
+
+        value_field = self.VALUE_FIELDS[self.observable.value_type]
+        for field_name in self.VALUE_FIELDS.values():
+            setattr(self, field_name, new_value if field_name == value_field else None)
+
+
+@receiver(post_save, sender=ECCServer)
+@receiver(post_save, sender=DataRouter)
+@receiver(post_save, sender=RunMetadata)
+@receiver(post_save, sender=Experiment)
+@receiver(post_delete, sender=ECCServer)
+@receiver(post_delete, sender=DataRouter)
+@receiver(post_delete, sender=RunMetadata)
+def _status_changed(sender, **kwargs):
+    """Invalidate the cached system status when an object shown on the status page changes.
+
+    This is done after the current transaction commits. Otherwise, another request could build a snapshot from the
+    old data and store it under the new version.
+
+    """
+    transaction.on_commit(bump_status_version)
+
+
+@receiver(post_save, sender=RunMetadata)
+@receiver(post_save, sender=Observable)
+@receiver(post_save, sender=Measurement)
+@receiver(post_delete, sender=RunMetadata)
+@receiver(post_delete, sender=Observable)
+@receiver(post_delete, sender=Measurement)
+def _measurements_changed(sender, **kwargs):
+    """Invalidate the cached tables of measurements (see :mod:`attpcdaq.daq.pivot`) once the transaction commits."""
+    from .pivot import bump_pivot_version  # Imported here since that module imports this one
+    transaction.on_commit(bump_pivot_version)
+
+
+#: The fields of :class:`DataRouter` that appear in the data link XML
+_DATA_LINK_ROUTER_FIELDS = frozenset(('name', 'ip_address', 'port', 'connection_type'))
+
+
+@receiver(post_save, sender=DataSource)
+@receiver(post_save, sender=DataRouter)
+@receiver(post_delete, sender=DataSource)
+@receiver(post_delete, sender=DataRouter)
+def _data_links_changed(sender, update_fields=None, **kwargs):
+    """Remove the cached data link XML of every ECC server when a data source or data router changes.
+
+    The data sources and routers are rarely edited, so it's simpler to clear everything than to work out which
+    ECC servers were affected. Saves that only update a data router's status are ignored. The XML is removed once
+    the transaction commits, so that it can't be rebuilt from the old rows in the meantime.
+
+    """
+    if sender is DataRouter and update_fields is not None and not _DATA_LINK_ROUTER_FIELDS & set(update_fields):
+        return
+
+    keys = ['daq:datalinks:{}'.format(pk) for pk in ECCServer.objects.values_list('pk', flat=True)]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender=ECCServer)
+@receiver(post_delete, sender=ECCServer)
+def _ecc_server_data_links_changed(sender, instance, created=True, **kwargs):
+    """Make sure that a new ECC server doesn't see the data link XML of a deleted one with the same pk."""
+    if created:
+        key = instance._data_link_cache_key()
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(post_save, sender=RunMetadata)
+@receiver(post_delete, sender=RunMetadata)
+def _run_changed(sender, instance, raw=False, created=False, **kwargs):
+    """Keep :attr:`Experiment.current_run` pointing to the most recent run.
+
+    Saves that don't move the run (see :attr:`RunMetadata.has_moved`) are ignored. A new run that started after the
+    current one takes its place with a single update. Otherwise, the most recent run is found again with
+    :meth:`Experiment.update_current_run`.
+
+    """
+    if raw:
+        return  # Loading fixtures
+
+    if kwargs['signal'] is post_save and not instance.has_moved:
+        return
+
+    if created and instance.start_datetime is not None:
+        later_than_current = Q(current_run__isnull=True) | Q(current_run__start_datetime__lte=instance.start_datetime)
+        if Experiment.objects.filter(later_than_current, pk=instance.experiment_id).update(
+                current_run=instance, run_counter=instance.run_number + 1):
+            # update() doesn't send the signal that refreshes the cached active experiment, so do it here
+            from .middleware import active_experiment_cache  # Imported here since that module imports this one
+            active_experiment_cache.forget()
+            transaction.on_commit(active_experiment_cache.invalidate)
+            return
+
+    try:
+        experiment = Experiment.objects.get(pk=instance.experiment_id)
+    except Experiment.DoesNotExist:
+        return  # The run was deleted along with its experiment
+
+    experiment.update_current_run()
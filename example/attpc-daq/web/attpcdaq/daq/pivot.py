@@ -0,0 +1,141 @@
+"""Tables of measurements by run and observable
+
+The measurement chart shows the value of every observable in every run of an experiment. This module builds that
+table in a columnar form, with one array of values per observable, using a fixed number of queries. The table is
+cached using Django's cache framework and rebuilt when any run, observable, or measurement changes.
+
+Like the cached system status (see :mod:`attpcdaq.daq.statuscache`), cached tables are stored under a version number
+that is increased with :func:`bump_pivot_version` whenever the data changes. As with the status, this should be done
+with ``transaction.on_commit(bump_pivot_version)`` when the change is made in a transaction.
+
+"""
+
+from django.core.cache import cache
+from bisect import bisect_left, bisect_right
+import time
+
+from .models import RunMetadata, Observable, Measurement
+
+#: The cache key where the version of the measurement tables is stored
+PIVOT_VERSION_KEY = 'daq:pivot:version'
+
+
+def get_pivot_version():
+    """Get the current version of the measurement tables.
+
+    Returns
+    -------
+    int
+        The version number.
+
+    """
+    version = cache.get(PIVOT_VERSION_KEY)
+    if version is None:
+        cache.add(PIVOT_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        version = cache.get(PIVOT_VERSION_KEY)
+    return version
+
+
+def bump_pivot_version():
+    """Record that a run, observable, or measurement has changed."""
+    try:
+        cache.incr(PIVOT_VERSION_KEY)
+    except ValueError:
+        # The key didn't exist yet
+        cache.add(PIVOT_VERSION_KEY, int(time.time() * 1000), timeout=None)
+        cache.incr(PIVOT_VERSION_KEY)
+
+
+def build_measurement_pivot(experiment):
+    """Build the table of measurements for an experiment.
+
+    This uses three queries: one for the observables, one for the runs, and one for all of the measurements. The
+    values are read from the typed fields of :class:`~attpcdaq.daq.models.Measurement`, so no conversion is needed.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment.
+
+    Returns
+    -------
+    dict
+        The table. The key ``run_numbers`` gives the run numbers in increasing order, and ``observables`` is a
+        list with a dictionary for each observable, in display order. Each of these contains the observable's
+        ``pk``, ``name``, and ``units``, and ``values`` is a list of its values in each run. Missing values are None.
+
+    """
+    observables = list(Observable.objects.filter(experiment=experiment).values_list('pk', 'name', 'units'))
+    runs = list(RunMetadata.objects.filter(experiment=experiment).order_by('run_number', 'pk')
+                                   .values_list('pk', 'run_number'))
+
+    row_index = {run_pk: i for i, (run_pk, _) in enumerate(runs)}
+    columns = {pk: [None] * len(runs) for pk, _, _ in observables}
+
+    measurements = (Measurement.objects.filter(run_metadata__experiment=experiment)
+                                       .values_list('run_metadata_id', 'observable_id', 'integer_value',
+                                                    'float_value', 'string_value'))
+    for run_pk, observable_pk, integer_value, float_value, string_value in measurements:
+        try:
+            values = columns[observable_pk]
+        except KeyError:
+            continue  # The observable belongs to another experiment
+
+        # At most one of the typed values is set (see Measurement.value)
+        for value in (integer_value, float_value, string_value):
+            if value is not None:
+                values[row_index[run_pk]] = value
+                break
+
+    return {
+        'run_numbers': [run_number for _, run_number in runs],
+        'observables': [{'pk': pk, 'name': name, 'units': units, 'values': columns[pk]}
+                        for pk, name, units in observables],
+    }
+
+
+def get_measurement_pivot(experiment):
+    """Get the table of measurements for an experiment, using the cached copy if it's up to date.
+
+    See :func:`build_measurement_pivot` for the format.
+
+    """
+    key = 'daq:pivot:{}:{}'.format(experiment.pk, get_pivot_version())
+    pivot = cache.get(key)
+    if pivot is None:
+        pivot = build_measurement_pivot(experiment)
+        cache.set(key, pivot)
+    return pivot
+
+
+def filter_pivot(pivot, run_min=None, run_max=None, observable_pks=None):
+    """Select part of a table of measurements.
+
+    Parameters
+    ----------
+    pivot : dict
+        The table, from :func:`get_measurement_pivot`.
+    run_min, run_max : int, optional
+        The range of run numbers to include, inclusive. If not given, the range isn't limited on that side.
+    observable_pks : iterable of int, optional
+        The primary keys of the observables to include. If not given, all observables are included.
+
+    Returns
+    -------
+    dict
+        A new table in the same format.
+
+    """
+    run_numbers = pivot['run_numbers']
+    start = 0 if run_min is None else bisect_left(run_numbers, run_min)
+    stop = len(run_numbers) if run_max is None else bisect_right(run_numbers, run_max)
+
+    observables = pivot['observables']
+    if observable_pks is not None:
+        observable_pks = set(observable_pks)
+        observables = [obs for obs in observables if obs['pk'] in observable_pks]
+
+    return {
+        'run_numbers': run_numbers[start:stop],
+        'observables': [dict(obs, values=obs['values'][start:stop]) for obs in observables],
+    }
@@ -0,0 +1,163 @@
+"""Adaptive schedules for the periodic status checks
+
+The state of the ECC servers and data routers only needs to be checked often while something is happening. This
+module keeps track of how active the system is, and it provides :class:`AdaptiveSchedule`, a Celery beat schedule
+that runs its task at a different rate depending on that activity level.
+
+The activity level is stored in Django's cache so that it's shared between the web app, which marks the system as
+busy when the user asks for a transition, and the Celery workers, which record the level they see when they poll
+the ECC servers.
+
+"""
+
+from django.core.cache import cache
+from django.conf import settings
+from celery.schedules import schedule, schedstate
+from celery.utils.time import remaining
+from datetime import timedelta
+import random
+
+#: The activity level while a transition is in progress or was just requested
+BUSY = 'busy'
+
+#: The activity level while some ECC servers are out of the idle state, but nothing is changing
+ACTIVE = 'active'
+
+#: The activity level when all ECC servers are idle, or there is no active experiment
+IDLE = 'idle'
+
+#: The cache key of the flag that marks the system as busy
+BUSY_KEY = 'daq:poll:busy'
+
+#: The cache key of the last activity level seen by the status checks
+ACTIVITY_KEY = 'daq:poll:activity'
+
+
+def mark_busy(duration=None):
+    """Mark the system as busy so that the status checks are run at their fastest rate.
+
+    Parameters
+    ----------
+    duration : float, optional
+        The number of seconds for which the system should be considered busy. The default is given by the
+        ``STATUS_POLL_BUSY_DURATION`` setting.
+
+    """
+    if duration is None:
+        duration = getattr(settings, 'STATUS_POLL_BUSY_DURATION', 30)
+    cache.set(BUSY_KEY, True, duration)
+
+
+def record_activity(ecc_servers):
+    """Record the activity level shown by a set of ECC servers.
+
+    If any of the servers is transitioning, the system is marked busy with :func:`mark_busy`. Otherwise, the
+    level is :data:`IDLE` if all of the servers are idle (or there are none), and :data:`ACTIVE` if not.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        All of the ECC servers in the active experiment, with their current states.
+
+    """
+    ecc_servers = list(ecc_servers)
+    if any(ecc.is_transitioning for ecc in ecc_servers):
+        mark_busy()
+
+    if all(ecc.state == ecc.IDLE for ecc in ecc_servers):
+        level = IDLE
+    else:
+        level = ACTIVE
+
+    cache.set(ACTIVITY_KEY, level, None)
+
+
+def get_activity():
+    """Get the current activity level of the system.
+
+    Returns
+    -------
+    str
+        One of :data:`BUSY`, :data:`ACTIVE`, or :data:`IDLE`. If nothing has been recorded yet, this is
+        :data:`ACTIVE`.
+
+    """
+    if cache.get(BUSY_KEY):
+        return BUSY
+    return cache.get(ACTIVITY_KEY, ACTIVE)
+
+
+class AdaptiveSchedule(schedule):
+    """A Celery beat schedule whose interval depends on the activity level of the system.
+
+    Each time the task runs, the next interval is stretched or shrunk by a random fraction of up to ``jitter`` so
+    that tasks with the same intervals don't all run at the same moment.
+
+    Parameters
+    ----------
+    busy, active, idle : float or timedelta
+        The interval to use at each activity level (see :func:`get_activity`).
+    jitter : float, optional
+        The largest fraction by which an interval is randomly changed.
+    check_interval : float, optional
+        The longest time, in seconds, that Celery beat waits before checking the activity level again. A change
+        to a faster rate takes effect within this time.
+
+    """
+    def __init__(self, busy, active, idle, jitter=0.1, check_interval=2, nowfun=None, app=None):
+        self.intervals = {
+            BUSY: _as_timedelta(busy),
+            ACTIVE: _as_timedelta(active),
+            IDLE: _as_timedelta(idle),
+        }
+        self.jitter = jitter
+        self.check_interval = check_interval
+        self._jitter_factor = self._new_jitter_factor()
+        super().__init__(run_every=self.intervals[ACTIVE], nowfun=nowfun, app=app)
+
+    def _new_jitter_factor(self):
+        return 1 + random.uniform(-self.jitter, self.jitter)
+
+    def current_interval(self):
+        """Get the interval for the current activity level, including jitter.
+
+        Returns
+        -------
+        timedelta
+            The interval.
+
+        """
+        return self.intervals[get_activity()] * self._jitter_factor
+
+    def remaining_estimate(self, last_run_at):
+        return remaining(self.maybe_make_aware(last_run_at), self.current_interval(),
+                         self.maybe_make_aware(self.now()))
+
+    def is_due(self, last_run_at):
+        remaining_s = max(self.remaining_estimate(last_run_at).total_seconds(), 0)
+        if remaining_s == 0:
+            self._jitter_factor = self._new_jitter_factor()
+            next_check = self.current_interval().total_seconds()
+            return schedstate(is_due=True, next=min(next_check, self.check_interval))
+
+        return schedstate(is_due=False, next=min(remaining_s, self.check_interval))
+
+    def __repr__(self):
+        return '<adaptive: busy {} / active {} / idle {}>'.format(
+            *(self.intervals[k].total_seconds() for k in (BUSY, ACTIVE, IDLE)))
+
+    def __eq__(self, other):
+        if isinstance(other, AdaptiveSchedule):
+            return (self.intervals, self.jitter, self.check_interval) == \
+                   (other.intervals, other.jitter, other.check_interval)
+        return False
+
+    def __reduce__(self):
+        return self.__class__, (self.intervals[BUSY], self.intervals[ACTIVE], self.intervals[IDLE],
+                                self.jitter, self.check_interval, self.nowfun)
+
+
+def _as_timedelta(value):
+    if isinstance(value, timedelta):
+        return value
+    return timedelta(seconds=value)
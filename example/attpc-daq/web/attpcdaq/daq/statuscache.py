@@ -0,0 +1,230 @@
+"""Version tracking for the cached system status
+
+The status of the system shown on the main page (see :func:`attpcdaq.daq.views.helpers.get_status_snapshot`)
+is cached using Django's cache framework. This module keeps a version number for that status, which must be
+increased with :func:`bump_status_version` whenever something shown on the status page changes. Cached status
+snapshots are stored under their version number, so increasing it makes the next request build a new snapshot.
+
+Since the Celery workers and the web server run in different processes, the cache backend needs to be shared
+between them for this to work (see the ``CACHES`` setting).
+
+When the change is made in a transaction, the version must not be increased until the transaction commits, or
+another request could build a snapshot from the old data and cache it under the new version. Therefore, callers
+should use ``transaction.on_commit(bump_status_version)``, which bumps the version right away if there is no
+transaction.
+
+Views that push status changes to the browser wait on the :data:`status_watcher` instead of reading the version
+over and over. Every increase is announced to the other processes through a fanout exchange on the Celery broker,
+so the watcher in each web server process wakes its waiting views as soon as a Celery worker changes something.
+
+"""
+
+from django.core.cache import cache
+from django.conf import settings
+from celery import current_app
+from kombu import Exchange, Queue
+import threading
+import socket
+import uuid
+import time
+
+import logging
+logger = logging.getLogger(__name__)
+
+#: The cache key where the status version is stored
+STATUS_VERSION_KEY = 'daq:status:version'
+
+
+def _initial_version():
+    # Start from the current time rather than 1 so that a version number can't be reused if the key
+    # is evicted from the cache while old snapshots are still stored.
+    return int(time.time() * 1000)
+
+
+def get_status_version():
+    """Get the current version of the system status.
+
+    Returns
+    -------
+    int
+        The version number.
+
+    """
+    version = cache.get(STATUS_VERSION_KEY)
+    if version is None:
+        cache.add(STATUS_VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.get(STATUS_VERSION_KEY)
+    return version
+
+
+def bump_status_version():
+    """Record that the system status has changed.
+
+    Returns
+    -------
+    int
+        The new version number.
+
+    """
+    try:
+        version = cache.incr(STATUS_VERSION_KEY)
+    except ValueError:
+        # The key didn't exist yet
+        cache.add(STATUS_VERSION_KEY, _initial_version(), timeout=None)
+        version = cache.incr(STATUS_VERSION_KEY)
+
+    status_watcher.notify(version)
+    if settings.STATUS_BROADCAST_ENABLED:
+        _broadcast_version(version)
+
+    return version
+
+
+#: The broker exchange where new status versions are announced to every process
+STATUS_EXCHANGE = Exchange('attpcdaq.status', type='fanout', durable=False, delivery_mode='transient')
+
+
+def _broadcast_version(version):
+    """Announce a new status version to the other processes. Failures are logged and otherwise ignored."""
+    try:
+        with current_app.producer_or_acquire() as producer:
+            producer.publish({'version': version}, exchange=STATUS_EXCHANGE, declare=[STATUS_EXCHANGE],
+                             serializer='json', retry=False)
+    except Exception:
+        logger.warning('Failed to announce status version %d', version, exc_info=True)
+
+
+class StatusWatcher(object):
+    """Wakes up the threads in this process that are waiting for the status to change.
+
+    Threads call :meth:`wait_for_change` to wait for a status version newer than the one they have. They are woken
+    up by :meth:`notify`, which :func:`bump_status_version` calls when the version is increased in this process.
+    Versions increased by other processes, like the Celery workers, arrive through :data:`STATUS_EXCHANGE`, which
+    a background thread listens to while anyone is subscribed. That thread also reads the version from the cache
+    every ``check_interval`` seconds, so that changes aren't missed while the broker can't be reached.
+
+    Parameters
+    ----------
+    check_interval : float, optional
+        The number of seconds between checks of the version in the cache.
+
+    """
+    def __init__(self, check_interval=10.0):
+        self.check_interval = check_interval
+
+        self._version = None
+        self._condition = threading.Condition()
+        self._subscribers = 0
+        self._thread = None
+        self._stop_event = None
+
+    @property
+    def is_running(self):
+        """Whether the background thread is running."""
+        return self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set()
+
+    def subscribe(self):
+        """Start watching for changes. The background thread is started if it isn't running already."""
+        with self._condition:
+            self._subscribers += 1
+            if not self.is_running:
+                self.start()
+
+    def unsubscribe(self):
+        """Stop watching for changes. The background thread is stopped once nobody is subscribed."""
+        with self._condition:
+            self._subscribers -= 1
+            if self._subscribers <= 0:
+                self._subscribers = 0
+                self.stop()
+
+    def start(self):
+        """Start the background thread."""
+        # Each thread gets its own stop event, so a thread that is still stopping doesn't stop its replacement
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop_event,), name='status watcher',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Tell the background thread to stop. This does not wait for the thread to finish."""
+        if self._stop_event is not None:
+            self._stop_event.set()
+
+    def notify(self, version):
+        """Record a new status version and wake up the waiting threads.
+
+        Parameters
+        ----------
+        version : int
+            The new version. Versions older than the newest one seen are ignored.
+
+        """
+        with self._condition:
+            if self._version is None or version > self._version:
+                self._version = version
+                self._condition.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """Wait until the status version is newer than the given one.
+
+        Parameters
+        ----------
+        version : int
+            The version the caller has already seen.
+        timeout : float, optional
+            The maximum number of seconds to wait. If None, wait until the version changes.
+
+        Returns
+        -------
+        int
+            The newest version seen. This is ``version`` if nothing changed in time.
+
+        """
+        with self._condition:
+            if self._version is None or self._version <= version:
+                self._condition.wait(timeout)
+            if self._version is not None and self._version > version:
+                return self._version
+            return version
+
+    def _check_version(self):
+        self.notify(get_status_version())
+
+    def _listen(self, stop_event):
+        queue = Queue('attpcdaq.status.{}'.format(uuid.uuid4().hex), exchange=STATUS_EXCHANGE, durable=False,
+                      exclusive=True, auto_delete=True)
+
+        with current_app.connection_for_read() as conn:
+            with conn.Consumer(queue, callbacks=[self._on_message], no_ack=True, accept=['json']):
+                # Catch up on anything that changed before the queue existed
+                self._check_version()
+
+                while not stop_event.is_set():
+                    try:
+                        conn.drain_events(timeout=self.check_interval)
+                    except socket.timeout:
+                        self._check_version()
+
+    def _on_message(self, body, message):
+        self.notify(body['version'])
+
+    def _run(self, stop_event):
+        from django.db import connections
+        try:
+            while not stop_event.is_set():
+                try:
+                    self._check_version()
+                    if settings.STATUS_BROADCAST_ENABLED:
+                        self._listen(stop_event)
+                except Exception:
+                    logger.warning('Failed to watch for status changes. Retrying in %g seconds.',
+                                   self.check_interval, exc_info=True)
+                stop_event.wait(self.check_interval)
+        finally:
+            # The cache may use the database, and this thread's connection would otherwise stay open
+            connections.close_all()
+
+
+#: The watcher shared by all requests in this process
+status_watcher = StatusWatcher()
@@ -1,15 +1,145 @@
 """Celery asynchronous tasks for the daq module."""
 
 from django.core.exceptions import ObjectDoesNotExist
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.core.cache import cache
 from celery import shared_task, group
 from celery.exceptions import SoftTimeLimitExceeded
 from .models import ECCServer, DataRouter, Experiment, RunMetadata
 from .workertasks import WorkerInterface
+from .transitions import SystemTransition
+from .schedules import record_activity
+from .statuscache import bump_status_version
+
+import random
+import math
+from contextlib import contextmanager
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+#: The cache key of the lock held by :func:`eccserver_refresh_all_batched_task` while it runs
+REFRESH_LOCK_KEY = 'daq:poll:refresh_lock'
+
+#: The format of the cache keys of the locks that stop rounds of status checks from overlapping
+ROUND_LOCK_KEY = 'daq:poll:round_lock:{}'
+
+#: The format of the cache keys of the slots held by running status checks
+STATUS_CHECK_SLOT_KEY = 'daq:poll:slot:{}'
+
+
+def _spread_out(signatures):
+    """Set countdowns on a list of status check subtasks so they don't all run at once.
+
+    At most ``STATUS_POLL_MAX_CONCURRENCY`` of the subtasks are started together, and each group of them starts
+    ``STATUS_POLL_WAVE_INTERVAL`` seconds after the previous one. Each subtask is also delayed by a random amount
+    of up to ``STATUS_POLL_JITTER`` seconds.
+
+    Parameters
+    ----------
+    signatures : list of celery.Signature
+        The subtasks.
+
+    Returns
+    -------
+    list of celery.Signature
+        The same subtasks, with countdowns set.
+
+    """
+    max_concurrency = getattr(settings, 'STATUS_POLL_MAX_CONCURRENCY', 4)
+    wave_interval = getattr(settings, 'STATUS_POLL_WAVE_INTERVAL', 2)
+    jitter = getattr(settings, 'STATUS_POLL_JITTER', 0.5)
+
+    return [sig.set(countdown=(i // max_concurrency) * wave_interval + random.uniform(0, jitter))
+            for i, sig in enumerate(signatures)]
+
+
+def _start_round(name, signatures):
+    """Start a round of status check subtasks, spread out over time with :func:`_spread_out`.
+
+    The round is skipped if the previous round with the same name is still being started. This keeps the rounds
+    from piling up when the schedule runs faster than the subtasks are spread out.
+
+    Parameters
+    ----------
+    name : str
+        A name for this kind of round.
+    signatures : list of celery.Signature
+        The subtasks.
+
+    Returns
+    -------
+    bool
+        Whether the round was started.
+
+    """
+    max_concurrency = getattr(settings, 'STATUS_POLL_MAX_CONCURRENCY', 4)
+    wave_interval = getattr(settings, 'STATUS_POLL_WAVE_INTERVAL', 2)
+    jitter = getattr(settings, 'STATUS_POLL_JITTER', 0.5)
+
+    duration = ((len(signatures) - 1) // max_concurrency) * wave_interval + jitter
+    if not cache.add(ROUND_LOCK_KEY.format(name), True, timeout=max(math.ceil(duration), 1)):
+        logger.debug('Skipped a round of %s since the last one is still being started', name)
+        return False
+
+    group(_spread_out(signatures))()
+    return True
+
+
+@contextmanager
+def _status_check_slot():
+    """Hold one of the ``STATUS_POLL_MAX_CONCURRENCY`` slots shared by all of the running status checks.
+
+    The slots are kept in Django's cache, so this limits the number of checks running at once across all of the
+    Celery workers. A slot is released when the block exits, or after 40 seconds (the hard time limit of the
+    status check tasks) if the worker is killed.
+
+    Yields
+    ------
+    bool
+        Whether a slot was free. If not, the check should be skipped.
+
+    """
+    max_concurrency = getattr(settings, 'STATUS_POLL_MAX_CONCURRENCY', 4)
+
+    for i in range(max_concurrency):
+        key = STATUS_CHECK_SLOT_KEY.format(i)
+        if cache.add(key, True, timeout=40):
+            try:
+                yield True
+            finally:
+                cache.delete(key)
+            return
+
+    yield False
+
+
+def update_run_for_state(experiment, target_state):
+    """Start or stop a run when the ECC servers are moved to the running or ready state.
+
+    A run is started when the system is moved to the running state, and the current run is stopped when it's moved
+    back to ready. Stopping a run also queues :func:`organize_files_all_task` and
+    :func:`backup_config_files_all_task` for it.
+
+    Parameters
+    ----------
+    experiment : Experiment
+        The experiment whose ECC servers were moved.
+    target_state : int
+        The state that the ECC servers were moved to.
+
+    """
+    if target_state == ECCServer.RUNNING and not experiment.is_running:
+        experiment.start_run()
+    elif target_state == ECCServer.READY and experiment.is_running:
+        experiment.stop_run()
+        organize_files_all_task.delay(experiment.pk, experiment.latest_run.pk)
+        backup_config_files_all_task.delay(experiment.pk, experiment.latest_run.pk)
+
+
 @shared_task(soft_time_limit=5, time_limit=10)
 def eccserver_refresh_state_task(eccserver_pk):
     """Fetch the state of the given ECC server.
@@ -37,22 +167,75 @@ def eccserver_refresh_state_task(eccserver_pk):
         logger.exception('Failed to refresh state of ECC server %s', ecc_server.name)
 
 
+@shared_task(soft_time_limit=20, time_limit=30)
+def eccserver_refresh_configs_task(eccserver_pk):
+    """Fetch the list of config file sets from the given ECC server.
+
+    This calls :meth:`~attpcdaq.daq.models.ECCServer.refresh_configs`, which updates the configs stored in the
+    database.
+
+    Parameters
+    ----------
+    eccserver_pk : int
+        The integer primary key of the ECCServer object in the database.
+
+    """
+    try:
+        ecc_server = ECCServer.objects.get(pk=eccserver_pk)
+    except ECCServer.DoesNotExist:
+        logger.error('No ECC server exists with pk %d', eccserver_pk)
+        return
+
+    try:
+        ecc_server.refresh_configs()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while refreshing configs of %s', ecc_server.name)
+    except Exception:
+        logger.exception('Failed to refresh configs of ECC server %s', ecc_server.name)
+
+
 @shared_task(soft_time_limit=8, time_limit=10)
-def eccserver_refresh_all_task():
-    """Fetch the state of all ECC servers.
+def eccserver_refresh_all_batched_task():
+    """Fetch the state of all ECC servers in a single task.
 
-    This calls :func:`eccserver_refresh_state_task` for each ECC server in the database.
+    This does not create a subtask for each ECC server. Instead, the ECC servers are loaded with one query, contacted concurrently, and any changes are written back with
+    one query using :meth:`~attpcdaq.daq.models.ECCServer.refresh_state_many`. This is the task run periodically
+    by Celery beat.
+
+    The states found are used to update the activity level of the system
+    (see :func:`~attpcdaq.daq.schedules.record_activity`), which sets how often the periodic tasks run. If the
+    task is still running from the last time it was scheduled, it does nothing.
 
     """
+    # The lock expires after the hard time limit in case the worker is killed
+    if not cache.add(REFRESH_LOCK_KEY, True, timeout=10):
+        logger.debug('Skipped refreshing the ECC servers since the last refresh is still running')
+        return
+
     try:
-        pk_list = ECCServer.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
-        if pk_list.exists():
-            gp = group([eccserver_refresh_state_task.s(i) for i in pk_list])
-            gp()
+        ecc_servers = list(ECCServer.objects.filter(experiment__is_active=True))
+        # Stop waiting early enough to write the states that arrived before the soft time limit
+        ECCServer.refresh_state_many(ecc_servers,
+                                     max_workers=getattr(settings, 'STATUS_POLL_MAX_CONCURRENCY', 4),
+                                     timeout=6)
+        record_activity(ecc_servers)
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all ECC servers')
     except Exception:
         logger.exception('Failed to refresh state of all ECC servers')
+    finally:
+        cache.delete(REFRESH_LOCK_KEY)
+
+
+@shared_task(soft_time_limit=8, time_limit=10)
+def eccserver_refresh_all_task():
+    """Fetch the state of all ECC servers.
+
+    This is the old name of :func:`eccserver_refresh_all_batched_task`, kept so that tasks sent or scheduled
+    under it still work. It does exactly the same thing.
+
+    """
+    eccserver_refresh_all_batched_task()
 
 
 @shared_task(soft_time_limit=45, time_limit=60)
@@ -84,12 +267,115 @@ def eccserver_change_state_task(eccserver_pk, target_state):
         logger.exception('Failed to change state of %s', ecc_server.name)
 
 
+@shared_task(soft_time_limit=45, time_limit=60)
+def eccserver_change_state_all_task(experiment_pk, target_state):
+    """Change the state of all ECC servers in an experiment.
+
+    This is the task submitted when the whole system changes state. Instead of one task per ECC server, the servers
+    are loaded with their configs and data sources in a few queries and told to transition concurrently using
+    :meth:`~attpcdaq.daq.models.ECCServer.change_state_many`. The outcome for the whole system is then logged:
+    either a message saying that every server accepted the transition, or an error listing the ones that didn't.
+
+    Parameters
+    ----------
+    experiment_pk : int
+        The primary key of the experiment whose ECC servers should be transitioned.
+    target_state : int
+        The target state. Use one of the constants from the :class:`~attpcdaq.daq.models.ECCServer` class.
+
+    """
+    state_name = ECCServer.STATE_DICT.get(target_state, target_state)
+
+    try:
+        ecc_servers = ECCServer.objects.filter(experiment__pk=experiment_pk).select_related('selected_config')
+        failures = ECCServer.change_state_many(ecc_servers, target_state, timeout=40)
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while changing state of all ECC servers')
+        return
+    except Exception:
+        logger.exception('Failed to change state of all ECC servers')
+        return
+
+    if failures:
+        logger.error('Transition to %s failed for %d ECC server(s): %s', state_name, len(failures),
+                     ', '.join(sorted(ecc.name for ecc in failures)))
+    else:
+        logger.info('All ECC servers accepted the transition to %s', state_name)
+
+
+@shared_task(soft_time_limit=1800, time_limit=1860)
+def eccserver_transition_all_task(experiment_pk, target_state):
+    """Move all ECC servers in an experiment to the target state, performing any intermediate transitions.
+
+    This uses a :class:`~attpcdaq.daq.transitions.SystemTransition`, so the servers can start in any state, and
+    each step is sent to all of them at once. The time allowed for each step is set by the
+    ``ECC_TRANSITION_STEP_TIMEOUT`` setting. When the process finishes or stops because of an error, the outcome
+    is logged, and a report is returned.
+
+    If every server reaches the target state, a run is started or stopped with :func:`update_run_for_state`.
+    Nothing is done to the runs if the transition fails.
+
+    Parameters
+    ----------
+    experiment_pk : int
+        The primary key of the experiment whose ECC servers should be transitioned.
+    target_state : int
+        The target state. Use one of the constants from the :class:`~attpcdaq.daq.models.ECCServer` class.
+
+    Returns
+    -------
+    dict
+        A report with the keys ``success`` (whether every server reached the target state), ``target_state``,
+        and ``servers``. The last is a list with the ``pk``, ``name``, final ``state``, and ``error`` (or None) of
+        each ECC server.
+
+    """
+    state_name = ECCServer.STATE_DICT.get(target_state, target_state)
+
+    ecc_servers = ECCServer.objects.filter(experiment__pk=experiment_pk).select_related('selected_config')
+    transition = SystemTransition(ecc_servers, target_state,
+                                  step_timeout=getattr(settings, 'ECC_TRANSITION_STEP_TIMEOUT', 300))
+
+    try:
+        errors = transition.run()
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while moving all ECC servers to %s', state_name)
+        errors = transition.errors
+    except Exception:
+        logger.exception('Failed to move all ECC servers to %s', state_name)
+        errors = transition.errors
+
+    reached_target = all(ecc.state == target_state for ecc in transition.ecc_servers)
+    if errors:
+        logger.error('Stopped moving ECC servers to %s. %s', state_name,
+                     '; '.join('{}: {}'.format(ecc.name, err) for ecc, err in sorted(errors.items(),
+                                                                                     key=lambda i: i[0].name)))
+    elif reached_target:
+        logger.info('All ECC servers reached %s', state_name)
+
+    success = not errors and reached_target
+    if success:
+        try:
+            update_run_for_state(Experiment.objects.get(pk=experiment_pk), target_state)
+        except Exception:
+            logger.exception('Failed to start or stop the run after moving the ECC servers to %s', state_name)
+
+    return {
+        'success': success,
+        'target_state': target_state,
+        'servers': [{'pk': ecc.pk,
+                     'name': ecc.name,
+                     'state': ecc.state,
+                     'error': errors.get(ecc)} for ecc in transition.ecc_servers],
+    }
+
+
 @shared_task(soft_time_limit=10, time_limit=40)
 def check_ecc_server_online_task(eccserver_pk):
     """Checks if the ECC server is online.
 
     This is done by checking if the process is running via SSH. Specifically, the method
-    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.check_ecc_server_status` of the
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.probe` of the
     :class:`~attpcdaq.daq.workertasks.WorkerInterface` object is used.
 
     Parameters
@@ -104,30 +390,36 @@ def check_ecc_server_online_task(eccserver_pk):
         logger.error('No ECC server exists with pk %d', eccserver_pk)
         return
 
-    try:
-        with WorkerInterface(ecc_server.ip_address) as wint:
-            ecc_alive = wint.check_ecc_server_status()
+    with _status_check_slot() as has_slot:
+        if not has_slot:
+            logger.debug('Skipped checking whether %s is online since too many checks are running', ecc_server.name)
+            return
 
-        ecc_server.is_online = ecc_alive
-        ecc_server.save()
-    except SoftTimeLimitExceeded:
-        logger.error('Time limit exceeded while checking whether %s is online', ecc_server.name)
-    except Exception:
-        logger.exception('Failed to check whether %s is online', ecc_server.name)
+        try:
+            with WorkerInterface(ecc_server.ip_address) as wint:
+                ecc_alive = wint.probe().ecc_server_running
+
+            if ecc_server.is_online != ecc_alive:
+                ecc_server.is_online = ecc_alive
+                ecc_server.save()
+        except SoftTimeLimitExceeded:
+            logger.error('Time limit exceeded while checking whether %s is online', ecc_server.name)
+        except Exception:
+            logger.exception('Failed to check whether %s is online', ecc_server.name)
 
 
 @shared_task(soft_time_limit=60, time_limit=80)
 def check_ecc_server_online_all_task():
     """Check and update the state of all known ECC servers.
 
-    This calls :func:`check_ecc_server_online_task` for each ECC server.
+    This calls :func:`check_ecc_server_online_task` for each ECC server. The subtasks are spread out over time,
+    and at most ``STATUS_POLL_MAX_CONCURRENCY`` status checks run at once (see the ``STATUS_POLL_*`` settings).
 
     """
     try:
         pks = ECCServer.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
         if pks.exists():
-            gp = group([check_ecc_server_online_task.s(i) for i in pks])
-            gp()
+            _start_round('check_ecc_server_online', [check_ecc_server_online_task.s(i) for i in pks])
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all ECC servers')
     except Exception:
@@ -138,11 +430,10 @@ def check_ecc_server_online_all_task():
 def check_data_router_status_task(datarouter_pk):
     """Checks whether the data router is online and if the staging directory is clean.
 
-    This is done by checking if the process is running via SSH. Specifically, the method
-    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.check_data_router_status` of the
-    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object is used. Then, the staging directory
-    is checked for GRAW files using :meth:`~attpcdaq.daq.workertasks.WorkerInterface.working_dir_is_clean`
-    from the same class.
+    This is done via SSH using the method :meth:`~attpcdaq.daq.workertasks.WorkerInterface.probe` of the
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object, which checks whether the process is running
+    and counts the GRAW files in its staging directory in a single remote command. The data router's PID and
+    working directory are saved as well.
 
     Parameters
     ----------
@@ -156,35 +447,55 @@ def check_data_router_status_task(datarouter_pk):
         logger.error('No data router exists with pk %d', datarouter_pk)
         return
 
-    try:
-        with WorkerInterface(data_router.ip_address) as wint:
-            data_router_alive = wint.check_data_router_status()
-            data_router.is_online = data_router_alive
+    with _status_check_slot() as has_slot:
+        if not has_slot:
+            logger.debug('Skipped checking the status of %s since too many checks are running', data_router.name)
+            return
 
-            if data_router_alive:
-                # If the router isn't running, this next step will fail anyway
-                staging_dir_clean = wint.working_dir_is_clean()
-                data_router.staging_directory_is_clean = staging_dir_clean
+        try:
+            with WorkerInterface(data_router.ip_address) as wint:
+                probe_result = wint.probe()
 
-        data_router.save()
-    except SoftTimeLimitExceeded:
-        logger.error('Time limit exceeded while checking whether %s is online', data_router.name)
-    except Exception:
-        logger.exception('Failed to check whether %s is online', data_router.name)
+            old_values = (data_router.is_online, data_router.pid, data_router.working_directory,
+                          data_router.staging_directory_is_clean)
+
+            data_router.is_online = probe_result.data_router_running
+            data_router.pid = probe_result.data_router_pid
+            data_router.working_directory = probe_result.data_router_cwd or ''
+
+            if probe_result.data_router_running:
+                # If the router isn't running, there is no staging directory to check
+                if probe_result.data_router_cwd is None:
+                    raise RuntimeError("Couldn't find working directory of data router")
+                if probe_result.graw_count is None:
+                    # Don't let a run start if we can't tell whether the last one's files were moved
+                    logger.error("Couldn't list the GRAW files in the staging directory of %s", data_router.name)
+                data_router.staging_directory_is_clean = probe_result.graw_count == 0
+
+            new_values = (data_router.is_online, data_router.pid, data_router.working_directory,
+                          data_router.staging_directory_is_clean)
+
+            # Only write to the database if something changed, since saving invalidates the cached status
+            if new_values != old_values:
+                data_router.save(update_fields=['is_online', 'pid', 'working_directory', 'staging_directory_is_clean'])
+        except SoftTimeLimitExceeded:
+            logger.error('Time limit exceeded while checking whether %s is online', data_router.name)
+        except Exception:
+            logger.exception('Failed to check whether %s is online', data_router.name)
 
 
 @shared_task(soft_time_limit=60, time_limit=80)
 def check_data_router_status_all_task():
     """Check and update the state of all known data routers.
 
-    This calls :func:`check_data_router_status_task` for each data router.
+    This calls :func:`check_data_router_status_task` for each data router. The subtasks are spread out over time,
+    and at most ``STATUS_POLL_MAX_CONCURRENCY`` status checks run at once (see the ``STATUS_POLL_*`` settings).
 
     """
     try:
         pks = DataRouter.objects.filter(experiment__is_active=True).values_list('pk', flat=True)
         if pks.exists():
-            gp = group([check_data_router_status_task.s(i) for i in pks])
-            gp()
+            _start_round('check_data_router_status', [check_data_router_status_task.s(i) for i in pks])
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while refreshing state of all data routers')
     except Exception:
@@ -196,8 +507,15 @@ def organize_files_task(datarouter_pk, experiment_pk, run_pk):
     """Connects to the DAQ worker nodes to organize files at the end of a run.
 
     This is done via SSH using the method
-    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.organize_files` of the
-    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object.
+    :meth:`~attpcdaq.daq.workertasks.WorkerInterface.organize_files_bulk` of the
+    :class:`~attpcdaq.daq.workertasks.WorkerInterface` object. The data router's PID and working
+    directory stored in the database are given to the interface so that it doesn't need to look them up
+    again, and they are updated afterwards.
+
+    The progress is written to the data router's :attr:`~attpcdaq.daq.models.DataRouter.organize_files_done`
+    and :attr:`~attpcdaq.daq.models.DataRouter.organize_files_total` fields after each batch of files is moved,
+    and the number and size of the files moved are added to the run's totals. Since the files that were already
+    moved are no longer in the staging directory, the task can safely be run again if it is interrupted.
 
     Parameters
     ----------
@@ -218,11 +536,31 @@ def organize_files_task(datarouter_pk, experiment_pk, run_pk):
         return
 
     try:
+        recorded = {'files': 0, 'bytes': 0}
+
+        def record_progress(files_moved, bytes_moved, total_files):
+            router.organize_files_done = files_moved
+            router.organize_files_total = total_files
+            DataRouter.objects.filter(pk=router.pk).update(
+                organize_files_done=files_moved,
+                organize_files_total=total_files,
+            )
+            RunMetadata.objects.filter(pk=run.pk).update(
+                graw_file_count=F('graw_file_count') + (files_moved - recorded['files']),
+                graw_total_bytes=F('graw_total_bytes') + (bytes_moved - recorded['bytes']),
+            )
+            recorded['files'] = files_moved
+            recorded['bytes'] = bytes_moved
+            transaction.on_commit(bump_status_version)
+
         with WorkerInterface(router.ip_address) as wint:
-            wint.organize_files(experiment.name, run.run_number)
+            wint.set_cached_data_router(router.pid, router.working_directory)
+            wint.organize_files_bulk(experiment.name, run.run_number, progress_callback=record_progress)
 
+        router.pid = wint.data_router_pid
+        router.working_directory = wint.data_router_cwd or ''
         router.staging_directory_is_clean = True
-        router.save()
+        router.save(update_fields=['pid', 'working_directory', 'staging_directory_is_clean'])
 
     except SoftTimeLimitExceeded:
         logger.error('Time limit exceeded while organizing files at for data source %s', router.name)
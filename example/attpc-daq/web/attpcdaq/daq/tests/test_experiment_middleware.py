@@ -1,8 +1,13 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.utils.functional import SimpleLazyObject
+from django.core.cache import cache
+from unittest.mock import Mock
 
 from ..models import Experiment, ECCServer
+from ..middleware import active_experiment_cache, get_current_experiment, needs_experiment
+from .utilities import run_on_commit_callbacks
 
 
 class CurrentExperimentMiddlewareTestCase(TestCase):
@@ -31,3 +36,84 @@ class CurrentExperimentMiddlewareTestCase(TestCase):
     def test_redirects_when_no_experiment_is_active(self):
         resp = self.client.get(self.request_url, follow=True)
         self.assertEqual(resp.redirect_chain[-1][0], reverse('daq/choose_experiment'))
+
+
+class ActiveExperimentCacheTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Experiment', is_active=True)
+        self.other_experiment = Experiment.objects.create(name='Other')
+
+    def test_lookup_is_cached(self):
+        self.assertEqual(get_current_experiment(), self.experiment)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(get_current_experiment(), self.experiment)
+
+    def test_returns_copies(self):
+        first = get_current_experiment()
+        first.name = 'Changed'
+
+        self.assertEqual(get_current_experiment().name, 'Experiment')
+
+    def test_invalidated_when_active_experiment_changes(self):
+        get_current_experiment()
+
+        self.other_experiment.is_active = True
+        self.other_experiment.save()
+
+        self.assertEqual(get_current_experiment(), self.other_experiment)
+
+    def test_shared_generation_bumped_after_commit(self):
+        get_current_experiment()
+        generation = cache.get(active_experiment_cache.generation_key)
+
+        with run_on_commit_callbacks():
+            self.other_experiment.is_active = True
+            self.other_experiment.save()
+            self.assertEqual(cache.get(active_experiment_cache.generation_key), generation)
+
+        self.assertGreater(cache.get(active_experiment_cache.generation_key), generation)
+
+    def test_invalidated_by_other_process(self):
+        get_current_experiment()
+
+        # Another process changes the experiment, so this one doesn't see the signal
+        Experiment.objects.filter(pk=self.experiment.pk).update(name='Renamed')
+        cache.incr(active_experiment_cache.generation_key)
+
+        self.assertEqual(get_current_experiment().name, 'Renamed')
+
+    def test_invalidated_when_run_started(self):
+        with run_on_commit_callbacks():
+            self.experiment.start_run()
+            self.experiment.stop_run()
+        self.assertFalse(get_current_experiment().is_running)
+
+        with run_on_commit_callbacks():
+            self.experiment.start_run()
+
+        self.assertTrue(get_current_experiment().is_running)
+
+    def test_invalidated_on_delete(self):
+        get_current_experiment()
+        self.experiment.delete()
+
+        self.assertIsNone(get_current_experiment())
+
+    def test_no_active_experiment_is_cached(self):
+        Experiment.objects.all().update(is_active=False)
+        active_experiment_cache.invalidate()
+
+        self.assertIsNone(get_current_experiment())
+        with self.assertNumQueries(0):
+            self.assertIsNone(get_current_experiment())
+
+    def test_decorator_reuses_experiment(self):
+        view = Mock()
+        request = RequestFactory().get('/')
+        request.experiment = SimpleLazyObject(get_current_experiment)
+        active_experiment_cache.forget()
+
+        with self.assertNumQueries(1):
+            needs_experiment(view)(request)
+            self.assertEqual(view.call_args[0][0].experiment.name, self.experiment.name)
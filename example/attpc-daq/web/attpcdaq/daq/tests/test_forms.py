@@ -1,10 +1,14 @@
 """Unit tests for Django forms"""
 
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django import forms
 
 from ..forms import RunMetadataForm, DataSourceForm, ECCServerForm, DataRouterForm, ConfigSelectionForm, ObservableForm
 from ..models import RunMetadata, Observable, Measurement, Experiment, DataSource, ECCServer, DataRouter
+from ..pivot import get_pivot_version
+from .utilities import run_on_commit_callbacks
 
 
 class TestModelFormFieldsMixin(object):
@@ -43,7 +47,8 @@ class DataRouterFormTestCase(TestModelFormFieldsMixin, TestCase):
         self.form = DataRouterForm
 
     def get_excluded_fields(self):
-        return {'is_online', 'staging_directory_is_clean', 'experiment'}
+        return {'is_online', 'staging_directory_is_clean', 'experiment', 'pid', 'working_directory',
+                'organize_files_total', 'organize_files_done'}
 
 
 class ConfigSelectionFormTestCase(TestModelFormFieldsMixin, TestCase):
@@ -93,7 +98,7 @@ class RunMetadataFormTestCase(TestModelFormFieldsMixin, TestCase):
         )
 
     def get_excluded_fields(self):
-        return {'experiment'}
+        return {'experiment', 'graw_file_count', 'graw_total_bytes'}
 
     def test_has_fields_for_observables(self):
         form = RunMetadataForm(instance=self.run)
@@ -126,6 +131,76 @@ class RunMetadataFormTestCase(TestModelFormFieldsMixin, TestCase):
         for measurement in measurements:
             self.assertEqual(measurement.value, data[measurement.observable.name])
 
+    def _measurement_queries(self, context):
+        return [q['sql'] for q in context.captured_queries if '"daq_measurement"' in q['sql']]
+
+    def test_measurements_are_created_in_bulk(self):
+        Measurement.objects.create(run_metadata=self.run, observable=self.int_observable, value=3)
+
+        with CaptureQueriesContext(connection) as context:
+            form = RunMetadataForm(instance=self.run)
+
+        # Load, create, and (on databases that don't return the new keys from bulk_create) reload
+        queries = self._measurement_queries(context)
+        self.assertLessEqual(len(queries), 3)
+        self.assertEqual(len([q for q in queries if q.startswith('INSERT')]), 1)
+
+        self.assertEqual(Measurement.objects.filter(run_metadata=self.run).count(), len(self.observables))
+        self.assertEqual(form.fields[self.int_observable.name].initial, 3)
+
+        with CaptureQueriesContext(connection) as context:
+            RunMetadataForm(instance=self.run)
+        self.assertEqual(len(self._measurement_queries(context)), 1)
+
+    def test_measurements_are_saved_in_one_query(self):
+        data = {o.name: self.observable_type_map[o.value_type](5) for o in self.observables}
+        for field in self.get_expected_fields():
+            data[field] = getattr(self.run, field)
+
+        RunMetadataForm(instance=self.run)  # Create the measurements
+        form = RunMetadataForm(data=data, instance=self.run)
+        self.assertTrue(form.is_valid(), form.errors.as_data())
+
+        with CaptureQueriesContext(connection) as context:
+            form.save()
+
+        queries = self._measurement_queries(context)
+        self.assertEqual(len(queries), 1)
+        self.assertTrue(queries[0].startswith('UPDATE'))
+
+        for measurement in Measurement.objects.filter(run_metadata=self.run).select_related('observable'):
+            self.assertEqual(measurement.value, data[measurement.observable.name])
+
+    def test_unchanged_measurements_are_not_saved(self):
+        RunMetadataForm(instance=self.run)  # Create the measurements
+        data = {field: getattr(self.run, field) for field in self.get_expected_fields()}
+        data[self.int_observable.name] = 5
+
+        form = RunMetadataForm(data=data, instance=self.run)
+        self.assertTrue(form.is_valid(), form.errors.as_data())
+
+        with CaptureQueriesContext(connection) as context:
+            form.save()
+
+        queries = self._measurement_queries(context)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('IN ({:d})'.format(form.measurements[self.int_observable.name].pk), queries[0])
+
+    def test_measurement_table_invalidated_after_commit(self):
+        RunMetadataForm(instance=self.run)  # Create the measurements
+        data = {field: getattr(self.run, field) for field in self.get_expected_fields()}
+        data[self.int_observable.name] = 5
+
+        form = RunMetadataForm(data=data, instance=self.run)
+        self.assertTrue(form.is_valid(), form.errors.as_data())
+
+        version = get_pivot_version()
+        with run_on_commit_callbacks():
+            form.save()
+            self.assertEqual(get_pivot_version(), version)
+
+        self.assertGreater(get_pivot_version(), version)
+
 
 class ObservableFormTestCase(TestModelFormFieldsMixin, TestCase):
     def setUp(self):
@@ -0,0 +1,157 @@
+from unittest import TestCase
+from unittest.mock import patch
+import itertools
+import logging
+
+from ..logtail import RemoteLogTail, LogTailRegistry, LogChunk
+
+
+@patch('attpcdaq.daq.logtail.WorkerInterface')
+class RemoteLogTailTestCase(TestCase):
+    def setUp(self):
+        self.hostname = 'hostname'
+        self.path = '/path/to/log'
+
+    def test_follows_file(self, mock_wint):
+        wint = mock_wint.return_value.__enter__.return_value
+        returns = [(b'first\n', 6), (b'second\n', 13)]
+        wint.follow_file.side_effect = itertools.chain(returns, itertools.repeat((b'', 13)))
+
+        tail = RemoteLogTail(self.hostname, self.path, poll_interval=0.01)
+        tail.start()
+        try:
+            chunks = []
+            while len(chunks) < 2:
+                new_chunks = tail.read_since(chunks[-1].seq if chunks else 0, timeout=5)
+                self.assertNotEqual(new_chunks, [], 'Timed out waiting for text')
+                chunks += new_chunks
+        finally:
+            tail.stop()
+            tail._thread.join(5)
+
+        self.assertEqual(chunks, [LogChunk(1, 0, 6, 'first\n'), LogChunk(2, 6, 13, 'second\n')])
+        mock_wint.assert_called_once_with(self.hostname)
+
+        calls = wint.follow_file.call_args_list
+        self.assertEqual(calls[0][0], (self.path, None))
+        self.assertEqual(calls[1][0], (self.path, 6))
+        self.assertIsNone(calls[0][1]['encoding'])
+
+        # New viewers get the buffered text
+        self.assertEqual(tail.read_since(0, timeout=0), chunks)
+
+    def _make_tail_with_text(self, texts):
+        """Make a tail that has already read the given (text, end offset) pairs, without starting its thread."""
+        tail = RemoteLogTail(self.hostname, self.path)
+        for text, end in texts:
+            tail._publish(text if isinstance(text, bytes) else text.encode(), end)
+        return tail
+
+    def test_read_from_offset(self, mock_wint):
+        tail = self._make_tail_with_text([('one\ntwo\n', 108), ('three\n', 114), ('four\n', 119)])
+
+        # At the end of a chunk
+        seq, chunks = tail.read_from_offset(114, timeout=0)
+        self.assertEqual(seq, 3)
+        self.assertEqual(chunks, [LogChunk(3, 114, 119, 'four\n')])
+
+        # Inside a chunk, so only the rest of it is sent
+        seq, chunks = tail.read_from_offset(104, timeout=0)
+        self.assertEqual([chunk.text for chunk in chunks], ['two\n', 'three\n', 'four\n'])
+        self.assertEqual(chunks[0].start, 104)
+
+        # Already up to date
+        self.assertEqual(tail.read_from_offset(119, timeout=0), (3, []))
+
+        # Not in the buffer at all, e.g. because the file was rotated
+        seq, chunks = tail.read_from_offset(5000, timeout=0)
+        self.assertEqual(len(chunks), 3)
+
+    def test_offsets_with_invalid_bytes(self, mock_wint):
+        tail = self._make_tail_with_text([(b'one\n', 104), (b'\xff\xfe bad\n', 111), (b'next\n', 116)])
+
+        chunks = tail.read_since(0, timeout=0)
+        self.assertEqual(chunks[1], LogChunk(2, 104, 111, '\ufffd\ufffd bad\n'))
+        self.assertEqual(chunks[2].start, 111)
+
+        seq, chunks = tail.read_from_offset(111, timeout=0)
+        self.assertEqual([chunk.text for chunk in chunks], ['next\n'])
+
+        # The position is counted in the file's bytes, not in the replaced text
+        seq, chunks = tail.read_from_offset(106, timeout=0)
+        self.assertEqual([chunk.text for chunk in chunks], [' bad\n', 'next\n'])
+
+    def test_reconnect_to_new_tail(self, mock_wint):
+        # A viewer read the file up to offset 114 from a tail that has since been stopped
+        old_tail = self._make_tail_with_text([('one\ntwo\n', 108), ('three\n', 114)])
+        last_event_id = old_tail.read_since(0, timeout=0)[-1].end
+
+        # The new tail starts with the last few lines of the file, which now has more in it
+        wint = mock_wint.return_value.__enter__.return_value
+        returns = [(b'two\nthree\nfour\n', 119), (b'five\n', 124)]
+        wint.follow_file.side_effect = itertools.chain(returns, itertools.repeat((b'', 124)))
+
+        new_tail = RemoteLogTail(self.hostname, self.path, poll_interval=0.01)
+        new_tail.start()
+        try:
+            seq, chunks = new_tail.read_from_offset(last_event_id, timeout=5)
+            while not any(chunk.text == 'five\n' for chunk in chunks):
+                new_chunks = new_tail.read_since(seq, timeout=5)
+                self.assertNotEqual(new_chunks, [], 'Timed out waiting for text')
+                seq = new_chunks[-1].seq
+                chunks += new_chunks
+        finally:
+            new_tail.stop()
+            new_tail._thread.join(5)
+
+        # Nothing is missed, and nothing is repeated
+        self.assertEqual(''.join(chunk.text for chunk in chunks), 'four\nfive\n')
+
+    def test_error_stops_tail(self, mock_wint):
+        wint = mock_wint.return_value.__enter__.return_value
+        wint.follow_file.side_effect = FileNotFoundError('No such file')
+
+        tail = RemoteLogTail(self.hostname, self.path, poll_interval=0.01)
+        with self.assertLogs(level=logging.ERROR):
+            tail.start()
+            tail._thread.join(5)
+
+        self.assertFalse(tail.is_running)
+        self.assertEqual(tail.error, 'No such file')
+        self.assertEqual(tail.read_since(0, timeout=0), [])
+
+
+@patch('attpcdaq.daq.logtail.RemoteLogTail.start')
+@patch('attpcdaq.daq.logtail.RemoteLogTail.stop')
+class LogTailRegistryTestCase(TestCase):
+    def setUp(self):
+        self.registry = LogTailRegistry()
+        self.hostname = 'hostname'
+        self.path = '/path/to/log'
+
+    def test_viewers_share_tail(self, mock_stop, mock_start):
+        tail1 = self.registry.subscribe(self.hostname, self.path)
+        tail2 = self.registry.subscribe(self.hostname, self.path)
+
+        self.assertIs(tail1, tail2)
+        self.assertEqual(self.registry.subscriber_count(self.hostname, self.path), 2)
+
+    def test_different_files(self, mock_stop, mock_start):
+        tail1 = self.registry.subscribe(self.hostname, self.path)
+        tail2 = self.registry.subscribe(self.hostname, '/other/path')
+
+        self.assertIsNot(tail1, tail2)
+
+    def test_stops_after_last_viewer(self, mock_stop, mock_start):
+        tail = self.registry.subscribe(self.hostname, self.path)
+        self.registry.subscribe(self.hostname, self.path)
+
+        self.registry.unsubscribe(tail)
+        mock_stop.assert_not_called()
+
+        self.registry.unsubscribe(tail)
+        self.assertEqual(mock_stop.call_count, 1)
+        self.assertEqual(self.registry.subscriber_count(self.hostname, self.path), 0)
+
+        new_tail = self.registry.subscribe(self.hostname, self.path)
+        self.assertIsNot(new_tail, tail)
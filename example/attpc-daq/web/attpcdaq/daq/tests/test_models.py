@@ -1,12 +1,18 @@
-from django.test import TestCase
-from unittest.mock import patch
-from .utilities import FakeResponseState, FakeResponseText
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.core.cache import cache
+from unittest.mock import patch, MagicMock, ANY
+from .utilities import FakeResponseState, FakeResponseText, run_on_commit_callbacks, ClearCacheMixin
 from ..models import DataSource, ECCServer, DataRouter, ConfigId, Experiment, RunMetadata, Observable, Measurement
-from ..models import ECCError
+from ..models import ECCError, EccClientRegistry
 import xml.etree.ElementTree as ET
 import os
+import threading
+from concurrent.futures import as_completed
 from itertools import permutations, product
 from datetime import datetime
+import logging
 
 
 class FakeTransitionResult(object):
@@ -81,8 +87,65 @@ class ConfigIdModelTestCase(TestCase):
         self.assertRaisesRegex(ValueError, 'Unknown or missing config type: BadType', ConfigId.from_xml, self.xml_root)
 
 
-class ECCServerModelTestCase(TestCase):
+@patch('attpcdaq.daq.models.SoapClient')
+class EccClientRegistryTestCase(TestCase):
     def setUp(self):
+        self.registry = EccClientRegistry()
+        self.url = 'http://123.45.67.8:8083/'
+        self.other_url = 'http://123.45.67.9:8083/'
+
+    def test_wsdl_is_parsed_once(self, mock_soap_client):
+        self.registry.get_service(self.url)
+        self.registry.get_service(self.other_url)
+        self.registry.get_service(self.url)
+
+        self.assertEqual(mock_soap_client.call_count, 1)
+        self.assertEqual(mock_soap_client.call_args[0], (EccClientRegistry.wsdl_path,))
+
+    def test_service_is_reused(self, mock_soap_client):
+        mock_soap_client.return_value.create_service.side_effect = lambda binding, url: object()
+
+        first = self.registry.get_service(self.url)
+        second = self.registry.get_service(self.url)
+        other = self.registry.get_service(self.other_url)
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(self.registry.hits, 1)
+        self.assertEqual(self.registry.misses, 2)
+
+    def test_evict(self, mock_soap_client):
+        mock_soap_client.return_value.create_service.side_effect = lambda binding, url: object()
+
+        first = self.registry.get_service(self.url)
+        self.registry.evict(self.url)
+        self.assertNotIn(self.url, self.registry)
+
+        second = self.registry.get_service(self.url)
+        self.assertIsNot(first, second)
+        self.assertEqual(self.registry.misses, 2)
+
+    def test_clear(self, mock_soap_client):
+        self.registry.get_service(self.url)
+        self.registry.get_service(self.url)
+        self.registry.clear()
+
+        self.assertEqual(len(self.registry), 0)
+        self.assertEqual(self.registry.hits, 0)
+        self.assertEqual(self.registry.misses, 0)
+
+    @override_settings(ECC_SOAP_TIMEOUT=12, ECC_SOAP_OPERATION_TIMEOUT=3)
+    def test_transport_has_timeouts(self, mock_soap_client):
+        self.registry.get_service(self.url)
+
+        transport = mock_soap_client.call_args[1]['transport']
+        self.assertEqual(transport.load_timeout, 12)
+        self.assertEqual(transport.operation_timeout, 3)
+
+
+class ECCServerModelTestCase(ClearCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
         self.name = 'ECC'
         self.ip_address = '123.45.67.8'
         self.port = '1234'
@@ -107,6 +170,19 @@ class ECCServerModelTestCase(TestCase):
         expected = 'http://{}:{}/'.format(self.ip_address, self.port)
         self.assertEqual(ecc_url, expected)
 
+    @patch('attpcdaq.daq.models.ecc_client_registry')
+    def test_changing_address_evicts_cached_client(self, mock_registry):
+        ecc_server = ECCServer.objects.get(pk=self.ecc_server.pk)
+        old_url = ecc_server.ecc_url
+
+        ecc_server.state = ECCServer.DESCRIBED
+        ecc_server.save()
+        mock_registry.evict.assert_not_called()
+
+        ecc_server.ip_address = '123.45.67.9'
+        ecc_server.save()
+        mock_registry.evict.assert_called_once_with(old_url)
+
     def test_config_paths(self):
         expected_root = '/Volumes/configs'
         expected = (
@@ -162,6 +238,77 @@ class ECCServerModelTestCase(TestCase):
 
         self.data_link_xml_test_impl()
 
+    def _add_data_sources(self, count):
+        for i in range(count):
+            router = DataRouter.objects.create(
+                name='DataRouter{:d}'.format(i),
+                ip_address='123.456.789.{:d}'.format(i),
+                experiment=self.experiment,
+            )
+            DataSource.objects.create(
+                name='CoBo[{:d}]'.format(i),
+                ecc_server=self.ecc_server,
+                data_router=router,
+            )
+
+    def test_get_data_link_xml_is_cached(self):
+        self._add_data_sources(10)
+
+        with self.assertNumQueries(1):
+            first = self.ecc_server.get_data_link_xml_from_clients()
+
+        with self.assertNumQueries(0):
+            second = self.ecc_server.get_data_link_xml_from_clients()
+
+        self.assertEqual(first, second)
+
+    def test_get_data_link_xml_invalidated_by_data_source(self):
+        self._add_data_sources(1)
+        self.ecc_server.get_data_link_xml_from_clients()
+
+        source = DataSource.objects.get()
+        source.name = 'CoBo[5]'
+        with run_on_commit_callbacks():
+            source.save()
+
+            # The old XML is kept until the transaction commits
+            root = ET.fromstring(self.ecc_server.get_data_link_xml_from_clients())
+            self.assertEqual(root.find('DataLink/DataSender').attrib['id'], 'CoBo[0]')
+
+        root = ET.fromstring(self.ecc_server.get_data_link_xml_from_clients())
+        self.assertEqual(root.find('DataLink/DataSender').attrib['id'], 'CoBo[5]')
+
+    def test_get_data_link_xml_invalidated_by_data_router(self):
+        self._add_data_sources(1)
+        self.ecc_server.get_data_link_xml_from_clients()
+
+        router = DataRouter.objects.get()
+        router.port = 1234
+        with run_on_commit_callbacks():
+            router.save()
+
+        root = ET.fromstring(self.ecc_server.get_data_link_xml_from_clients())
+        self.assertEqual(root.find('DataLink/DataRouter').attrib['port'], '1234')
+
+    @override_settings(ECC_DATA_LINK_CACHE_TTL=120)
+    def test_get_data_link_xml_cache_expires(self):
+        with patch('attpcdaq.daq.models.cache') as mock_cache:
+            mock_cache.get.return_value = None
+            self.ecc_server.get_data_link_xml_from_clients()
+
+        mock_cache.set.assert_called_once_with(self.ecc_server._data_link_cache_key(), ANY, 120)
+
+    def test_get_data_link_xml_kept_on_router_status_update(self):
+        self._add_data_sources(1)
+        self.ecc_server.get_data_link_xml_from_clients()
+
+        router = DataRouter.objects.get()
+        router.is_online = True
+        router.save(update_fields=['is_online'])
+
+        with self.assertNumQueries(0):
+            self.ecc_server.get_data_link_xml_from_clients()
+
     @patch('attpcdaq.daq.models.EccClient')
     def test_get_transition_too_many_steps(self, mock_client):
         mock_instance = mock_client()
@@ -246,6 +393,36 @@ class ECCServerModelTestCase(TestCase):
             msg='Removed config was still present in database.'
         )
 
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_configs_query_count(self, mock_client):
+        def make_xml(names):
+            configs = [ConfigId(describe=a, prepare=b, configure=c) for a, b, c in permutations(names, 3)]
+            return '<ConfigIdList>' + ''.join((c.as_xml() for c in configs)) + '</ConfigIdList>'
+
+        mock_inst = mock_client.return_value
+
+        # The number of queries shouldn't depend on the number of configs
+        query_counts = []
+        for names in (['A', 'B', 'C'], ['A', 'B', 'C', 'D', 'E']):
+            mock_inst.GetConfigIDs.return_value = FakeResponseText(text=make_xml(names))
+            self.ecc_server.refresh_configs()  # Create the configs
+
+            with CaptureQueriesContext(connection) as ctx:
+                self.ecc_server.refresh_configs()  # Find and update the existing configs
+            query_counts.append(len(ctx.captured_queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(self.ecc_server.configid_set.count(), 5 * 4 * 3)
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_configs_are_stale(self, mock_client):
+        cache.delete(self.ecc_server._config_list_cache_key())
+        mock_client.return_value.GetConfigIDs.return_value = FakeResponseText(text='<ConfigIdList></ConfigIdList>')
+
+        self.assertTrue(self.ecc_server.configs_are_stale)
+        self.ecc_server.refresh_configs()
+        self.assertFalse(self.ecc_server.configs_are_stale)
+
     def test_refresh_state(self):
         for (state, trans) in product(ECCServer.STATE_DICT.keys(), [False, True]):
             with patch('attpcdaq.daq.models.EccClient') as mock_client:
@@ -260,6 +437,167 @@ class ECCServerModelTestCase(TestCase):
             self.assertEqual(self.ecc_server.state, state)
             self.assertEqual(self.ecc_server.is_transitioning, trans)
 
+    def _add_ecc_servers(self, count):
+        for i in range(count):
+            ECCServer.objects.create(
+                name='ECC{}'.format(i),
+                ip_address='123.45.67.{}'.format(10 + i),
+                experiment=self.experiment,
+                state=ECCServer.IDLE,
+            )
+        return list(ECCServer.objects.filter(experiment=self.experiment).exclude(pk=self.ecc_server.pk))
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_state_many(self, mock_client):
+        ecc_servers = self._add_ecc_servers(5)
+        mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.READY, trans=True)
+
+        with self.assertNumQueries(1):
+            changed = ECCServer.refresh_state_many(ecc_servers, max_workers=3)
+
+        self.assertEqual(len(changed), len(ecc_servers))
+        for ecc in ECCServer.objects.filter(pk__in=[e.pk for e in ecc_servers]):
+            self.assertEqual(ecc.state, ECCServer.READY)
+            self.assertTrue(ecc.is_transitioning)
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_state_many_skips_unchanged(self, mock_client):
+        ecc_servers = self._add_ecc_servers(5)
+        mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.IDLE, trans=False)
+
+        with self.assertNumQueries(0):
+            changed = ECCServer.refresh_state_many(ecc_servers)
+
+        self.assertEqual(changed, [])
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_state_many_with_error(self, mock_client):
+        ecc_servers = self._add_ecc_servers(2)
+        bad_url = ecc_servers[0].ecc_url
+
+        def client_side_effect(url):
+            client = MagicMock()
+            if url == bad_url:
+                client.GetState.return_value = FakeResponseState(error_code=1, error_message='Failed')
+            else:
+                client.GetState.return_value = FakeResponseState(state=ECCServer.DESCRIBED)
+            return client
+
+        mock_client.side_effect = client_side_effect
+
+        with self.assertLogs(level=logging.ERROR):
+            changed = ECCServer.refresh_state_many(ecc_servers)
+
+        self.assertEqual(changed, [ecc_servers[1]])
+        self.assertEqual(ECCServer.objects.get(pk=ecc_servers[0].pk).state, ECCServer.IDLE)
+        self.assertEqual(ECCServer.objects.get(pk=ecc_servers[1].pk).state, ECCServer.DESCRIBED)
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_state_many_with_timeout(self, mock_client):
+        ecc_servers = self._add_ecc_servers(3)
+        hung_url = ecc_servers[0].ecc_url
+        release = threading.Event()
+
+        def client_side_effect(url):
+            client = MagicMock()
+            if url == hung_url:
+                client.GetState.side_effect = lambda: release.wait(5)
+            else:
+                client.GetState.return_value = FakeResponseState(state=ECCServer.DESCRIBED)
+            return client
+
+        mock_client.side_effect = client_side_effect
+
+        try:
+            with self.assertLogs(level=logging.ERROR):
+                changed = ECCServer.refresh_state_many(ecc_servers, timeout=0.5)
+        finally:
+            release.set()
+
+        # The servers that answered are written even though one didn't
+        self.assertCountEqual(changed, ecc_servers[1:])
+        self.assertEqual(ECCServer.objects.get(pk=ecc_servers[0].pk).state, ECCServer.IDLE)
+        for ecc in ecc_servers[1:]:
+            self.assertEqual(ECCServer.objects.get(pk=ecc.pk).state, ECCServer.DESCRIBED)
+
+    @patch('attpcdaq.daq.models.EccClient')
+    def test_refresh_state_many_writes_results_when_interrupted(self, mock_client):
+        ecc_servers = self._add_ecc_servers(2)
+        mock_client.return_value.GetState.return_value = FakeResponseState(state=ECCServer.DESCRIBED)
+
+        class Interrupted(Exception):
+            pass
+
+        # Stop waiting after the first result arrives, as a Celery soft time limit would
+        def interrupt_after_first(futures, timeout=None):
+            yield next(as_completed(futures, timeout=timeout))
+            raise Interrupted()
+
+        with patch('attpcdaq.daq.models.as_completed', new=interrupt_after_first):
+            with self.assertRaises(Interrupted):
+                ECCServer.refresh_state_many(ecc_servers)
+
+        states = ECCServer.objects.filter(pk__in=[ecc.pk for ecc in ecc_servers]).values_list('state', flat=True)
+        self.assertEqual(sorted(states), [ECCServer.IDLE, ECCServer.DESCRIBED])
+
+    @patch('attpcdaq.daq.models.ECCServer.change_state', autospec=True)
+    def test_change_state_many(self, mock_change_state):
+        ecc_servers = self._add_ecc_servers(5)
+
+        # One query to build the data link XML of all of the servers, and nothing in the threads
+        with self.assertNumQueries(1):
+            failures = ECCServer.change_state_many(ecc_servers, ECCServer.DESCRIBED, max_workers=3)
+
+        self.assertEqual(failures, {})
+        self.assertEqual(mock_change_state.call_count, len(ecc_servers))
+        for ecc in ecc_servers:
+            mock_change_state.assert_any_call(ecc, ECCServer.DESCRIBED)
+
+        # Now the XML is cached
+        ecc_servers = list(ECCServer.objects.filter(pk__in=[ecc.pk for ecc in ecc_servers]))
+        with self.assertNumQueries(0):
+            ECCServer.change_state_many(ecc_servers, ECCServer.DESCRIBED)
+
+    @patch('attpcdaq.daq.models.ECCServer.change_state', autospec=True)
+    def test_change_state_many_with_error(self, mock_change_state):
+        ecc_servers = self._add_ecc_servers(2)
+        ECCServer.objects.all().update(is_transitioning=True)
+
+        def change_state_side_effect(ecc, target_state):
+            if ecc.pk == ecc_servers[0].pk:
+                raise ECCError('Failed')
+
+        mock_change_state.side_effect = change_state_side_effect
+
+        with self.assertLogs(level=logging.ERROR):
+            failures = ECCServer.change_state_many(ecc_servers, ECCServer.DESCRIBED)
+
+        self.assertEqual(failures, {ecc_servers[0]: 'Failed'})
+        self.assertFalse(ECCServer.objects.get(pk=ecc_servers[0].pk).is_transitioning)
+        self.assertTrue(ECCServer.objects.get(pk=ecc_servers[1].pk).is_transitioning)
+
+    @patch('attpcdaq.daq.models.ECCServer.change_state', autospec=True)
+    def test_change_state_many_with_timeout(self, mock_change_state):
+        ecc_servers = self._add_ecc_servers(2)
+        ECCServer.objects.all().update(is_transitioning=True)
+        release = threading.Event()
+
+        def change_state_side_effect(ecc, target_state):
+            if ecc.pk == ecc_servers[0].pk:
+                release.wait(5)
+
+        mock_change_state.side_effect = change_state_side_effect
+
+        try:
+            with self.assertLogs(level=logging.ERROR):
+                failures = ECCServer.change_state_many(ecc_servers, ECCServer.DESCRIBED, timeout=0.5)
+        finally:
+            release.set()
+
+        self.assertEqual(list(failures), [ecc_servers[0]])
+        self.assertFalse(ECCServer.objects.get(pk=ecc_servers[0].pk).is_transitioning)
+        self.assertTrue(ECCServer.objects.get(pk=ecc_servers[1].pk).is_transitioning)
+
     def _transition_test_helper(self, trans_func_name, initial_state, final_state,
                                 error_code=0, error_msg=""):
         with patch('attpcdaq.daq.models.EccClient') as mock_client:
@@ -477,6 +815,84 @@ class ExperimentModelTestCase(TestCase):
         run0 = self._create_run()
         self.assertRaisesRegex(RuntimeError, 'Not running', self.experiment.stop_run)
 
+    def test_current_run_updated_when_run_created(self):
+        run0 = self._create_run()
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.current_run, run0)
+        self.assertEqual(self.experiment.run_counter, run0.run_number + 1)
+
+    def test_current_run_updated_when_run_deleted(self):
+        run0 = self._create_run()
+        run1 = RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=1,
+            start_datetime=datetime(2016, 1, 2, 0, 0, 0),
+        )
+        run1.delete()
+
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.current_run, run0)
+        self.assertEqual(self.experiment.next_run_number, 1)
+
+        run0.delete()
+        self.experiment.refresh_from_db()
+        self.assertIsNone(self.experiment.current_run)
+        self.assertEqual(self.experiment.next_run_number, 0)
+
+    def test_older_run_created(self):
+        run0 = self._create_run()
+        RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=5,
+            start_datetime=datetime(2015, 1, 1, 0, 0, 0),
+        )
+
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.current_run, run0)
+
+    def test_current_run_updated_when_run_moved(self):
+        run0 = self._create_run()
+        run1 = RunMetadata.objects.create(
+            experiment=self.experiment,
+            run_number=1,
+            start_datetime=datetime(2016, 1, 2, 0, 0, 0),
+        )
+
+        run0 = RunMetadata.objects.get(pk=run0.pk)
+        run0.run_number = 2
+        run0.start_datetime = datetime(2016, 1, 3, 0, 0, 0)
+        run0.save()
+
+        self.experiment.refresh_from_db()
+        self.assertEqual(self.experiment.current_run, run0)
+        self.assertEqual(self.experiment.run_counter, 3)
+        self.assertNotEqual(self.experiment.current_run, run1)
+
+    def test_editing_run_does_not_update_experiment(self):
+        run0 = RunMetadata.objects.get(pk=self._create_run().pk)
+        run0.title = 'New title'
+        with self.assertNumQueries(1):
+            run0.save()
+
+    def test_start_run_sets_current_run(self):
+        self._create_run()
+        self.experiment.start_run()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.experiment.next_run_number, 2)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.experiment.latest_run.run_number, 1)
+            self.assertTrue(self.experiment.is_running)
+
+    def test_stop_run_with_stale_instance(self):
+        self.experiment.start_run()
+
+        other = Experiment.objects.get(pk=self.experiment.pk)
+        other.stop_run()
+
+        self.assertRaisesRegex(RuntimeError, 'Not running', self.experiment.stop_run)
+
     def test_change_active_experiment(self):
         self.experiment.is_active = True
         self.experiment.save()
@@ -563,10 +979,12 @@ class MeasurementModelTestCase(TestCase):
         else:
             measurement.value = value
 
-        if value is None:
-            self.assertIsNone(measurement.serialized_value)
-        else:
-            self.assertEqual(measurement.serialized_value, str(value))
+        value_field = Measurement.VALUE_FIELDS[obs_type]
+        for field_name in Measurement.VALUE_FIELDS.values():
+            if field_name == value_field:
+                self.assertEqual(getattr(measurement, field_name), value)
+            else:
+                self.assertIsNone(getattr(measurement, field_name))
 
         unpacked_value = measurement.value
         if value is None:
@@ -587,6 +1005,75 @@ class MeasurementModelTestCase(TestCase):
         for value_type in (x[0] for x in Observable.value_type_choices):
             self._serialization_test_impl(value_type, None)
 
+    def test_value_does_not_fetch_observable(self):
+        observable = Observable.objects.create(name='Test observable', value_type=Observable.FLOAT,
+                                               experiment=self.experiment)
+        Measurement.objects.create(run_metadata=self.run, observable=observable, value=4.5)
+
+        measurement = Measurement.objects.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(measurement.value, 4.5)
+
+    def test_observable_statistics(self):
+        observable = Observable.objects.create(name='Test observable', value_type=Observable.INTEGER,
+                                               experiment=self.experiment)
+        for i, value in enumerate((2, 4, None, 9)):
+            run = RunMetadata.objects.create(run_number=i + 1, experiment=self.experiment)
+            Measurement.objects.create(run_metadata=run, observable=observable, value=value)
+
+        stats = observable.statistics()
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['min'], 2)
+        self.assertEqual(stats['max'], 9)
+        self.assertAlmostEqual(stats['mean'], 5)
+
+    def _add_measurements(self, observable, values):
+        for i, value in enumerate(values):
+            run = RunMetadata.objects.create(run_number=i + 1, experiment=self.experiment)
+            Measurement.objects.create(run_metadata=run, observable=observable, value=value)
+
+    def _values(self, observable):
+        measurements = Measurement.objects.filter(observable=observable).order_by('run_metadata__run_number')
+        return [m.value for m in measurements]
+
+    def test_changing_value_type_converts_measurements(self):
+        observable = Observable.objects.create(name='Test observable', value_type=Observable.STRING,
+                                               experiment=self.experiment)
+        self._add_measurements(observable, ['2', '4.0', None])
+
+        observable = Observable.objects.get(pk=observable.pk)
+        observable.value_type = Observable.FLOAT
+        observable.save()
+
+        self.assertEqual(self._values(observable), [2.0, 4.0, None])
+        self.assertEqual(observable.statistics()['count'], 2)
+        self.assertFalse(Measurement.objects.filter(observable=observable, string_value__isnull=False).exists())
+
+    def test_unconvertible_values_kept_as_strings(self):
+        observable = Observable.objects.create(name='Test observable', value_type=Observable.FLOAT,
+                                               experiment=self.experiment)
+        self._add_measurements(observable, [2.0, 4.5])
+
+        observable = Observable.objects.get(pk=observable.pk)
+        observable.value_type = Observable.INTEGER
+        with self.assertLogs('attpcdaq.daq.models', level=logging.WARNING) as cm:
+            observable.save()
+
+        self.assertRegex(cm.output[0], r'1 measurements of Test observable could not be converted to Integer')
+        self.assertEqual(self._values(observable), [2, '4.5'])
+
+    def test_saving_without_type_change_does_not_touch_measurements(self):
+        observable = Observable.objects.create(name='Test observable', value_type=Observable.INTEGER,
+                                               experiment=self.experiment)
+        self._add_measurements(observable, [2])
+
+        observable = Observable.objects.get(pk=observable.pk)
+        observable.units = 'm'
+        with CaptureQueriesContext(connection) as context:
+            observable.save()
+
+        self.assertFalse([q for q in context.captured_queries if '"daq_measurement"' in q['sql']])
+
     def test_fails_when_type_mismatch(self):
         self._serialization_test_impl(Observable.FLOAT, 'string')
         self._serialization_test_impl(Observable.STRING, 4)
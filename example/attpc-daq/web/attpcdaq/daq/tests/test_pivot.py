@@ -0,0 +1,84 @@
+from django.test import TestCase
+
+from ..pivot import build_measurement_pivot, get_measurement_pivot, filter_pivot
+from ..models import Experiment, RunMetadata, Observable, Measurement
+from .utilities import run_on_commit_callbacks, ClearCacheMixin
+
+
+class MeasurementPivotTestCase(ClearCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.experiment = Experiment.objects.create(name='Test')
+        self.energy = Observable.objects.create(name='Energy', units='MeV', value_type=Observable.FLOAT,
+                                                experiment=self.experiment, order=1)
+        self.target = Observable.objects.create(name='Target', value_type=Observable.STRING,
+                                                experiment=self.experiment, order=0)
+
+        self.runs = {}
+        for run_number in (3, 1, 2):
+            run = RunMetadata.objects.create(run_number=run_number, experiment=self.experiment)
+            Measurement.objects.create(run_metadata=run, observable=self.energy,
+                                       value=run_number * 2.5)
+            self.runs[run_number] = run
+
+        Measurement.objects.create(run_metadata=self.runs[2], observable=self.target, value='CH4')
+
+    def test_build(self):
+        with self.assertNumQueries(3):
+            pivot = build_measurement_pivot(self.experiment)
+
+        self.assertEqual(pivot['run_numbers'], [1, 2, 3])
+        self.assertEqual([obs['name'] for obs in pivot['observables']], ['Target', 'Energy'])
+        self.assertEqual(pivot['observables'][0]['values'], [None, 'CH4', None])
+        self.assertEqual(pivot['observables'][1]['values'], [2.5, 5.0, 7.5])
+        self.assertEqual(pivot['observables'][1]['units'], 'MeV')
+
+    def test_excludes_other_experiments(self):
+        other = Experiment.objects.create(name='Other')
+        RunMetadata.objects.create(run_number=10, experiment=other)
+        Observable.objects.create(name='Other', value_type=Observable.INTEGER, experiment=other)
+
+        pivot = build_measurement_pivot(self.experiment)
+        self.assertEqual(pivot['run_numbers'], [1, 2, 3])
+        self.assertEqual(len(pivot['observables']), 2)
+
+    def test_cached(self):
+        get_measurement_pivot(self.experiment)
+        with self.assertNumQueries(0):
+            get_measurement_pivot(self.experiment)
+
+    def test_measurement_save_invalidates(self):
+        get_measurement_pivot(self.experiment)
+
+        measurement = Measurement.objects.get(run_metadata=self.runs[1], observable=self.energy)
+        measurement.value = 100.0
+        with run_on_commit_callbacks():
+            measurement.save()
+
+        pivot = get_measurement_pivot(self.experiment)
+        self.assertEqual(pivot['observables'][1]['values'][0], 100.0)
+
+    def test_invalidated_after_commit(self):
+        get_measurement_pivot(self.experiment)
+
+        measurement = Measurement.objects.get(run_metadata=self.runs[1], observable=self.energy)
+        measurement.value = 100.0
+        with run_on_commit_callbacks():
+            measurement.save()
+            pivot = get_measurement_pivot(self.experiment)
+            self.assertEqual(pivot['observables'][1]['values'][0], 2.5)  # not until the transaction commits
+
+    def test_filter(self):
+        pivot = build_measurement_pivot(self.experiment)
+
+        result = filter_pivot(pivot, run_min=2, observable_pks=[self.energy.pk])
+        self.assertEqual(result['run_numbers'], [2, 3])
+        self.assertEqual([obs['name'] for obs in result['observables']], ['Energy'])
+        self.assertEqual(result['observables'][0]['values'], [5.0, 7.5])
+
+        result = filter_pivot(pivot, run_max=1)
+        self.assertEqual(result['run_numbers'], [1])
+        self.assertEqual(len(result['observables']), 2)
+
+        # The original isn't changed
+        self.assertEqual(pivot['run_numbers'], [1, 2, 3])
@@ -0,0 +1,83 @@
+from django.test import TestCase
+from django.core.cache import cache
+from datetime import datetime, timedelta
+import pickle
+
+from ..models import ECCServer
+from ..schedules import AdaptiveSchedule, mark_busy, record_activity, get_activity, BUSY, ACTIVE, IDLE
+from ..schedules import BUSY_KEY, ACTIVITY_KEY
+
+
+class ActivityLevelTestCase(TestCase):
+    def setUp(self):
+        cache.delete_many([BUSY_KEY, ACTIVITY_KEY])
+
+    def test_default_is_active(self):
+        self.assertEqual(get_activity(), ACTIVE)
+
+    def test_mark_busy(self):
+        mark_busy()
+        self.assertEqual(get_activity(), BUSY)
+
+    def test_busy_expires(self):
+        mark_busy(duration=-1)
+        self.assertEqual(get_activity(), ACTIVE)
+
+    def test_record_idle(self):
+        record_activity([ECCServer(state=ECCServer.IDLE), ECCServer(state=ECCServer.IDLE)])
+        self.assertEqual(get_activity(), IDLE)
+
+    def test_record_without_servers(self):
+        record_activity([])
+        self.assertEqual(get_activity(), IDLE)
+
+    def test_record_active(self):
+        record_activity([ECCServer(state=ECCServer.IDLE), ECCServer(state=ECCServer.READY)])
+        self.assertEqual(get_activity(), ACTIVE)
+
+    def test_record_transitioning(self):
+        record_activity([ECCServer(state=ECCServer.IDLE, is_transitioning=True)])
+        self.assertEqual(get_activity(), BUSY)
+
+
+class AdaptiveScheduleTestCase(TestCase):
+    def setUp(self):
+        cache.delete_many([BUSY_KEY, ACTIVITY_KEY])
+        self.now = datetime(2017, 1, 1, 12, 0, 0)
+        self.schedule = AdaptiveSchedule(busy=0.5, active=5, idle=60, jitter=0, check_interval=2,
+                                         nowfun=lambda: self.now)
+
+    def test_intervals(self):
+        self.assertEqual(self.schedule.current_interval(), timedelta(seconds=5))
+
+        mark_busy()
+        self.assertEqual(self.schedule.current_interval(), timedelta(seconds=0.5))
+
+        cache.delete(BUSY_KEY)
+        record_activity([])
+        self.assertEqual(self.schedule.current_interval(), timedelta(seconds=60))
+
+    def test_not_due_while_idle(self):
+        record_activity([])
+        is_due, next_check = self.schedule.is_due(self.now - timedelta(seconds=10))
+        self.assertFalse(is_due)
+        self.assertEqual(next_check, 2)  # Checks the activity level again soon
+
+    def test_due_when_busy(self):
+        record_activity([])
+        mark_busy()
+        is_due, next_check = self.schedule.is_due(self.now - timedelta(seconds=1))
+        self.assertTrue(is_due)
+        self.assertEqual(next_check, 0.5)
+
+    def test_jitter(self):
+        schedule = AdaptiveSchedule(busy=1, active=10, idle=100, jitter=0.2)
+        for i in range(20):
+            schedule.is_due(datetime(2000, 1, 1))
+            self.assertGreaterEqual(schedule.current_interval(), timedelta(seconds=8))
+            self.assertLessEqual(schedule.current_interval(), timedelta(seconds=12))
+
+    def test_pickle(self):
+        schedule = AdaptiveSchedule(busy=1, active=10, idle=100, jitter=0.2, check_interval=3)
+        self.assertEqual(pickle.loads(pickle.dumps(schedule)), schedule)
+        self.assertNotEqual(schedule, AdaptiveSchedule(busy=1, active=10, idle=200))
@@ -0,0 +1,135 @@
+from django.test import TestCase
+from django.core.cache import cache
+from unittest.mock import patch, MagicMock
+import threading
+import time
+
+from ..statuscache import get_status_version, bump_status_version, STATUS_VERSION_KEY, STATUS_EXCHANGE
+from ..statuscache import StatusWatcher
+from ..models import Experiment, ECCServer
+from .utilities import run_on_commit_callbacks
+
+
+class StatusVersionTestCase(TestCase):
+    def setUp(self):
+        cache.delete(STATUS_VERSION_KEY)
+
+    def test_version_is_stable(self):
+        self.assertEqual(get_status_version(), get_status_version())
+
+    def test_bump(self):
+        version = get_status_version()
+        new_version = bump_status_version()
+        self.assertEqual(new_version, version + 1)
+        self.assertEqual(get_status_version(), new_version)
+
+    def test_bump_without_version(self):
+        new_version = bump_status_version()
+        self.assertEqual(get_status_version(), new_version)
+
+    def test_saving_bumps_version(self):
+        experiment = Experiment.objects.create(name='Test')
+        version = get_status_version()
+
+        with run_on_commit_callbacks():
+            ECCServer.objects.create(name='ECC', ip_address='123.123.123.123', experiment=experiment)
+            self.assertEqual(get_status_version(), version)  # not until the transaction commits
+
+        self.assertGreater(get_status_version(), version)
+
+
+class StatusWatcherTestCase(TestCase):
+    def setUp(self):
+        cache.delete(STATUS_VERSION_KEY)
+        self.watcher = StatusWatcher(check_interval=0.05)
+        self.addCleanup(self.watcher.stop)
+
+    def test_wait_times_out(self):
+        self.watcher.notify(10)
+        self.assertEqual(self.watcher.wait_for_change(10, timeout=0.01), 10)
+
+    def test_newer_version_returned_at_once(self):
+        self.watcher.notify(11)
+        self.assertEqual(self.watcher.wait_for_change(10, timeout=5), 11)
+
+    def test_old_versions_ignored(self):
+        self.watcher.notify(11)
+        self.watcher.notify(10)
+        self.assertEqual(self.watcher.wait_for_change(10, timeout=0), 11)
+
+    def test_notify_wakes_waiter(self):
+        self.watcher.notify(10)
+        timer = threading.Timer(0.1, self.watcher.notify, args=(11,))
+        timer.start()
+
+        start = time.monotonic()
+        version = self.watcher.wait_for_change(10, timeout=5)
+        timer.join()
+
+        self.assertEqual(version, 11)
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_bump_notifies(self):
+        with patch('attpcdaq.daq.statuscache.status_watcher', self.watcher):
+            version = get_status_version()
+            self.assertEqual(self.watcher.wait_for_change(version, timeout=0), version)
+
+            new_version = bump_status_version()
+            self.assertEqual(self.watcher.wait_for_change(version, timeout=0), new_version)
+
+    def test_thread_reads_version_from_cache(self):
+        # As if another process had bumped the version while the broker can't be reached
+        version = get_status_version()
+        cache.incr(STATUS_VERSION_KEY)
+
+        self.watcher.subscribe()
+        self.assertEqual(self.watcher.wait_for_change(version, timeout=5), version + 1)
+        self.watcher.unsubscribe()
+
+    def test_thread_stops_after_last_unsubscribe(self):
+        self.watcher.subscribe()
+        self.watcher.subscribe()
+        thread = self.watcher._thread
+
+        self.watcher.unsubscribe()
+        self.assertTrue(self.watcher.is_running)
+
+        self.watcher.unsubscribe()
+        self.assertFalse(self.watcher.is_running)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_message_notifies(self):
+        self.watcher.notify(10)
+        self.watcher._on_message({'version': 12}, MagicMock())
+        self.assertEqual(self.watcher.wait_for_change(10, timeout=0), 12)
+
+
+@patch('attpcdaq.daq.statuscache.current_app')
+class StatusBroadcastTestCase(TestCase):
+    def setUp(self):
+        cache.delete(STATUS_VERSION_KEY)
+
+    def test_not_broadcast_when_disabled(self, mock_app):
+        with self.settings(STATUS_BROADCAST_ENABLED=False):
+            bump_status_version()
+        mock_app.producer_or_acquire.assert_not_called()
+
+    def test_broadcast(self, mock_app):
+        producer = mock_app.producer_or_acquire.return_value.__enter__.return_value
+
+        with self.settings(STATUS_BROADCAST_ENABLED=True):
+            version = bump_status_version()
+
+        producer.publish.assert_called_once()
+        args, kwargs = producer.publish.call_args
+        self.assertEqual(args[0], {'version': version})
+        self.assertEqual(kwargs['exchange'], STATUS_EXCHANGE)
+
+    def test_broadcast_failure_ignored(self, mock_app):
+        mock_app.producer_or_acquire.side_effect = ConnectionRefusedError()
+
+        with self.settings(STATUS_BROADCAST_ENABLED=True), self.assertLogs('attpcdaq.daq.statuscache', 'WARNING'):
+            version = bump_status_version()
+
+        self.assertEqual(get_status_version(), version)
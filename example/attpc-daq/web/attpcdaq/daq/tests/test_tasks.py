@@ -1,6 +1,7 @@
 """Unit tests for Celery tasks"""
 
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.core.cache import cache
 from unittest.mock import patch, MagicMock, call
 import logging
 from celery.exceptions import SoftTimeLimitExceeded
@@ -8,8 +9,12 @@ from celery.exceptions import SoftTimeLimitExceeded
 from ..tasks import organize_files_task, eccserver_refresh_state_task, eccserver_change_state_task
 from ..tasks import check_ecc_server_online_task, check_data_router_status_task, organize_files_all_task
 from ..tasks import eccserver_refresh_all_task, check_ecc_server_online_all_task, check_data_router_status_all_task
-from ..tasks import backup_config_files_task, backup_config_files_all_task
+from ..tasks import eccserver_refresh_all_batched_task, eccserver_change_state_all_task, eccserver_transition_all_task
+from ..tasks import backup_config_files_task, backup_config_files_all_task, eccserver_refresh_configs_task
+from ..tasks import REFRESH_LOCK_KEY, ROUND_LOCK_KEY, STATUS_CHECK_SLOT_KEY
 from ..models import ECCServer, DataRouter, ConfigId, Experiment, RunMetadata
+from ..workertasks import ProbeResult
+from ..schedules import get_activity, BUSY_KEY, ACTIVITY_KEY, IDLE, ACTIVE
 
 
 class TaskTestCaseBase(TestCase):
@@ -199,8 +204,47 @@ class EccServerRefreshStateTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
             self.call_task(self.ecc.pk + 10)
 
 
-class EccServerRefreshAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin,
-                                      TestOkWithoutActiveExperimentMixin, AllTaskTestCaseBase):
+class EccServerRefreshConfigsTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+
+        self.ecc = ECCServer.objects.create(
+            name='ECC',
+            ip_address='123.123.123.123',
+            experiment=self.experiment,
+        )
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.ECCServer.refresh_configs'
+
+    def call_task(self, pk=None):
+        if pk is None:
+            pk = self.ecc.pk
+        eccserver_refresh_configs_task(pk)
+
+    def test_refresh_configs(self):
+        """Test that the task works."""
+        self.call_task()
+        self.get_callable().assert_called_once_with()
+
+    def test_with_invalid_ecc_pk(self):
+        """Test that the task logs an error if the pk is invalid."""
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task(self.ecc.pk + 10)
+
+
+class EccServerRefreshAllTaskTestCase(TestCase):
+    @patch('attpcdaq.daq.tasks.eccserver_refresh_all_batched_task')
+    def test_runs_batched_task(self, mock_batched):
+        eccserver_refresh_all_task()
+        mock_batched.assert_called_once_with()
+
+
+class EccServerRefreshAllBatchedTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
     def setUp(self):
         super().setUp()
 
@@ -226,13 +270,41 @@ class EccServerRefreshAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForA
         )
 
     def get_patch_target(self):
-        return 'attpcdaq.daq.tasks.eccserver_refresh_state_task'
+        return 'attpcdaq.daq.tasks.ECCServer.refresh_state_many'
 
     def call_task(self):
-        return eccserver_refresh_all_task()
+        return eccserver_refresh_all_batched_task()
 
-    def get_queryset(self):
-        return ECCServer.objects.filter(experiment=self.experiment)
+    def test_refreshes_servers_in_active_experiment(self):
+        """Test that only the servers for the active experiment are refreshed, in one call."""
+        self.call_task()
+        self.assertEqual(self.get_callable().call_count, 1)
+
+        refreshed = list(self.get_callable().call_args[0][0])
+        self.assertEqual(refreshed, list(ECCServer.objects.filter(experiment=self.experiment)))
+
+    def test_records_activity(self):
+        """Test that the activity level used by the adaptive schedules is updated."""
+        cache.delete_many([BUSY_KEY, ACTIVITY_KEY])
+        self.call_task()
+        self.assertEqual(get_activity(), IDLE)
+
+        ECCServer.objects.filter(experiment=self.experiment).update(state=ECCServer.READY)
+        self.call_task()
+        self.assertEqual(get_activity(), ACTIVE)
+
+    def test_skipped_while_running(self):
+        """Test that the task does nothing if the last run of it hasn't finished."""
+        cache.add(REFRESH_LOCK_KEY, True)
+        self.addCleanup(cache.delete, REFRESH_LOCK_KEY)
+
+        self.call_task()
+        self.get_callable().assert_not_called()
+
+    def test_releases_lock(self):
+        self.call_task()
+        self.call_task()
+        self.assertEqual(self.get_callable().call_count, 2)
 
 
 class EccServerChangeStateTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
@@ -270,6 +342,166 @@ class EccServerChangeStateTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseB
             self.call_task(self.ecc.pk + 10)
 
 
+class EccServerChangeStateAllTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+        self.other_experiment = Experiment.objects.create(
+            name='Other',
+        )
+
+        self.ecc_servers = [ECCServer.objects.create(
+            name='ECC{}'.format(i),
+            ip_address='123.123.123.123',
+            experiment=self.experiment,
+        ) for i in range(3)]
+        self.other_ecc = ECCServer.objects.create(
+            name='Other ECC',
+            ip_address='123.123.123.123',
+            experiment=self.other_experiment,
+        )
+        self.target_state = ECCServer.DESCRIBED
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.ECCServer.change_state_many'
+
+    def call_task(self):
+        eccserver_change_state_all_task(self.experiment.pk, self.target_state)
+
+    def test_change_state(self):
+        """Test that the servers in the experiment are transitioned and the result is logged."""
+        self.set_mock_effect({})
+
+        with self.assertLogs(level=logging.INFO) as cm:
+            self.call_task()
+
+        ecc_servers, target_state = self.get_callable().call_args[0]
+        self.assertEqual(set(ecc_servers), set(self.ecc_servers))
+        self.assertEqual(target_state, self.target_state)
+        self.assertRegex(cm.output[-1], r'All ECC servers accepted the transition to Described')
+
+    def test_failures_are_logged(self):
+        """Test that the failed servers are listed in an error message."""
+        self.set_mock_effect({self.ecc_servers[1]: 'Failed'})
+
+        with self.assertLogs(level=logging.ERROR) as cm:
+            self.call_task()
+
+        self.assertEqual(len(cm.output), 1)
+        self.assertRegex(cm.output[0], r'failed for 1 ECC server\(s\): ECC1')
+
+
+class EccServerTransitionAllTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
+    def setUp(self):
+        super().setUp()
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+        self.selected_config = ConfigId.objects.create(
+            describe='describe',
+            prepare='prepare',
+            configure='configure',
+        )
+        self.ecc_servers = [ECCServer.objects.create(
+            name='ECC{}'.format(i),
+            ip_address='123.123.123.123',
+            experiment=self.experiment,
+            selected_config=self.selected_config,
+        ) for i in range(2)]
+        self.target_state = ECCServer.RUNNING
+
+    def get_patch_target(self):
+        return 'attpcdaq.daq.tasks.SystemTransition'
+
+    def get_callable(self):
+        return self.mock.return_value.run
+
+    def call_task(self):
+        self.mock.return_value.ecc_servers = self.ecc_servers
+        self.mock.return_value.errors = {}
+        return eccserver_transition_all_task(self.experiment.pk, self.target_state)
+
+    def test_success(self):
+        for ecc in self.ecc_servers:
+            ecc.state = self.target_state
+        self.set_mock_effect({})
+
+        with self.assertLogs(level=logging.INFO) as cm:
+            report = self.call_task()
+
+        self.assertRegex(cm.output[-1], r'All ECC servers reached Running')
+        self.assertTrue(report['success'])
+        self.assertEqual(report['target_state'], self.target_state)
+        self.assertEqual([s['error'] for s in report['servers']], [None, None])
+
+        ecc_servers, target_state = self.mock.call_args[0]
+        self.assertEqual(set(ecc_servers), set(self.ecc_servers))
+        self.assertEqual(target_state, self.target_state)
+
+    def test_failure_report(self):
+        self.set_mock_effect({self.ecc_servers[1]: 'Transition rejected'})
+
+        with self.assertLogs(level=logging.ERROR) as cm:
+            report = self.call_task()
+
+        self.assertRegex(cm.output[0], r'ECC1: Transition rejected')
+        self.assertFalse(report['success'])
+        self.assertEqual(report['servers'][1], {
+            'pk': self.ecc_servers[1].pk,
+            'name': 'ECC1',
+            'state': ECCServer.IDLE,
+            'error': 'Transition rejected',
+        })
+
+    def test_starts_run_on_success(self):
+        for ecc in self.ecc_servers:
+            ecc.state = self.target_state
+        self.set_mock_effect({})
+
+        self.call_task()
+
+        self.assertTrue(self.experiment.is_running)
+
+    def test_run_not_started_on_failure(self):
+        self.set_mock_effect({self.ecc_servers[1]: 'Transition rejected'})
+
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task()
+
+        self.assertFalse(self.experiment.is_running)
+
+    @patch('attpcdaq.daq.tasks.backup_config_files_all_task.delay')
+    @patch('attpcdaq.daq.tasks.organize_files_all_task.delay')
+    def test_stops_run_on_success(self, mock_organize, mock_backup):
+        self.experiment.start_run()
+        self.target_state = ECCServer.READY
+        for ecc in self.ecc_servers:
+            ecc.state = self.target_state
+        self.set_mock_effect({})
+
+        self.call_task()
+
+        self.assertFalse(self.experiment.is_running)
+        mock_organize.assert_called_once_with(self.experiment.pk, self.experiment.latest_run.pk)
+        mock_backup.assert_called_once_with(self.experiment.pk, self.experiment.latest_run.pk)
+
+    @patch('attpcdaq.daq.tasks.organize_files_all_task.delay')
+    def test_run_not_stopped_on_failure(self, mock_organize):
+        self.experiment.start_run()
+        self.target_state = ECCServer.READY
+        self.set_mock_effect({self.ecc_servers[1]: 'Transition rejected'})
+
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task()
+
+        self.assertTrue(self.experiment.is_running)
+        mock_organize.assert_not_called()
+
+
 class CheckEccServerOnlineTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
     def setUp(self):
         super().setUp()
@@ -290,16 +522,35 @@ class CheckEccServerOnlineTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseB
         return 'attpcdaq.daq.tasks.WorkerInterface'
 
     def get_callable(self):
-        return self.mock.return_value.__enter__.return_value.check_ecc_server_status
+        return self.mock.return_value.__enter__.return_value.probe
 
     def call_task(self, pk=None):
         if pk is None:
             pk = self.ecc.pk
         check_ecc_server_online_task(pk)
 
+    @override_settings(STATUS_POLL_MAX_CONCURRENCY=1)
+    def test_skipped_when_no_slot_is_free(self):
+        """Test that the check is skipped if too many checks are already running."""
+        cache.add(STATUS_CHECK_SLOT_KEY.format(0), True)
+        self.addCleanup(cache.delete, STATUS_CHECK_SLOT_KEY.format(0))
+
+        self.call_task()
+        self.get_callable().assert_not_called()
+
+    @override_settings(STATUS_POLL_MAX_CONCURRENCY=1)
+    def test_releases_slot(self):
+        self.set_mock_effect(ProbeResult(ecc_server_running=True, data_router_running=False, data_router_pid=None,
+                                         data_router_cwd=None, graw_count=0, graw_total_size=0))
+        self.call_task()
+        self.call_task()
+
+        self.assertEqual(self.get_callable().call_count, 2)
+
     def test_check_ecc_server_online(self):
         """Test that the task works."""
-        self.set_mock_effect(True)
+        self.set_mock_effect(ProbeResult(ecc_server_running=True, data_router_running=False, data_router_pid=None,
+                                         data_router_cwd=None, graw_count=0, graw_total_size=0))
 
         self.call_task()
         self.get_callable().assert_called_once_with()
@@ -307,6 +558,16 @@ class CheckEccServerOnlineTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseB
         self.ecc.refresh_from_db()
         self.assertTrue(self.ecc.is_online)
 
+    def test_unchanged_status_not_saved(self):
+        """Test that the ECC server is not saved again if it's still offline."""
+        self.set_mock_effect(ProbeResult(ecc_server_running=False, data_router_running=False, data_router_pid=None,
+                                         data_router_cwd=None, graw_count=0, graw_total_size=0))
+
+        with patch('attpcdaq.daq.tasks.ECCServer.save') as mock_save:
+            self.call_task()
+
+        mock_save.assert_not_called()
+
     def test_with_invalid_ecc_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
@@ -340,6 +601,8 @@ class CheckEccServerOnlineAllTaskTestCase(ExceptionHandlingTestMixin, TestCalled
             experiment=self.other_experiment,
         )
 
+        cache.delete(ROUND_LOCK_KEY.format('check_ecc_server_online'))
+
     def get_patch_target(self):
         return 'attpcdaq.daq.tasks.check_ecc_server_online_task'
 
@@ -349,6 +612,22 @@ class CheckEccServerOnlineAllTaskTestCase(ExceptionHandlingTestMixin, TestCalled
     def get_queryset(self):
         return ECCServer.objects.filter(experiment=self.experiment)
 
+    @override_settings(STATUS_POLL_MAX_CONCURRENCY=4, STATUS_POLL_WAVE_INTERVAL=2, STATUS_POLL_JITTER=0)
+    def test_subtasks_spread_out(self):
+        """Test that only a few subtasks are started at the same time."""
+        self.call_task()
+
+        countdowns = [c[1]['countdown'] for c in self.get_callable('subtask').return_value.set.call_args_list]
+        self.assertEqual(countdowns, [0, 0, 0, 0, 2, 2, 2, 2, 4, 4])
+
+    @override_settings(STATUS_POLL_MAX_CONCURRENCY=4, STATUS_POLL_WAVE_INTERVAL=2, STATUS_POLL_JITTER=0)
+    def test_rounds_do_not_overlap(self):
+        """Test that a round is skipped if the last one is still being started."""
+        self.call_task()
+        self.call_task()
+
+        self.assertEqual(self.get_callable('group').return_value.call_count, 1)
+
 
 class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
     def setUp(self):
@@ -367,14 +646,18 @@ class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
     def get_patch_target(self):
         return 'attpcdaq.daq.tasks.WorkerInterface'
 
-    def get_callable(self, which='status'):
-        cm = self.mock.return_value.__enter__.return_value
-        if which == 'status':
-            return cm.check_data_router_status
-        elif which == 'clean':
-            return cm.working_dir_is_clean
-        else:
-            raise ValueError('Unknown method {} requested'.format(which))
+    def get_callable(self):
+        return self.mock.return_value.__enter__.return_value.probe
+
+    def make_probe_result(self, is_running=True, graw_count=0, cwd='/path/to/router'):
+        return ProbeResult(
+            ecc_server_running=False,
+            data_router_running=is_running,
+            data_router_pid=1234 if is_running else None,
+            data_router_cwd=cwd if is_running else None,
+            graw_count=graw_count,
+            graw_total_size=graw_count * 100,
+        )
 
     def call_task(self, pk=None):
         if pk is None:
@@ -387,32 +670,60 @@ class CheckDataRouterStatusTaskTestCase(ExceptionHandlingTestMixin, TaskTestCase
         self.data_router.staging_directory_is_clean = False
         self.data_router.save()
 
-        self.set_mock_effect(True, which='status')
-        self.set_mock_effect(True, which='clean')
+        self.set_mock_effect(self.make_probe_result())
 
         self.call_task()
 
         self.mock.assert_called_once_with(self.data_router.ip_address)
-        self.get_callable(which='status').assert_called_once_with()
-        self.get_callable(which='clean').assert_called_once_with()
+        self.get_callable().assert_called_once_with()
 
         self.data_router.refresh_from_db()
         self.assertTrue(self.data_router.is_online)
         self.assertTrue(self.data_router.staging_directory_is_clean)
+        self.assertEqual(self.data_router.pid, 1234)
+        self.assertEqual(self.data_router.working_directory, '/path/to/router')
+
+    def test_staging_directory_not_clean(self):
+        """Test that the staging directory is marked as not clean if there are GRAW files in it."""
+        self.set_mock_effect(self.make_probe_result(graw_count=3))
+
+        self.call_task()
+
+        self.data_router.refresh_from_db()
+        self.assertTrue(self.data_router.is_online)
+        self.assertFalse(self.data_router.staging_directory_is_clean)
 
     def test_with_invalid_data_router_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
             self.call_task(self.data_router.pk + 10)
 
+    def test_staging_directory_not_clean_if_unknown(self):
+        """Test that the staging directory is marked as not clean if the GRAW files couldn't be listed."""
+        self.set_mock_effect(self.make_probe_result()._replace(graw_count=None, graw_total_size=None))
+
+        with self.assertLogs(level=logging.ERROR):
+            self.call_task()
+
+        self.data_router.refresh_from_db()
+        self.assertTrue(self.data_router.is_online)
+        self.assertFalse(self.data_router.staging_directory_is_clean)
+
     def test_does_not_check_if_clean_if_not_online(self):
-        """Test that the staging directory status is not checked if the server is not online."""
-        self.set_mock_effect(False, which='status')
+        """Test that the staging directory status is not changed if the server is not online."""
+        self.data_router.is_online = True
+        self.data_router.staging_directory_is_clean = False
+        self.data_router.save()
+
+        self.set_mock_effect(self.make_probe_result(is_running=False))
         self.call_task()
 
         self.mock.assert_called_once_with(self.data_router.ip_address)
-        self.get_callable(which='status').assert_called_once_with()
-        self.get_callable(which='clean').assert_not_called()
+        self.get_callable().assert_called_once_with()
+
+        self.data_router.refresh_from_db()
+        self.assertFalse(self.data_router.is_online)
+        self.assertFalse(self.data_router.staging_directory_is_clean)
 
 
 class CheckDataRouterStatusAllTaskTestCase(ExceptionHandlingTestMixin, TestCalledForAllMixin,
@@ -442,6 +753,8 @@ class CheckDataRouterStatusAllTaskTestCase(ExceptionHandlingTestMixin, TestCalle
             experiment=self.other_experiment,
         )
 
+        cache.delete(ROUND_LOCK_KEY.format('check_data_router_status'))
+
     def get_patch_target(self):
         return 'attpcdaq.daq.tasks.check_data_router_status_task'
 
@@ -470,11 +783,15 @@ class OrganizeFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
             experiment=self.experiment,
         )
 
+        self.wint = self.mock.return_value.__enter__.return_value
+        self.wint.data_router_pid = 1234
+        self.wint.data_router_cwd = '/path/to/router'
+
     def get_patch_target(self):
         return 'attpcdaq.daq.tasks.WorkerInterface'
 
     def get_callable(self):
-        return self.mock.return_value.__enter__.return_value.organize_files
+        return self.wint.organize_files_bulk
 
     def call_task(self, pk=None):
         if pk is None:
@@ -489,11 +806,51 @@ class OrganizeFilesTaskTestCase(ExceptionHandlingTestMixin, TaskTestCaseBase):
         self.call_task()
 
         self.mock.assert_called_once_with(self.data_router.ip_address)
-        self.get_callable().assert_called_once_with(self.experiment.name, self.run.run_number)
+        self.assertEqual(self.get_callable().call_count, 1)
+        args, kwargs = self.get_callable().call_args
+        self.assertEqual(args, (self.experiment.name, self.run.run_number))
 
         self.data_router.refresh_from_db()
         self.assertTrue(self.data_router.staging_directory_is_clean)
 
+    def test_records_progress(self):
+        """Test that the progress is stored on the data router and run."""
+        def fake_organize(experiment_name, run_number, progress_callback):
+            progress_callback(0, 0, 5)
+            progress_callback(3, 300, 5)
+            progress_callback(5, 500, 5)
+            return 5, 500
+
+        self.set_mock_effect(fake_organize, side_effect=True)
+        self.run.graw_file_count = 10
+        self.run.graw_total_bytes = 1000
+        self.run.save()
+
+        self.call_task()
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.organize_files_done, 5)
+        self.assertEqual(self.data_router.organize_files_total, 5)
+        self.assertEqual(self.data_router.organize_files_progress, 1)
+
+        self.run.refresh_from_db()
+        self.assertEqual(self.run.graw_file_count, 15)
+        self.assertEqual(self.run.graw_total_bytes, 1500)
+
+    def test_uses_stored_working_directory(self):
+        """Test that the stored data router location is passed on and updated."""
+        self.data_router.pid = 1000
+        self.data_router.working_directory = '/old/path'
+        self.data_router.save()
+
+        self.call_task()
+
+        self.wint.set_cached_data_router.assert_called_once_with(1000, '/old/path')
+
+        self.data_router.refresh_from_db()
+        self.assertEqual(self.data_router.pid, 1234)
+        self.assertEqual(self.data_router.working_directory, '/path/to/router')
+
     def test_with_invalid_data_router_pk(self):
         """Test that the task logs an error if the pk is invalid."""
         with self.assertLogs(level=logging.ERROR):
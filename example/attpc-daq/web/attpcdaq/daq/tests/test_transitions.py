@@ -0,0 +1,129 @@
+from django.test import TestCase
+from unittest.mock import patch
+import logging
+
+from ..models import ECCServer, Experiment, ECCError
+from ..transitions import SystemTransition
+
+
+class FakeStateMachine(object):
+    """Stands in for the ECC servers' state machines.
+
+    Each transition takes ``polls_per_step`` calls to ``GetState`` to finish. Servers named in ``broken`` reject
+    transitions to the given state.
+
+    """
+    def __init__(self, polls_per_step=2, broken=None):
+        self.polls_per_step = polls_per_step
+        self.broken = broken or {}
+        self.targets = {}
+        self.change_state_calls = []
+
+    def change_state(self, ecc, target_state):
+        self.change_state_calls.append((ecc.name, ecc.state, target_state))
+        if self.broken.get(ecc.name) == target_state:
+            raise ECCError('Transition rejected')
+        self.targets[ecc.pk] = [target_state, self.polls_per_step]
+        ecc.is_transitioning = True
+
+    def fetch_state(self, ecc):
+        try:
+            target, polls_left = self.targets[ecc.pk]
+        except KeyError:
+            return ecc.state, False
+
+        if polls_left > 0:
+            self.targets[ecc.pk][1] -= 1
+            return ecc.state, True
+        else:
+            del self.targets[ecc.pk]
+            return target, False
+
+
+@patch('attpcdaq.daq.transitions.time.sleep')
+class SystemTransitionTestCase(TestCase):
+    def setUp(self):
+        self.experiment = Experiment.objects.create(name='Test')
+        self.ecc_servers = [ECCServer.objects.create(
+            name='ECC{}'.format(i),
+            ip_address='123.123.123.123',
+            experiment=self.experiment,
+        ) for i in range(3)]
+
+    def _run(self, target_state, machine, **kwargs):
+        with patch('attpcdaq.daq.models.ECCServer.change_state', autospec=True, side_effect=machine.change_state):
+            with patch('attpcdaq.daq.models.ECCServer.fetch_state', autospec=True, side_effect=machine.fetch_state):
+                transition = SystemTransition(ECCServer.objects.filter(experiment=self.experiment), target_state,
+                                              **kwargs)
+                errors = transition.run()
+        return transition, errors
+
+    def test_idle_to_running(self, mock_sleep):
+        machine = FakeStateMachine()
+        transition, errors = self._run(ECCServer.RUNNING, machine)
+
+        self.assertEqual(errors, {})
+        for ecc in ECCServer.objects.all():
+            self.assertEqual(ecc.state, ECCServer.RUNNING)
+            self.assertFalse(ecc.is_transitioning)
+
+        steps = [(ECCServer.IDLE, ECCServer.DESCRIBED), (ECCServer.DESCRIBED, ECCServer.PREPARED),
+                 (ECCServer.PREPARED, ECCServer.READY), (ECCServer.READY, ECCServer.RUNNING)]
+        expected_calls = {(ecc.name, start, end) for ecc in self.ecc_servers for start, end in steps}
+        self.assertEqual(set(machine.change_state_calls), expected_calls)
+
+    def test_mixed_states_going_down(self, mock_sleep):
+        ECCServer.objects.filter(pk=self.ecc_servers[0].pk).update(state=ECCServer.READY)
+        ECCServer.objects.filter(pk=self.ecc_servers[1].pk).update(state=ECCServer.DESCRIBED)
+
+        machine = FakeStateMachine()
+        transition, errors = self._run(ECCServer.IDLE, machine)
+
+        self.assertEqual(errors, {})
+        self.assertFalse(ECCServer.objects.exclude(state=ECCServer.IDLE).exists())
+
+        # The server that was already idle shouldn't be touched
+        self.assertNotIn(self.ecc_servers[2].name, [c[0] for c in machine.change_state_calls])
+
+    def test_poll_interval_backs_off(self, mock_sleep):
+        machine = FakeStateMachine(polls_per_step=5)
+        self._run(ECCServer.DESCRIBED, machine, initial_poll_interval=1, max_poll_interval=3, backoff_factor=2)
+
+        intervals = [c[0][0] for c in mock_sleep.call_args_list]
+        self.assertEqual(intervals, [1, 2, 3, 3, 3])
+
+    def test_stops_on_failure(self, mock_sleep):
+        machine = FakeStateMachine(broken={'ECC1': ECCServer.PREPARED})
+        with self.assertLogs(level=logging.ERROR):
+            transition, errors = self._run(ECCServer.RUNNING, machine)
+
+        self.assertEqual({ecc.name: err for ecc, err in errors.items()}, {'ECC1': 'Transition rejected'})
+        self.assertFalse(any(c[2] == ECCServer.READY for c in machine.change_state_calls))
+
+        ecc1 = ECCServer.objects.get(name='ECC1')
+        self.assertEqual(ecc1.state, ECCServer.DESCRIBED)
+        self.assertFalse(ecc1.is_transitioning)
+
+    def test_timeout(self, mock_sleep):
+        machine = FakeStateMachine(polls_per_step=10 ** 6)
+        with patch('attpcdaq.daq.transitions.time.monotonic', side_effect=[0, 0, 0, 1000]):
+            transition, errors = self._run(ECCServer.DESCRIBED, machine, step_timeout=10)
+
+        self.assertEqual(len(errors), len(self.ecc_servers))
+        for err in errors.values():
+            self.assertEqual(err, 'Timed out in state Idle')
+
+    def test_wrong_final_state(self, mock_sleep):
+        machine = FakeStateMachine()
+
+        def bad_fetch_state(ecc):
+            state, is_transitioning = machine.fetch_state(ecc)
+            if ecc.name == 'ECC0' and not is_transitioning and state == ECCServer.PREPARED:
+                return ECCServer.IDLE, False
+            return state, is_transitioning
+
+        with patch('attpcdaq.daq.models.ECCServer.change_state', autospec=True, side_effect=machine.change_state):
+            with patch('attpcdaq.daq.models.ECCServer.fetch_state', autospec=True, side_effect=bad_fetch_state):
+                errors = SystemTransition(ECCServer.objects.all(), ECCServer.READY).run()
+
+        self.assertEqual({ecc.name: err for ecc, err in errors.items()}, {'ECC0': 'Ended up Idle instead of Prepared'})
@@ -4,7 +4,7 @@ import os
 from itertools import chain
 from io import BytesIO
 
-from ..workertasks import WorkerInterface, mkdir_recursive
+from ..workertasks import WorkerInterface, SSHConnectionPool, mkdir_recursive, _PROBE_SCRIPT
 
 
 class MkdirRecursiveTestCase(TestCase):
@@ -102,6 +102,11 @@ class WorkerInterfaceTestCase(TestCase):
         self.router_path = '/path/to/router'
         self.graw_list = ['test1.graw', 'test2.graw']
 
+        # Give each test its own pool so connections from previous tests aren't reused
+        pool_patcher = patch('attpcdaq.daq.workertasks.connection_pool', new=SSHConnectionPool())
+        self.pool = pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+
     def test_initialize_loads_host_keys(self, mock_client, mock_config):
         wint = WorkerInterface(self.hostname)
         client = mock_client.return_value
@@ -136,13 +141,25 @@ class WorkerInterfaceTestCase(TestCase):
         client = mock_client.return_value
         client.connect.assert_called_once_with(self.full_hostname, 22, username=self.user)
 
-    def test_exit_closes_connection(self, mock_client, mock_config):
+    def test_exit_returns_connection_to_pool(self, mock_client, mock_config):
         client = mock_client.return_value
 
         with WorkerInterface(self.hostname) as wint:
             pass
 
-        client.close.assert_called_once_with()
+        client.close.assert_not_called()
+        self.assertIsNone(wint.client)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_connection_is_reused(self, mock_client, mock_config):
+        with WorkerInterface(self.hostname) as wint:
+            first_client = wint.client
+
+        with WorkerInterface(self.hostname) as wint:
+            self.assertIs(wint.client, first_client)
+
+        self.assertEqual(mock_client.call_count, 1)
+        self.assertEqual(mock_config.return_value.parse.call_count, 1)
 
     def test_find_data_router(self, mock_client, mock_config):
         true_drpath = '/path/to/router'
@@ -155,6 +172,47 @@ class WorkerInterfaceTestCase(TestCase):
 
         self.assertEqual(drpath, true_drpath)
 
+    def test_find_data_router_is_cached(self, mock_client, mock_config):
+        client = mock_client.return_value
+        fake_lsof_return = ('p1234\n', 'cdataRouter\n', 'n{}\n'.format(self.router_path))
+        client.exec_command.return_value = ([], fake_lsof_return, [])
+
+        with WorkerInterface(self.hostname) as wint:
+            first = wint.find_data_router()
+            second = wint.find_data_router()
+
+        self.assertEqual(first, self.router_path)
+        self.assertEqual(second, self.router_path)
+        self.assertEqual(wint.data_router_pid, 1234)
+        self.assertEqual(client.exec_command.call_count, 1)
+
+    def test_find_data_router_uses_stored_location(self, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = ([], ['/path/to/dataRouter\n'], [])
+
+        with WorkerInterface(self.hostname) as wint:
+            wint.set_cached_data_router(1234, self.router_path)
+            drpath = wint.find_data_router()
+
+        self.assertEqual(drpath, self.router_path)
+        client.exec_command.assert_called_once_with('ps -p 1234 -o comm=')
+
+    def test_find_data_router_pid_changed(self, mock_client, mock_config):
+        client = mock_client.return_value
+        new_path = '/new/path'
+        client.exec_command.side_effect = [
+            ([], [], []),  # ps finds nothing for the old PID
+            ([], ('p5678\n', 'cdataRouter\n', 'n{}\n'.format(new_path)), []),
+        ]
+
+        with WorkerInterface(self.hostname) as wint:
+            wint.set_cached_data_router(1234, self.router_path)
+            drpath = wint.find_data_router()
+
+        self.assertEqual(drpath, new_path)
+        self.assertEqual(wint.data_router_pid, 5678)
+        self.assertEqual(client.exec_command.call_count, 2)
+
     def test_find_data_router_not_running(self, mock_client, mock_config):
         client = mock_client.return_value
         client.exec_command.return_value = ([], [], [])
@@ -232,6 +290,72 @@ class WorkerInterfaceTestCase(TestCase):
     def test_check_data_router_running_when_false(self, mock_client, mock_config):
         self._check_data_router_running_impl(mock_client, False)
 
+    def _probe_impl(self, mock_client, ecc_running=True, router_running=True, graw_output=None):
+        output = ['@@ps\n', '  PID TTY           TIME CMD\n']
+        if ecc_running:
+            output.append(' 1234 ??         0:01.23 /path/to/getEccSoapServer --args something\n')
+        if router_running:
+            output.append(' 1235 ??         0:03.45 /path/to/dataRouter --args 123.345.567.789\n')
+
+        output.append('@@lsof\n')
+        if router_running:
+            output += ['p1235\n', 'cdataRouter\n', 'n{}\n'.format(self.router_path)]
+
+        output.append('@@graw\n')
+        output.append(graw_output if graw_output is not None else ('2 3500\n' if router_running else '0 0\n'))
+
+        client = mock_client.return_value
+        client.exec_command.return_value = ([], output, [])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.probe()
+
+        self.assertEqual(client.exec_command.call_count, 1)
+        return result
+
+    def test_probe(self, mock_client, mock_config):
+        result = self._probe_impl(mock_client)
+
+        self.assertTrue(result.ecc_server_running)
+        self.assertTrue(result.data_router_running)
+        self.assertEqual(result.data_router_pid, 1235)
+        self.assertEqual(result.data_router_cwd, self.router_path)
+        self.assertEqual(result.graw_count, 2)
+        self.assertEqual(result.graw_total_size, 3500)
+
+    def test_probe_nothing_running(self, mock_client, mock_config):
+        result = self._probe_impl(mock_client, ecc_running=False, router_running=False)
+
+        self.assertFalse(result.ecc_server_running)
+        self.assertFalse(result.data_router_running)
+        self.assertIsNone(result.data_router_pid)
+        self.assertIsNone(result.data_router_cwd)
+        self.assertEqual(result.graw_count, 0)
+        self.assertEqual(result.graw_total_size, 0)
+
+    def test_probe_listing_failed(self, mock_client, mock_config):
+        result = self._probe_impl(mock_client, graw_output='failed\n')
+
+        self.assertTrue(result.data_router_running)
+        self.assertIsNone(result.graw_count)
+        self.assertIsNone(result.graw_total_size)
+
+    def test_probe_lsof_gets_junk(self, mock_client, mock_config):
+        client = mock_client.return_value
+        output = ['@@ps\n', '@@lsof\n', 'p1234\n', 'csomeProgram\n', 'n/some/path\n', '@@graw\n']
+        client.exec_command.return_value = ([], output, [])
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.probe()
+
+        self.assertIsNone(result.data_router_pid)
+        self.assertIsNone(result.data_router_cwd)
+
+    def test_probe_script_quotes_closed_on_each_line(self, mock_client, mock_config):
+        # A newline escape that isn't doubled in the Python string would put a line break inside the quotes
+        for line in _PROBE_SCRIPT.splitlines():
+            self.assertEqual(line.count("'") % 2, 0, line)
+
     @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
     def test_get_graw_list(self, mock_find_data_router, mock_client, mock_config):
         mock_open_sftp = mock_client.return_value.open_sftp
@@ -304,6 +428,65 @@ class WorkerInterfaceTestCase(TestCase):
             with WorkerInterface(self.hostname) as wint:
                 wint.organize_files(exp_name, run_number)
 
+    def _make_stdout(self, lines, exit_status=0):
+        stdout = MagicMock()
+        stdout.__iter__.return_value = iter(lines)
+        stdout.channel.recv_exit_status.return_value = exit_status
+        return stdout
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_organize_files_bulk(self, mock_find_data_router, mock_client, mock_config):
+        mock_find_data_router.return_value = self.router_path
+        client = mock_client.return_value
+        stdout = self._make_stdout(['@@total 3\n', '@@moved 2 2000\n', '@@moved 1 500\n'])
+        client.exec_command.return_value = (MagicMock(), stdout, MagicMock())
+
+        progress = []
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.organize_files_bulk('experiment', 1, batch_size=2,
+                                              progress_callback=lambda *args: progress.append(args))
+
+        self.assertEqual(result, (3, 2500))
+        self.assertEqual(progress, [(0, 0, 3), (2, 2000, 3), (3, 2500, 3)])
+
+        self.assertEqual(client.exec_command.call_count, 1)
+        command = client.exec_command.call_args[0][0]
+        self.assertIn(self.router_path, command)
+        self.assertIn(os.path.join(self.router_path, 'experiment', 'run_0001'), command)
+        self.assertIn('-n 2', command)
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_organize_files_bulk_collision(self, mock_find_data_router, mock_client, mock_config):
+        mock_find_data_router.return_value = self.router_path
+        client = mock_client.return_value
+        collision = os.path.join(self.router_path, 'file 2.graw')
+        stdout = self._make_stdout(['@@total 3\n', '@@collision {}\n'.format(collision), '@@moved 2 2000\n'])
+        client.exec_command.return_value = (MagicMock(), stdout, MagicMock())
+
+        progress = []
+        with WorkerInterface(self.hostname) as wint:
+            with self.assertRaisesRegex(RuntimeError, r'1 file\(s\) .* file 2\.graw'):
+                wint.organize_files_bulk('experiment', 1, progress_callback=lambda *args: progress.append(args))
+
+        # The files that were moved are still reported
+        self.assertEqual(progress[-1], (2, 2000, 3))
+
+        command = client.exec_command.call_args[0][0]
+        self.assertIn('mv -n', command)
+        self.assertNotIn('mv -f', command)
+
+    @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
+    def test_organize_files_bulk_failure(self, mock_find_data_router, mock_client, mock_config):
+        mock_find_data_router.return_value = self.router_path
+        client = mock_client.return_value
+        stderr = MagicMock()
+        stderr.read.return_value = b'mv: permission denied'
+        client.exec_command.return_value = (MagicMock(), self._make_stdout(['@@total 3\n'], exit_status=123), stderr)
+
+        with WorkerInterface(self.hostname) as wint:
+            with self.assertRaisesRegex(RuntimeError, r'permission denied'):
+                wint.organize_files_bulk('experiment', 1)
+
     @patch('attpcdaq.daq.workertasks.WorkerInterface.find_data_router')
     def test_build_run_dir_path(self, mock_find_data_router, mock_client, mock_config):
         mock_find_data_router.return_value = self.router_path
@@ -321,8 +504,10 @@ class WorkerInterfaceTestCase(TestCase):
         mock_find_data_router.assert_called_once_with()
 
     @patch('attpcdaq.daq.workertasks.mkdir_recursive')
-    def test_backup_config_files(self, mock_mkdir, mock_client, mock_config):
-        mock_sftp = mock_client.return_value.open_sftp.return_value.__enter__.return_value
+    def test_backup_config_files_fallback(self, mock_mkdir, mock_client, mock_config):
+        client = mock_client.return_value
+        client.exec_command.return_value = (MagicMock(), self._make_stdout([], exit_status=2), MagicMock())
+        mock_sftp = client.open_sftp.return_value.__enter__.return_value
 
         dest_root = '/backup/destination'
 
@@ -336,22 +521,43 @@ class WorkerInterfaceTestCase(TestCase):
         dest_paths = [os.path.join(backup_dest, os.path.basename(s)) for s in src_paths]
 
         mock_file = mock_sftp.open.return_value.__enter__.return_value
-        sample_contents = b'Some file contents'
-        mock_file.read.return_value = sample_contents
+        sample_contents = [b'Some file ', b'contents', b'']
+        mock_file.read.side_effect = sample_contents * len(src_paths)
 
         with WorkerInterface(self.hostname) as wint:
-            wint.backup_config_files(exp_name, run_num, src_paths, dest_root)
+            result = wint.backup_config_files(exp_name, run_num, src_paths, dest_root, chunk_size=10)
 
         mock_mkdir.assert_called_once_with(mock_sftp, backup_dest)
 
         expected_calls = list(chain.from_iterable(zip(
             (call(f, 'r') for f in src_paths),
-            (call(f, 'w') for f in dest_paths)
+            (call(f + '.tmp', 'w') for f in dest_paths)
         )))
 
         self.assertEqual(mock_sftp.open.call_args_list, expected_calls)
-        self.assertEqual(mock_file.read.call_count, len(src_paths))
-        self.assertEqual(mock_file.write.call_args_list, [call(sample_contents)] * len(dest_paths))
+        self.assertEqual(mock_sftp.posix_rename.call_args_list, [call(f + '.tmp', f) for f in dest_paths])
+        self.assertEqual(mock_file.read.call_args_list, [call(10)] * len(sample_contents) * len(src_paths))
+        self.assertEqual(mock_file.write.call_args_list, [call(b'Some file '), call(b'contents')] * len(dest_paths))
+        self.assertEqual(result, {path: 'copied' for path in src_paths})
+
+    @patch('attpcdaq.daq.workertasks.mkdir_recursive')
+    def test_backup_config_files(self, mock_mkdir, mock_client, mock_config):
+        client = mock_client.return_value
+        src_paths = ['/some/config/file1.xcfg', '/some/config/file 2.xcfg']
+        output = ['@@copied {}\n'.format(src_paths[0]), '@@linked {}\n'.format(src_paths[1])]
+        client.exec_command.return_value = (MagicMock(), self._make_stdout(output), MagicMock())
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.backup_config_files('experiment', 1, src_paths, '/backup/destination')
+
+        self.assertEqual(result, {src_paths[0]: 'copied', src_paths[1]: 'linked'})
+
+        self.assertEqual(client.exec_command.call_count, 1)
+        command = client.exec_command.call_args[0][0]
+        self.assertIn('/backup/destination/.objects', command)
+        self.assertIn('/backup/destination/experiment/run_0001', command)
+        client.open_sftp.assert_not_called()
+        mock_mkdir.assert_not_called()
 
     def test_tail_file(self, mock_client, mock_config):
         path = '/path/to/file'
@@ -374,3 +580,152 @@ class WorkerInterfaceTestCase(TestCase):
 
         mock_sftp.open.assert_called_once_with(path, 'r')
 
+
+    def _setup_remote_file(self, mock_client, contents):
+        buffer = BytesIO(contents)
+
+        mock_sftp = mock_client.return_value.open_sftp.return_value.__enter__.return_value
+        mock_file = mock_sftp.open.return_value.__enter__.return_value
+
+        mock_file.seek.side_effect = buffer.seek
+        mock_file.read.side_effect = buffer.read
+        mock_file.tell.side_effect = buffer.tell
+
+        return mock_file
+
+    def test_tail_file_in_blocks(self, mock_client, mock_config):
+        lines = ['Line {}\n'.format(i) for i in range(100)]
+        mock_file = self._setup_remote_file(mock_client, ''.join(lines).encode('ascii'))
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.tail_file('/path/to/file', num_lines=10, block_size=16)
+
+        self.assertEqual(result, ''.join(lines[-10:]))
+        self.assertLess(mock_file.read.call_count, 20)
+
+    def test_tail_file_byte_cap(self, mock_client, mock_config):
+        lines = ['Line {}\n'.format(i) for i in range(100)]
+        self._setup_remote_file(mock_client, ''.join(lines).encode('ascii'))
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.tail_file('/path/to/file', num_lines=50, max_bytes=20, block_size=8)
+
+        self.assertEqual(result, ''.join(lines[-2:]))
+
+    def test_tail_file_invalid_bytes(self, mock_client, mock_config):
+        self._setup_remote_file(mock_client, b'first\nsecond \xff\xfe line\n')
+
+        with WorkerInterface(self.hostname) as wint:
+            result = wint.tail_file('/path/to/file', num_lines=1)
+
+        self.assertEqual(result, 'second \ufffd\ufffd line\n')
+
+    def test_follow_file(self, mock_client, mock_config):
+        contents = b'one\ntwo\nthree\n'
+        self._setup_remote_file(mock_client, contents + b'four\nfive\npartial')
+
+        with WorkerInterface(self.hostname) as wint:
+            result, offset = wint.follow_file('/path/to/file', len(contents))
+
+        self.assertEqual(result, 'four\nfive\n')
+        self.assertEqual(offset, len(contents) + len(b'four\nfive\n'))
+
+    def test_follow_file_without_offset(self, mock_client, mock_config):
+        contents = b'one\ntwo\nthree\n'
+        self._setup_remote_file(mock_client, contents)
+
+        with WorkerInterface(self.hostname) as wint:
+            result, offset = wint.follow_file('/path/to/file', None, num_lines=2)
+
+        self.assertEqual(result, 'two\nthree\n')
+        self.assertEqual(offset, len(contents))
+
+    def test_follow_file_bytes(self, mock_client, mock_config):
+        contents = b'one\n'
+        self._setup_remote_file(mock_client, contents + b'\xff\xfe bad\n')
+
+        with WorkerInterface(self.hostname) as wint:
+            result, offset = wint.follow_file('/path/to/file', len(contents), encoding=None)
+
+        self.assertEqual(result, b'\xff\xfe bad\n')
+        self.assertEqual(offset, len(contents) + len(result))
+
+    def test_follow_file_truncated(self, mock_client, mock_config):
+        contents = b'new\n'
+        self._setup_remote_file(mock_client, contents)
+
+        with WorkerInterface(self.hostname) as wint:
+            result, offset = wint.follow_file('/path/to/file', 1000)
+
+        self.assertEqual(result, 'new\n')
+        self.assertEqual(offset, len(contents))
+
+@patch('attpcdaq.daq.workertasks.open')
+@patch('attpcdaq.daq.workertasks.SSHConfig')
+@patch('attpcdaq.daq.workertasks.SSHClient')
+class SSHConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self.hostname = 'hostname'
+        self.pool = SSHConnectionPool(idle_ttl=60)
+
+    def test_connect_sets_keepalive(self, mock_client, mock_config, mock_open):
+        key, client = self.pool.acquire(self.hostname)
+        transport = client.get_transport.return_value
+        transport.set_keepalive.assert_called_once_with(self.pool.keepalive_interval)
+
+    def test_keys_are_separate(self, mock_client, mock_config, mock_open):
+        mock_client.side_effect = lambda: MagicMock()
+
+        key1, client1 = self.pool.acquire(self.hostname)
+        self.pool.release(key1, client1)
+        key2, client2 = self.pool.acquire(self.hostname, username='other')
+
+        self.assertNotEqual(key1, key2)
+        self.assertIsNot(client1, client2)
+
+    def test_dead_connection_is_replaced(self, mock_client, mock_config, mock_open):
+        mock_client.side_effect = lambda: MagicMock()
+
+        key, dead_client = self.pool.acquire(self.hostname)
+        self.pool.release(key, dead_client)
+        dead_client.get_transport.return_value.is_active.return_value = False
+
+        key, client = self.pool.acquire(self.hostname)
+
+        self.assertIsNot(client, dead_client)
+        dead_client.close.assert_called_once_with()
+
+    def test_failed_keepalive_replaces_connection(self, mock_client, mock_config, mock_open):
+        mock_client.side_effect = lambda: MagicMock()
+
+        key, dead_client = self.pool.acquire(self.hostname)
+        self.pool.release(key, dead_client)
+        dead_client.get_transport.return_value.send_ignore.side_effect = EOFError()
+
+        key, client = self.pool.acquire(self.hostname)
+
+        self.assertIsNot(client, dead_client)
+        dead_client.close.assert_called_once_with()
+
+    @patch('attpcdaq.daq.workertasks.time.monotonic')
+    def test_idle_connections_expire(self, mock_time, mock_client, mock_config, mock_open):
+        mock_client.side_effect = lambda: MagicMock()
+
+        mock_time.return_value = 1000
+        key, old_client = self.pool.acquire(self.hostname)
+        self.pool.release(key, old_client)
+
+        mock_time.return_value = 1000 + self.pool.idle_ttl + 1
+        key, client = self.pool.acquire(self.hostname)
+
+        self.assertIsNot(client, old_client)
+        old_client.close.assert_called_once_with()
+
+    def test_close_all(self, mock_client, mock_config, mock_open):
+        key, client = self.pool.acquire(self.hostname)
+        self.pool.release(key, client)
+
+        self.pool.close_all()
+
+        client.close.assert_called_once_with()
+        self.assertEqual(len(self.pool), 0)
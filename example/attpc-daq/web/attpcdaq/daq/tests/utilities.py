@@ -1,3 +1,8 @@
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.core.cache import cache
+from contextlib import contextmanager
+
+
 class FakeResponseState(object):
     def __init__(self, error_code=0, error_message='', state=1, trans=0):
         self.ErrorCode = str(error_code)
@@ -11,3 +16,32 @@ class FakeResponseText(object):
         self.ErrorCode = str(error_code)
         self.ErrorMessage = str(error_message)
         self.Text = str(text)
+
+
+@contextmanager
+def run_on_commit_callbacks(using=DEFAULT_DB_ALIAS):
+    """Run the ``transaction.on_commit`` callbacks registered inside the block when it exits.
+
+    A TestCase runs each test in a transaction that is never committed, so these callbacks would otherwise
+    never run. This does the same thing as ``TestCase.captureOnCommitCallbacks(execute=True)`` in newer
+    versions of Django.
+
+    """
+    connection = connections[using]
+    start = len(connection.run_on_commit)
+    yield
+    callbacks = [func for _, func in connection.run_on_commit[start:]]
+    del connection.run_on_commit[start:]
+    for callback in callbacks:
+        callback()
+
+
+class ClearCacheMixin(object):
+    """Clears Django's cache before each test.
+
+    The test cache lives for the whole test run, so status versions and snapshots would otherwise leak between tests.
+
+    """
+    def setUp(self):
+        cache.clear()
+        super().setUp()
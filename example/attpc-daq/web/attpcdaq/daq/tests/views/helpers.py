@@ -3,6 +3,8 @@ from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
 
 from ...models import ConfigId, ECCServer, DataRouter, DataSource, Experiment
+from ...middleware import active_experiment_cache
+from ..utilities import ClearCacheMixin
 
 
 class RequiresLoginTestMixin(object):
@@ -23,6 +25,7 @@ class NeedsExperimentTestMixin(object):
     def test_no_experiment(self, *args, **kwargs):
         self.client.force_login(self.user)
         Experiment.objects.all().update(is_active=False)
+        active_experiment_cache.invalidate()  # update() doesn't send signals
 
         request_data = kwargs.get('data')
         reverse_args = kwargs.get('rev_args')
@@ -31,8 +34,10 @@ class NeedsExperimentTestMixin(object):
         self.assertEqual(resp.redirect_chain[-1][0], reverse('daq/choose_experiment'))
 
 
-class ManySourcesTestCaseBase(TestCase):
+class ManySourcesTestCaseBase(ClearCacheMixin, TestCase):
     def setUp(self):
+        super().setUp()
+
         self.user = User(username='test', password='test1234')
         self.user.save()
 
@@ -1,17 +1,29 @@
 from django.test import TestCase
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
-from unittest.mock import patch, call
+from django.core.cache import cache
+from unittest.mock import patch
 from datetime import datetime
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 import json
+import csv
+import io
 import tempfile
 import logging
+import threading
+import time
 
 from .helpers import RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase
 from ...models import ECCServer, DataRouter, DataSource, RunMetadata, Experiment, Observable, Measurement
 from ... import views
 from ...views import UpdateRunMetadataView
+from ...views.io import _iter_runs_with_measurements
 from ...forms import RunMetadataForm
+from ...schedules import get_activity, BUSY, BUSY_KEY
+from ...pivot import get_pivot_version
+from ...statuscache import StatusWatcher, bump_status_version
+from ..utilities import run_on_commit_callbacks, ClearCacheMixin
 
 
 class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase):
@@ -26,9 +38,10 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
 
     def test_good_request(self):
         self.client.force_login(self.user)
-        for ecc in self.ecc_servers:
-            ecc.state = ECCServer.RUNNING
-            ecc.save()
+        with run_on_commit_callbacks():
+            for ecc in self.ecc_servers:
+                ecc.state = ECCServer.RUNNING
+                ecc.save()
 
         resp = self.client.get(reverse(self.view_name))
         self.assertEqual(resp.resolver_match.func, views.refresh_state_all)
@@ -51,18 +64,21 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
             router = DataRouter.objects.get(pk=pk)
             self.assertEqual(res['is_online'], router.is_online)
             self.assertEqual(res['is_clean'], router.staging_directory_is_clean)
+            self.assertEqual(res['organize_files_done'], router.organize_files_done)
+            self.assertEqual(res['organize_files_total'], router.organize_files_total)
             self.assertTrue(res['success'])
 
     def test_response_contains_run_info(self):
         self.client.force_login(self.user)
 
-        for ecc_server in self.ecc_servers:
-            ecc_server.state = ECCServer.RUNNING
-            ecc_server.save()
+        with run_on_commit_callbacks():
+            for ecc_server in self.ecc_servers:
+                ecc_server.state = ECCServer.RUNNING
+                ecc_server.save()
 
-        run0 = RunMetadata.objects.create(run_number=0,
-                                          experiment=self.experiment,
-                                          start_datetime=datetime.now())
+            run0 = RunMetadata.objects.create(run_number=0,
+                                              experiment=self.experiment,
+                                              start_datetime=datetime.now())
 
         resp = self.client.get(reverse(self.view_name))
 
@@ -71,6 +87,59 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         self.assertEqual(resp_json['start_time'], run0.start_datetime.strftime('%b %d %Y, %H:%M:%S'))  # This is perhaps not the best
         self.assertEqual(resp_json['run_duration'], run0.duration_string)
 
+    def test_not_modified(self):
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+
+        resp = self.client.get(reverse(self.view_name), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp['ETag'], etag)
+
+    def test_change_invalidates_snapshot(self):
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name))
+        etag = resp['ETag']
+
+        ecc = self.ecc_servers[0]
+        ecc.state = ECCServer.READY
+        with run_on_commit_callbacks():
+            ecc.save()
+
+        resp = self.client.get(reverse(self.view_name), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp['ETag'], etag)
+
+        states = {int(e['pk']): e['state'] for e in resp.json()['ecc_server_status_list']}
+        self.assertEqual(states[ecc.pk], ECCServer.READY)
+
+    def test_bulk_refresh_invalidates_snapshot(self):
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name))
+        etag = resp['ETag']
+
+        ecc = self.ecc_servers[0]
+        with patch('attpcdaq.daq.models.ECCServer.fetch_state', return_value=(ECCServer.PREPARED, False)):
+            with run_on_commit_callbacks():
+                ECCServer.refresh_state_many([ECCServer.objects.get(pk=ecc.pk)])
+
+        resp = self.client.get(reverse(self.view_name), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_cached_snapshot_does_not_query_sources(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse(self.view_name))
+
+        with patch('attpcdaq.daq.views.helpers.get_status') as mock_get_status:
+            resp = self.client.get(reverse(self.view_name))
+
+        mock_get_status.assert_not_called()
+        self.assertEqual(resp.status_code, 200)
+
     def test_ecc_servers_only_for_this_experiment(self):
         self.client.force_login(self.user)
 
@@ -98,6 +167,159 @@ class RefreshStateAllViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         self.assertNotIn(other_router.pk, [int(e['pk']) for e in resp.json()['data_router_status_list']])
 
 
+class StreamStatusViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/source_stream_status'
+
+        # Use a new watcher so that versions seen in other tests don't count
+        self.watcher = StatusWatcher()
+        for target in ('attpcdaq.daq.statuscache.status_watcher', 'attpcdaq.daq.views.api.status_watcher'):
+            patcher = patch(target, self.watcher)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def on_wait(self, func):
+        """Call ``func`` each time the stream waits for a change, then check for changes without waiting."""
+        wait_for_change = self.watcher.wait_for_change
+
+        def side_effect(version, timeout=None):
+            func()
+            return wait_for_change(version, 0)
+
+        patcher = patch.object(self.watcher, 'wait_for_change', side_effect=side_effect)
+        self.addCleanup(patcher.stop)
+        return patcher.start()
+
+    def test_post(self):
+        self.client.force_login(self.user)
+        resp = self.client.post(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 405)
+
+    @staticmethod
+    def _parse_event(raw):
+        event, data = raw.decode('utf-8').rstrip('\n').split('\n')
+        return event[len('event: '):], json.loads(data[len('data: '):])
+
+    def test_first_event_is_full_status(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+
+        event, data = self._parse_event(next(iter(resp.streaming_content)))
+        resp.close()
+
+        self.assertEqual(event, 'status')
+        self.assertEqual(len(data['ecc_server_status_list']), len(self.ecc_servers))
+        self.assertEqual(len(data['data_router_status_list']), len(self.data_routers))
+
+    def test_diff_after_change(self):
+        ecc = self.ecc_servers[0]
+
+        def change_state():
+            ecc.state = ECCServer.READY
+            with run_on_commit_callbacks():
+                ecc.save()
+
+        self.on_wait(change_state)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        stream = iter(resp.streaming_content)
+        next(stream)
+        event, data = self._parse_event(next(stream))
+        resp.close()
+
+        self.assertEqual(event, 'status-diff')
+        self.assertEqual(data['overall_state_name'], 'Mixed')
+        self.assertEqual(len(data['ecc_server_status_list']), 1)
+        self.assertEqual(data['ecc_server_status_list'][0]['pk'], ecc.pk)
+        self.assertEqual(data['ecc_server_status_list'][0]['state'], ECCServer.READY)
+        self.assertNotIn('data_router_status_list', data)
+
+    def test_woken_by_change(self):
+        ecc = self.ecc_servers[0]
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        stream = iter(resp.streaming_content)
+        next(stream)
+
+        # Change the state without bumping the version, and bump it from another thread later, like a Celery task
+        ecc.state = ECCServer.READY
+        ecc.save()
+
+        timer = threading.Timer(0.2, bump_status_version)
+        timer.start()
+        start = time.monotonic()
+        event, data = self._parse_event(next(stream))
+        timer.join()
+        resp.close()
+
+        self.assertEqual(event, 'status-diff')
+        self.assertLess(time.monotonic() - start, 5)
+
+    def test_full_status_after_source_removed(self):
+        def remove_source():
+            with run_on_commit_callbacks():
+                self.ecc_servers[0].delete()
+
+        self.on_wait(remove_source)
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        stream = iter(resp.streaming_content)
+        next(stream)
+        event, data = self._parse_event(next(stream))
+        resp.close()
+
+        self.assertEqual(event, 'status')
+        self.assertEqual(len(data['ecc_server_status_list']), len(self.ecc_servers) - 1)
+
+    def test_snapshot_loaded_only_when_version_changes(self):
+        ecc = self.ecc_servers[0]
+
+        def change_state_on_third_wait():
+            if mock_wait.call_count == 3:
+                ecc.state = ECCServer.READY
+                with run_on_commit_callbacks():
+                    ecc.save()
+
+        mock_wait = self.on_wait(change_state_on_third_wait)
+
+        self.client.force_login(self.user)
+        with patch('attpcdaq.daq.views.api.load_status_snapshot', wraps=views.api.load_status_snapshot) as mock_load:
+            resp = self.client.get(reverse(self.view_name))
+            stream = iter(resp.streaming_content)
+            next(stream)
+            event, data = self._parse_event(next(stream))
+            resp.close()
+
+        self.assertEqual(event, 'status-diff')
+        self.assertEqual(mock_wait.call_count, 3)
+        self.assertEqual(mock_load.call_count, 2)
+
+    def test_too_many_streams(self):
+        self.client.force_login(self.user)
+
+        with patch('attpcdaq.daq.views.api._status_stream_slots', threading.BoundedSemaphore(1)):
+            first = self.client.get(reverse(self.view_name))
+            event, _ = self._parse_event(next(iter(first.streaming_content)))
+            self.assertEqual(event, 'status')
+
+            second = self.client.get(reverse(self.view_name))
+            event, _ = self._parse_event(next(iter(second.streaming_content)))
+            second.close()
+            self.assertEqual(event, 'use-polling')
+
+            first.close()
+
+            third = self.client.get(reverse(self.view_name))
+            event, _ = self._parse_event(next(iter(third.streaming_content)))
+            third.close()
+            self.assertEqual(event, 'status')
+
+
 class SourceChangeStateTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
     def setUp(self):
         super().setUp()
@@ -163,7 +385,7 @@ class SourceChangeStateTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin
                 self.ecc.save()
 
 
-@patch('attpcdaq.daq.views.api.eccserver_change_state_task.delay')
+@patch('attpcdaq.daq.views.api.eccserver_change_state_all_task.delay')
 class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase):
     def setUp(self):
         super().setUp()
@@ -202,8 +424,9 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
 
         resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.DESCRIBED})
 
-        used_pks = [c[0][0] for c in mock_task_delay.call_args_list]
-        self.assertNotIn(new_ecc.pk, used_pks)
+        mock_task_delay.assert_called_once_with(self.experiment.pk, ECCServer.DESCRIBED)
+        new_ecc.refresh_from_db()
+        self.assertFalse(new_ecc.is_transitioning)
 
     def test_all_transitions_work(self, mock_task_delay):
         self.client.force_login(self.user)
@@ -221,8 +444,8 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
             ECCServer.RESET,
         )
 
-        with patch('attpcdaq.daq.views.api.organize_files_all_task.delay') as mock_organize:
-            with patch('attpcdaq.daq.views.api.backup_config_files_all_task.delay') as mock_backup:
+        with patch('attpcdaq.daq.tasks.organize_files_all_task.delay') as mock_organize:
+            with patch('attpcdaq.daq.tasks.backup_config_files_all_task.delay') as mock_backup:
                 for transition_number in state_list:
                     if transition_number == ECCServer.RESET:
                         target_state = ECCServer.objects.first().state - 1
@@ -232,8 +455,7 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
                     resp = self.client.post(reverse(self.view_name), {'target_state': transition_number})
 
                     self.assertEqual(resp.status_code, 200)
-                    expected_calls = [call(e.pk, target_state) for e in ECCServer.objects.all()]
-                    mock_task_delay.assert_has_calls(expected_calls)
+                    mock_task_delay.assert_called_once_with(self.experiment.pk, target_state)
 
                     self.assertFalse(ECCServer.objects.filter(is_transitioning=False).exists())
 
@@ -242,6 +464,46 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
                     # Prepare for the next iteration since they won't actually transition
                     ECCServer.objects.all().update(state=target_state, is_transitioning=False)
 
+    def test_marks_system_busy(self, mock_task_delay):
+        self.client.force_login(self.user)
+        cache.delete(BUSY_KEY)
+
+        self.client.post(reverse(self.view_name), {'target_state': ECCServer.DESCRIBED})
+        self.assertEqual(get_activity(), BUSY)
+
+    def test_multi_step_transition(self, mock_task_delay):
+        self.client.force_login(self.user)
+
+        with patch('attpcdaq.daq.views.api.eccserver_transition_all_task.delay') as mock_transition:
+            resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.READY})
+
+        self.assertEqual(resp.status_code, 200)
+        mock_transition.assert_called_once_with(self.experiment.pk, ECCServer.READY)
+        mock_task_delay.assert_not_called()
+
+    def test_multi_step_start_waits_for_transition(self, mock_task_delay):
+        self.client.force_login(self.user)
+        ECCServer.objects.all().update(state=ECCServer.PREPARED)
+
+        with patch('attpcdaq.daq.views.api.eccserver_transition_all_task.delay') as mock_transition:
+            resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.RUNNING})
+
+        self.assertEqual(resp.status_code, 200)
+        mock_transition.assert_called_once_with(self.experiment.pk, ECCServer.RUNNING)
+
+        self.experiment.refresh_from_db()
+        self.assertFalse(self.experiment.is_running)
+
+    def test_single_query_for_transitioning_flag(self, mock_task_delay):
+        self.client.force_login(self.user)
+
+        with patch('attpcdaq.daq.views.api.ECCServer.save') as mock_save:
+            self.client.post(reverse(self.view_name), {'target_state': ECCServer.DESCRIBED})
+
+        mock_save.assert_not_called()
+        self.assertEqual(mock_task_delay.call_count, 1)
+        self.assertFalse(ECCServer.objects.filter(is_transitioning=False).exists())
+
     def test_start(self, mock_change_state_task_delay):
         self.client.force_login(self.user)
         ECCServer.objects.all().update(state=ECCServer.READY)
@@ -258,8 +520,8 @@ class SourceChangeStateAllTestCase(RequiresLoginTestMixin, NeedsExperimentTestMi
         ECCServer.objects.all().update(state=ECCServer.RUNNING)
         self.experiment.start_run()
 
-        with patch('attpcdaq.daq.views.api.organize_files_all_task.delay') as mock_organize:
-            with patch('attpcdaq.daq.views.api.backup_config_files_all_task.delay') as mock_backup:
+        with patch('attpcdaq.daq.tasks.organize_files_all_task.delay') as mock_organize:
+            with patch('attpcdaq.daq.tasks.backup_config_files_all_task.delay') as mock_backup:
                 resp = self.client.post(reverse(self.view_name), {'target_state': ECCServer.READY})
 
                 self.assertEqual(resp.status_code, 200)
@@ -334,6 +596,137 @@ class ListRunMetadataViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMix
         self.assertNotIn(newrun, run_list)
 
 
+class DownloadRunMetadataTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/download_run_metadata'
+
+        self.user = User.objects.create(username='testUser', password='test1234')
+        self.experiment = Experiment.objects.create(name='Test experiment', is_active=True)
+
+        self.observables = [
+            Observable.objects.create(name='Energy', value_type=Observable.FLOAT, experiment=self.experiment),
+            Observable.objects.create(name='Count', value_type=Observable.INTEGER, experiment=self.experiment),
+        ]
+
+        for i in (2, 0, 1):
+            self._add_run(self.experiment, i)
+
+    def _add_run(self, experiment, run_number):
+        run = RunMetadata.objects.create(run_number=run_number, title='Run {}'.format(run_number),
+                                         experiment=experiment)
+        Measurement.objects.create(run_metadata=run, observable=self.observables[0],
+                                   value=run_number * 1.5)
+        if run_number != 1:  # Leave one measurement out
+            Measurement.objects.create(run_metadata=run, observable=self.observables[1],
+                                       value=run_number * 10)
+        return run
+
+    def _download(self, **params):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), params)
+        self.assertEqual(resp.status_code, 200)
+        return b''.join(resp.streaming_content).decode()
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self._download())))
+
+        self.assertEqual(rows[0][-2:], ['Energy', 'Count'])
+        self.assertEqual([row[0] for row in rows[1:]], ['0', '1', '2'])
+        self.assertEqual([row[-2:] for row in rows[1:]], [['0.0', '0'], ['1.5', ''], ['3.0', '20']])
+
+    def test_json_lines(self):
+        items = [json.loads(line) for line in self._download(format='jsonl').splitlines()]
+
+        self.assertEqual([item['run_number'] for item in items], [0, 1, 2])
+        self.assertEqual(items[2]['title'], 'Run 2')
+        self.assertEqual(items[1]['measurements'], {'Energy': 1.5, 'Count': None})
+
+    def test_unknown_format(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), {'format': 'xls'})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_only_this_experiment(self):
+        other_experiment = Experiment.objects.create(name='Another experiment')
+        self._add_run(other_experiment, 10)
+
+        rows = list(csv.reader(io.StringIO(self._download())))
+        self.assertEqual([row[0] for row in rows[1:]], ['0', '1', '2'])
+
+    def test_query_count_does_not_depend_on_runs(self):
+        self.client.force_login(self.user)
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(reverse(self.view_name))
+                b''.join(resp.streaming_content)
+            return len(ctx.captured_queries)
+
+        count_queries()  # Let the active experiment be cached
+        before = count_queries()
+        for i in range(3, 20):
+            self._add_run(self.experiment, i)
+        self.assertEqual(count_queries(), before)
+
+    def test_chunks_with_run_inserted(self):
+        self._add_run(self.experiment, 1)  # A repeated run number
+
+        runs = _iter_runs_with_measurements(self.experiment, self.observables, chunk_size=2)
+        run_numbers = [next(runs)[0].run_number, next(runs)[0].run_number]
+
+        # A run that comes before the next chunk is added during the download
+        self._add_run(self.experiment, 0)
+
+        run_numbers += [run.run_number for run, values in runs]
+        self.assertEqual(run_numbers, [0, 1, 1, 2])
+
+
+class MeasurementPivotViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, ClearCacheMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/measurement_pivot'
+
+        self.user = User.objects.create(username='testUser', password='test1234')
+        self.experiment = Experiment.objects.create(name='Test experiment', is_active=True)
+        self.observables = [
+            Observable.objects.create(name='Obs{}'.format(i), value_type=Observable.INTEGER,
+                                      experiment=self.experiment, order=i)
+            for i in range(3)
+        ]
+
+        for run_number in range(5):
+            run = RunMetadata.objects.create(run_number=run_number, experiment=self.experiment)
+            for i, obs in enumerate(self.observables):
+                Measurement.objects.create(run_metadata=run, observable=obs,
+                                           value=run_number * 10 + i)
+
+    def test_all(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+
+        table = json.loads(resp.content.decode())
+        self.assertEqual(table['run_numbers'], [0, 1, 2, 3, 4])
+        self.assertEqual(table['observables'][1]['values'], [1, 11, 21, 31, 41])
+
+    def test_filters(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), {'run_min': 1, 'run_max': 2,
+                                                         'observable': [self.observables[2].pk]})
+        self.assertEqual(resp.status_code, 200)
+
+        table = json.loads(resp.content.decode())
+        self.assertEqual(table['run_numbers'], [1, 2])
+        self.assertEqual([obs['name'] for obs in table['observables']], ['Obs2'])
+        self.assertEqual(table['observables'][0]['values'], [12, 22])
+
+    def test_invalid_filter(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name), {'run_min': 'first'})
+        self.assertEqual(resp.status_code, 400)
+
+
 class UploadDataSourceListTestCase(RequiresLoginTestMixin, ManySourcesTestCaseBase):
     def setUp(self):
         super().setUp()
@@ -465,6 +858,50 @@ class SetObservableOrderingTestCase(RequiresLoginTestMixin, NeedsExperimentTestM
         order_after = [o.pk for o in Observable.objects.filter(experiment=self.experiment).order_by('order')]
         self.assertEqual(order_after, new_order)
 
+    def _post_ordering(self, new_order):
+        return self.client.post(reverse(self.view_name), data=json.dumps({'new_order': new_order}),
+                                content_type='application/json')
+
+    def test_single_update(self):
+        self.client.force_login(self.user)
+
+        new_order = [o.pk for o in Observable.objects.filter(experiment=self.experiment).order_by('-pk')]
+        with CaptureQueriesContext(connection) as context:
+            resp = self._post_ordering(new_order)
+        self.assertEqual(resp.status_code, 200)
+
+        queries = [q['sql'] for q in context.captured_queries if '"daq_observable"' in q['sql']]
+        self.assertEqual(len(queries), 2)  # Read the primary keys, then update them all
+        self.assertTrue(queries[1].startswith('UPDATE'))
+
+    def test_rejects_incomplete_ordering(self):
+        self.client.force_login(self.user)
+
+        pks = [o.pk for o in Observable.objects.filter(experiment=self.experiment).order_by('order')]
+        other_experiment = Experiment.objects.create(name='Other')
+        other_obs = Observable.objects.create(name='Other', value_type=Observable.FLOAT, experiment=other_experiment)
+
+        bad_orders = [
+            list(reversed(pks[1:])),                 # Missing one
+            list(reversed(pks)) + [pks[0]],          # Duplicated
+            list(reversed(pks[1:])) + [other_obs.pk],  # From another experiment
+        ]
+        for new_order in bad_orders:
+            resp = self._post_ordering(new_order)
+            self.assertEqual(resp.status_code, 400)
+
+        order_after = [o.pk for o in Observable.objects.filter(experiment=self.experiment).order_by('order', 'pk')]
+        self.assertEqual(order_after, pks)
+
+    def test_invalidates_measurement_table(self):
+        self.client.force_login(self.user)
+        version = get_pivot_version()
+
+        new_order = [o.pk for o in Observable.objects.filter(experiment=self.experiment).order_by('-pk')]
+        self._post_ordering(new_order)
+
+        self.assertNotEqual(get_pivot_version(), version)
+
 
 class ListEccServerViewTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
     def setUp(self):
@@ -1,11 +1,13 @@
 from django.test import TestCase
 from django.core.urlresolvers import reverse
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from unittest.mock import patch
 
-from .helpers import RequiresLoginTestMixin, ManySourcesTestCaseBase
-from ...models import ECCServer, DataRouter, DataSource, Experiment
+from .helpers import RequiresLoginTestMixin, NeedsExperimentTestMixin, ManySourcesTestCaseBase
+from ...models import ECCServer, DataRouter, DataSource, Experiment, ConfigId, Observable
 from ...views.pages import easy_setup
+from ...logtail import LogChunk
 
 
 class StatusTestCase(RequiresLoginTestMixin, ManySourcesTestCaseBase):
@@ -61,10 +63,78 @@ class ChooseConfigTestCase(RequiresLoginTestMixin, TestCase):
     def setUp(self):
         super().setUp()
         self.view_name = 'daq/choose_config'
+        self.user = User.objects.create(username='test', password='test1234')
 
     def test_no_login(self, *args, **kwargs):
         super().test_no_login(rev_args=(1,))
 
+    def _make_ecc_server(self):
+        experiment = Experiment.objects.create(name='Test')
+        return ECCServer.objects.create(
+            name='ECC',
+            ip_address='123.123.123.123',
+            experiment=experiment,
+        )
+
+    @patch('attpcdaq.daq.views.pages.eccserver_refresh_configs_task')
+    @patch('attpcdaq.daq.models.ECCServer.refresh_configs')
+    def test_fetches_configs_if_none(self, mock_refresh, mock_task):
+        ecc = self._make_ecc_server()
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name, args=(ecc.pk,)))
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(mock_refresh.call_count, 1)
+        self.assertEqual(mock_task.delay.call_count, 0)
+
+    @patch('attpcdaq.daq.views.pages.eccserver_refresh_configs_task')
+    @patch('attpcdaq.daq.models.ECCServer.refresh_configs')
+    def test_refreshes_stale_configs_in_background(self, mock_refresh, mock_task):
+        ecc = self._make_ecc_server()
+        ConfigId.objects.create(describe='A', prepare='B', configure='C', ecc_server=ecc)
+        cache.delete(ecc._config_list_cache_key())
+        self.client.force_login(self.user)
+
+        resp = self.client.get(reverse(self.view_name, args=(ecc.pk,)))
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(mock_refresh.call_count, 0)
+        mock_task.delay.assert_called_once_with(ecc.pk)
+
+    @patch('attpcdaq.daq.views.pages.eccserver_refresh_configs_task')
+    @patch('attpcdaq.daq.models.ECCServer.refresh_configs')
+    def test_fresh_configs_not_refreshed(self, mock_refresh, mock_task):
+        ecc = self._make_ecc_server()
+        ConfigId.objects.create(describe='A', prepare='B', configure='C', ecc_server=ecc)
+        cache.set(ecc._config_list_cache_key(), 'now', 60)
+        self.client.force_login(self.user)
+
+        try:
+            resp = self.client.get(reverse(self.view_name, args=(ecc.pk,)))
+        finally:
+            cache.delete(ecc._config_list_cache_key())
+        self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(mock_refresh.call_count, 0)
+        self.assertEqual(mock_task.delay.call_count, 0)
+
+
+class MeasurementChartTestCase(RequiresLoginTestMixin, NeedsExperimentTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.view_name = 'daq/measurement_chart'
+        self.user = User.objects.create(username='test', password='test1234')
+        self.experiment = Experiment.objects.create(name='Test', is_active=True)
+        Observable.objects.create(name='Energy', value_type=Observable.FLOAT, experiment=self.experiment)
+
+    def test_renders_headings(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, 'Energy')
+        self.assertContains(resp, reverse('daq/measurement_pivot'))
+
 
 class ExperimentSettingsTestCase(RequiresLoginTestMixin, TestCase):
     def setUp(self):
@@ -269,7 +339,6 @@ class EasySetupTestCase(TestCase):
         self.easy_setup_test_impl()
 
 
-@patch('attpcdaq.daq.views.pages.WorkerInterface')
 class LogViewerTestCase(RequiresLoginTestMixin, TestCase):
     def setUp(self):
         self.view_name = 'daq/show_log'
@@ -296,33 +365,97 @@ class LogViewerTestCase(RequiresLoginTestMixin, TestCase):
     def test_no_login(self, *args, **kwargs):
         super().test_no_login(rev_args=('ecc', 0))
 
-    def _log_test_impl(self, mock_worker_interface, target):
+    @patch('attpcdaq.daq.logtail.WorkerInterface')
+    def _log_test_impl(self, program, target, mock_worker_interface):
         self.client.force_login(self.user)
-        fake_log = "Test data"
 
-        wi = mock_worker_interface.return_value
-        wi_as_context_mgr = wi.__enter__.return_value
-        wi_as_context_mgr.tail_file.return_value = fake_log
+        resp = self.client.get(reverse(self.view_name, args=(program, target.pk)))
+        self.assertEqual(resp.status_code, 200)
 
-        if isinstance(target, ECCServer):
-            url = reverse('daq/show_log', args=('ecc', target.pk))
-        elif isinstance(target, DataRouter):
-            url = reverse('daq/show_log', args=('data_router', target.pk))
-        else:
-            raise ValueError('Invalid target class')
+        self.assertEqual(resp.context['stream_url'], reverse('daq/stream_log', args=(program, target.pk)))
+        mock_worker_interface.assert_not_called()
+
+    def test_ecc_log(self):
+        self._log_test_impl('ecc', self.ecc)
+
+    def test_data_router_log(self):
+        self._log_test_impl('data_router', self.data_router)
 
-        resp = self.client.get(url)
+    def test_missing_object(self):
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=('ecc', self.ecc.pk + 100)))
+        self.assertEqual(resp.status_code, 404)
+
+
+@patch('attpcdaq.daq.views.pages.log_tail_registry')
+class StreamLogTestCase(RequiresLoginTestMixin, TestCase):
+    def setUp(self):
+        self.view_name = 'daq/stream_log'
+
+        self.experiment = Experiment.objects.create(
+            name='Test',
+        )
+        self.ecc = ECCServer.objects.create(
+            name='ECC',
+            ip_address='123.456.789.1',
+            experiment=self.experiment,
+        )
+        self.user = User.objects.create(
+            username='test',
+            password='test1234',
+        )
+
+    def test_no_login(self, mock_registry):
+        super().test_no_login(rev_args=('ecc', 0))
+
+    def _get_stream(self, mock_registry, chunks, error='Connection lost', **extra):
+        tail = mock_registry.subscribe.return_value
+        tail.read_since.side_effect = [chunks, []]
+        tail.error = error
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=('ecc', self.ecc.pk)), **extra)
         self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+
+        content = b''.join(resp.streaming_content).decode('utf-8')
+        return tail, content
 
-        self.assertEqual(resp.context['log_content'], fake_log)
-        mock_worker_interface.assert_called_once_with(target.ip_address)
-        wi_as_context_mgr.tail_file.assert_called_once_with(target.log_path)
+    def test_stream(self, mock_registry):
+        tail, content = self._get_stream(mock_registry, [LogChunk(1, 0, 18, 'line one\nline two\n'),
+                                                         LogChunk(2, 18, 29, 'line three\n')])
+
+        mock_registry.subscribe.assert_called_once_with(self.ecc.ip_address, self.ecc.log_path)
+        mock_registry.unsubscribe.assert_called_once_with(tail)
+
+        expected = ('id: 18\ndata: line one\ndata: line two\n\n'
+                    'id: 29\ndata: line three\n\n'
+                    'event: tail-error\ndata: Connection lost\n\n')
+        self.assertEqual(content, expected)
+
+    def test_resume_from_last_event_id(self, mock_registry):
+        tail = mock_registry.subscribe.return_value
+        tail.read_from_offset.return_value = (3, [LogChunk(3, 18, 29, 'line three\n')])
+        tail, content = self._get_stream(mock_registry, [], HTTP_LAST_EVENT_ID='18')
+
+        self.assertEqual(tail.read_from_offset.call_args[0][0], 18)
+        self.assertEqual(tail.read_since.call_args_list[0][0][0], 3)
+        self.assertTrue(content.startswith('id: 29\ndata: line three\n\n'))
+
+    def test_keepalive(self, mock_registry):
+        tail = mock_registry.subscribe.return_value
+        tail.read_since.side_effect = [[], [LogChunk(1, 0, 5, 'text\n')], []]
+        tail.error = None
+
+        self.client.force_login(self.user)
+        resp = self.client.get(reverse(self.view_name, args=('ecc', self.ecc.pk)))
 
-    def test_ecc_log(self, mock_worker_interface):
-        self._log_test_impl(mock_worker_interface, self.ecc)
+        stream = iter(resp.streaming_content)
+        self.assertEqual(next(stream), b': keepalive\n\n')
+        self.assertEqual(next(stream), b'id: 5\ndata: text\n\n')
+        resp.close()
 
-    def test_data_router_log(self, mock_worker_interface):
-        self._log_test_impl(mock_worker_interface, self.data_router)
+        mock_registry.unsubscribe.assert_called_once_with(tail)
 
 
 class ExperimentChoiceViewTestCase(RequiresLoginTestMixin, TestCase):
@@ -0,0 +1,137 @@
+"""Multi-step transitions of the whole system
+
+The ECC servers can only move one step through the CoBo state machine at a time (see
+:meth:`~attpcdaq.daq.models.ECCServer.change_state`). This module drives a set of ECC servers from whatever
+states they're in to a target state by performing the intermediate transitions for them. Each step is sent to
+all of the servers at once, and the next step starts as soon as they have all finished the previous one.
+
+"""
+
+import time
+
+from .models import ECCServer
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _next_state(current_state, target_state):
+    """Find the state one step from ``current_state`` in the direction of ``target_state``."""
+    if target_state > current_state:
+        return current_state + 1
+    elif target_state < current_state:
+        return current_state - 1
+    else:
+        return current_state
+
+
+class SystemTransition(object):
+    """Moves a set of ECC servers to a target state, one step at a time.
+
+    Before the first step, this waits for any transitions that are already in progress to finish. Then, at each
+    step, every server that hasn't reached the target state is told to move one state closer to it using
+    :meth:`~attpcdaq.daq.models.ECCServer.change_state_many`. The servers are then polled with
+    :meth:`~attpcdaq.daq.models.ECCServer.refresh_state_many` until they have all finished. Polling starts quickly
+    and slows down by ``backoff_factor`` each time the servers are found to still be busy, so short transitions are
+    noticed right away without flooding the ECC servers during long ones.
+
+    If any server fails to make a transition, ends up in the wrong state, or takes longer than ``step_timeout``
+    seconds, the process stops after the current step and the errors are returned.
+
+    Parameters
+    ----------
+    ecc_servers : iterable of ECCServer
+        The servers to transition. Their configs and data sources should be loaded beforehand
+        (see :meth:`~attpcdaq.daq.models.ECCServer.change_state_many`).
+    target_state : int
+        The state to move the servers to.
+    step_timeout : float, optional
+        The maximum number of seconds to wait for the servers to finish one step.
+    initial_poll_interval : float, optional
+        The number of seconds to wait before checking the state of the servers for the first time in a step.
+    max_poll_interval : float, optional
+        The longest time to wait between checks of the state.
+    backoff_factor : float, optional
+        The factor by which the time between checks grows.
+
+    """
+    def __init__(self, ecc_servers, target_state, step_timeout=300, initial_poll_interval=0.25,
+                 max_poll_interval=5, backoff_factor=1.5):
+        self.ecc_servers = list(ecc_servers)
+        self.target_state = target_state
+        self.step_timeout = step_timeout
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
+
+        #: Maps each ECC server that failed to a description of the error
+        self.errors = {}
+
+    def run(self):
+        """Perform the transition.
+
+        Returns
+        -------
+        dict
+            Maps the ECC servers that failed to a description of the error. This is empty if all of the servers
+            reached the target state.
+
+        """
+        self._wait(self.ecc_servers)
+
+        while not self.errors:
+            steps = {ecc: _next_state(ecc.state, self.target_state) for ecc in self.ecc_servers
+                     if ecc.state != self.target_state}
+            if not steps:
+                break
+
+            # The servers might be in different states to begin with, so they might need different transitions
+            for step_state in set(steps.values()):
+                group = [ecc for ecc, state in steps.items() if state == step_state]
+                self.errors.update(ECCServer.change_state_many(group, step_state))
+
+            if not self.errors:
+                self._wait(list(steps), steps)
+
+        return self.errors
+
+    def _wait(self, ecc_servers, expected_states=None):
+        """Poll the given servers until they have all finished transitioning.
+
+        Servers that stop in a state other than their expected one, if one is given, are recorded as errors. A server
+        still in its original state that isn't transitioning is assumed not to have started its transition yet.
+
+        """
+        if expected_states is None:
+            expected_states = {}
+
+        start_states = {ecc: ecc.state for ecc in ecc_servers}
+        waiting = set(ecc_servers)
+        interval = self.initial_poll_interval
+        deadline = time.monotonic() + self.step_timeout
+
+        while True:
+            ECCServer.refresh_state_many(waiting)
+
+            for ecc in list(waiting):
+                if ecc.is_transitioning:
+                    continue
+
+                expected = expected_states.get(ecc)
+                if expected is None or ecc.state == expected:
+                    waiting.discard(ecc)
+                elif ecc.state != start_states[ecc]:
+                    waiting.discard(ecc)
+                    self.errors[ecc] = 'Ended up {} instead of {}'.format(ecc.get_state_display(),
+                                                                          ECCServer.STATE_DICT[expected])
+
+            if not waiting:
+                return
+
+            if time.monotonic() >= deadline:
+                for ecc in waiting:
+                    self.errors[ecc] = 'Timed out in state {}'.format(ecc.get_state_display())
+                return
+
+            time.sleep(interval)
+            interval = min(interval * self.backoff_factor, self.max_poll_interval)
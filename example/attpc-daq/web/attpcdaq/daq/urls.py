@@ -17,6 +17,7 @@ urlpatterns = [
     url(r'^sources/edit/(?P<pk>\d+)$', views.UpdateDataSourceView.as_view(), name='daq/update_source'),
     url(r'^sources/remove/(?P<pk>\d+)$', views.RemoveDataSourceView.as_view(), name='daq/remove_source'),
     url(r'^sources/refresh_state_all$', views.refresh_state_all, name='daq/source_refresh_state_all'),
+    url(r'^sources/stream_status/$', views.stream_status, name='daq/source_stream_status'),
     url(r'^sources/change_state/$', views.source_change_state, name='daq/source_change_state'),
     url(r'^sources/change_state_all/$', views.source_change_state_all, name='daq/source_change_state_all'),
     url(r'^sources/choose_config/(\d+)$', views.choose_config, name='daq/choose_config'),
@@ -46,10 +47,12 @@ urlpatterns = [
     url(r'^observables/set_ordering$', views.set_observable_ordering, name='daq/set_observable_ordering'),
 
     url(r'^measurements/$', views.measurement_chart, name='daq/measurement_chart'),
+    url(r'^measurements/pivot$', views.measurement_pivot, name='daq/measurement_pivot'),
 
     url(r'^experiment_settings/$', views.experiment_settings, name='daq/experiment_settings'),
 
     url(r'^status/(?P<program>ecc|data_router)_log/(?P<pk>\d+)/$', views.show_log_page, name='daq/show_log'),
+    url(r'^status/(?P<program>ecc|data_router)_log/(?P<pk>\d+)/stream/$', views.stream_log, name='daq/stream_log'),
 
     url(r'^easy_setup/$', views.EasySetupPage.as_view(), name='daq/easy_setup'),
 ]
@@ -1,12 +1,12 @@
-from .api import refresh_state_all, source_change_state, source_change_state_all
+from .api import refresh_state_all, stream_status, source_change_state, source_change_state_all
 from .api import AddDataSourceView, ListDataSourcesView, UpdateDataSourceView, RemoveDataSourceView
 from .api import AddECCServerView, ListECCServersView, UpdateECCServerView, RemoveECCServerView
 from .api import AddDataRouterView, ListDataRoutersView, UpdateDataRouterView, RemoveDataRouterView
 from .api import ListRunMetadataView, UpdateRunMetadataView, UpdateLatestRunMetadataView
 from .api import ListObservablesView, AddObservableView, UpdateObservableView, RemoveObservableView
-from .api import set_observable_ordering, AddExperimentView
+from .api import set_observable_ordering, measurement_pivot, AddExperimentView
 
 from .io import download_run_metadata, download_datasource_list, upload_datasource_list
 
-from .pages import (status, choose_config, experiment_settings, show_log_page, EasySetupPage,
+from .pages import (status, choose_config, experiment_settings, show_log_page, stream_log, EasySetupPage,
                     measurement_chart, ExperimentChoiceView)
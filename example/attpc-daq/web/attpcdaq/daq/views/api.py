@@ -7,22 +7,32 @@ views that control refreshing the state of the system and changing the state.
 """
 
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponseNotAllowed, HttpResponseBadRequest, JsonResponse
+from django.http import (HttpResponseNotAllowed, HttpResponseBadRequest, HttpResponseNotModified, JsonResponse,
+                         StreamingHttpResponse)
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.views.generic.list import ListView
 from django.views.generic import RedirectView
 from django.core.urlresolvers import reverse_lazy
+from django.utils.http import parse_etags
+from django.db import transaction
 
 from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Experiment, Observable
-from ..models import ECCError
 from ..forms import DataSourceForm, ECCServerForm, RunMetadataForm, DataRouterForm, ObservableForm, NewExperimentForm
-from ..tasks import eccserver_change_state_task, organize_files_all_task, backup_config_files_all_task
-from .helpers import get_status, calculate_overall_state
+from ..tasks import eccserver_change_state_task, eccserver_change_state_all_task, eccserver_transition_all_task
+from ..tasks import update_run_for_state
+from ..statuscache import get_status_version, bump_status_version, status_watcher
+from ..schedules import mark_busy
+from ..pivot import get_measurement_pivot, filter_pivot, bump_pivot_version
+from ..dbutils import bulk_update
+from .helpers import get_status, get_status_snapshot, load_status_snapshot, status_from_snapshot, diff_status
+from .helpers import calculate_overall_state
 from ..middleware import needs_experiment, NeedsExperimentMixin
 
 import json
+import time
+import threading
 
 import logging
 logger = logging.getLogger(__name__)
@@ -41,6 +51,10 @@ def refresh_state_all(request):
         This function does *not* communicate with the ECC server in any way. To contact the ECC server and update
         the state stored in the database, call :meth:`attpcdaq.daq.models.ECCServer.refresh_state` instead.
 
+    The status is served from the cache using :func:`~attpcdaq.daq.views.helpers.get_status_snapshot`, and the
+    response includes an ``ETag`` header. If the request's ``If-None-Match`` header matches the current tag,
+    an empty response with status 304 (Not Modified) is returned instead.
+
     The JSON array returned will contain the following keys:
 
     overall_state
@@ -89,9 +103,130 @@ def refresh_state_all(request):
         logger.error('Received non-GET HTTP request %s', request.method)
         return HttpResponseNotAllowed(['GET'])
 
-    output = get_status(request)
+    etag, output = get_status_snapshot(request)
 
-    return JsonResponse(output)
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        response = JsonResponse(output)
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+#: The maximum number of seconds that a status stream stays open. The browser reconnects automatically after this.
+STATUS_STREAM_MAX_DURATION = 300
+
+#: The number of seconds between keepalive comments sent on a status stream if nothing changes.
+STATUS_STREAM_KEEPALIVE_INTERVAL = 15
+
+#: The number of seconds between updates of the run duration sent on a status stream while a run is in progress.
+STATUS_STREAM_DURATION_INTERVAL = 1
+
+#: The most status streams that each server process keeps open at once. Each stream occupies one of the server's
+#: threads (see ``django_entrypoint.sh``), so this leaves threads free for other requests.
+STATUS_STREAM_MAX_OPEN = 24
+
+_status_stream_slots = threading.BoundedSemaphore(STATUS_STREAM_MAX_OPEN)
+
+
+def _format_status_event(event, data):
+    """Format a status or status diff as a server-sent event."""
+    return 'event: {}\ndata: {}\n\n'.format(event, json.dumps(data))
+
+
+@login_required
+@needs_experiment
+def stream_status(request):
+    """Push changes to the state of the system to the client as server-sent events.
+
+    This is an alternative to polling :func:`refresh_state_all`. The first event sent is a ``status`` event
+    containing the full status, in the same format as :func:`refresh_state_all`. After that, whenever the
+    status changes, a ``status-diff`` event is sent with only the values that changed, as found by
+    :func:`~attpcdaq.daq.views.helpers.diff_status`. If a source is added or removed, a full ``status`` event
+    is sent again instead.
+
+    The stream waits on the :data:`~attpcdaq.daq.statuscache.status_watcher` for the status version to change.
+    The version is increased when an ECC server, data router, or run is saved by any process, including the Celery
+    workers, and only then is the new status loaded with :func:`~attpcdaq.daq.views.helpers.load_status_snapshot`.
+    While a run is in progress, the run duration is updated from the status already loaded every
+    :data:`STATUS_STREAM_DURATION_INTERVAL` seconds.
+
+    Each stream occupies a server thread while it waits, so at most :data:`STATUS_STREAM_MAX_OPEN` streams are kept
+    open by each server process. If that many are already open, a single ``use-polling`` event is sent and the
+    stream ends. The client should then poll :func:`refresh_state_all` instead. The stream is also closed after
+    :data:`STATUS_STREAM_MAX_DURATION` seconds so that it doesn't occupy a server thread forever. Browsers
+    reconnect to event streams automatically.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object. The method must be GET.
+
+    Returns
+    -------
+    StreamingHttpResponse
+        The event stream.
+
+    """
+    if request.method != 'GET':
+        logger.error('Received non-GET HTTP request %s', request.method)
+        return HttpResponseNotAllowed(['GET'])
+
+    def event_stream():
+        # The slot is taken here rather than in the view so that it's always released by the finally clause
+        if not _status_stream_slots.acquire(blocking=False):
+            logger.warning('Too many status streams are open. Asking the client to poll instead.')
+            yield 'event: use-polling\ndata: {}\n\n'
+            return
+
+        status_watcher.subscribe()
+        try:
+            version = get_status_version()
+            snapshot = load_status_snapshot(request, version)
+            etag, status = status_from_snapshot(request, version, snapshot)
+            yield _format_status_event('status', status)
+
+            start_time = last_event_time = time.monotonic()
+            while True:
+                now = time.monotonic()
+                remaining = STATUS_STREAM_MAX_DURATION - (now - start_time)
+                if remaining <= 0:
+                    break
+
+                if snapshot['run_start'] is not None and snapshot['run_stop'] is None:
+                    timeout = STATUS_STREAM_DURATION_INTERVAL
+                else:
+                    timeout = max(0, STATUS_STREAM_KEEPALIVE_INTERVAL - (now - last_event_time))
+
+                new_version = status_watcher.wait_for_change(version, min(timeout, remaining))
+                if new_version != version:
+                    version = new_version
+                    snapshot = load_status_snapshot(request, version)
+
+                new_etag, new_status = status_from_snapshot(request, version, snapshot)
+                if new_etag != etag:
+                    diff = diff_status(status, new_status)
+                    if diff is None:
+                        yield _format_status_event('status', new_status)
+                    else:
+                        yield _format_status_event('status-diff', diff)
+
+                    etag, status = new_etag, new_status
+                    last_event_time = time.monotonic()
+
+                elif time.monotonic() - last_event_time >= STATUS_STREAM_KEEPALIVE_INTERVAL:
+                    yield ': keepalive\n\n'
+                    last_event_time = time.monotonic()
+        finally:
+            status_watcher.unsubscribe()
+            _status_stream_slots.release()
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
 
 
 @login_required
@@ -134,6 +269,7 @@ def source_change_state(request):
     try:
         ecc_server.is_transitioning = True
         ecc_server.save()
+        mark_busy()
         eccserver_change_state_task.delay(ecc_server.pk, target_state)
     except Exception:
         logger.exception('Error while submitting change-state task')
@@ -148,7 +284,16 @@ def source_change_state(request):
 def source_change_state_all(request):
     """Send requests to change the state of all ECC servers.
 
-    The requests are queued to be performed asynchronously.
+    All of the ECC servers in the experiment are marked as transitioning with one query, and a single task is
+    queued to perform the transitions asynchronously. If every server is one step away from the target state, this
+    is :func:`~attpcdaq.daq.tasks.eccserver_change_state_all_task`. Otherwise,
+    :func:`~attpcdaq.daq.tasks.eccserver_transition_all_task` is used to step the servers through the
+    intermediate states. Either task logs whether the transition succeeded for the whole system.
+
+    Moving to the running or ready state also starts or stops a run with
+    :func:`~attpcdaq.daq.tasks.update_run_for_state`. For a single step, this is done right away. Otherwise, the
+    multi-step task does it once every server has reached the target state, so no run is started or stopped if the
+    transition fails.
 
     Parameters
     ----------
@@ -188,25 +333,28 @@ def source_change_state_all(request):
             logger.error('Data routers are not ready')
             return HttpResponseBadRequest('Data routers are not ready')
 
-    for ecc_server in ECCServer.objects.filter(experiment=request.experiment):
-        try:
-            ecc_server.is_transitioning = True
-            ecc_server.save()
-            eccserver_change_state_task.delay(ecc_server.pk, target_state)
-        except (ECCError, ValueError):
-            logger.exception('Failed to submit change_state task for ECC server %s', ecc_server.name)
-
     experiment = request.experiment
+    ecc_servers = ECCServer.objects.filter(experiment=experiment)
 
-    is_starting = target_state == ECCServer.RUNNING and not experiment.is_running
-    is_stopping = target_state == ECCServer.READY and experiment.is_running
+    # Servers that are more than one step away need the intermediate transitions done for them
+    states = set(ecc_servers.values_list('state', flat=True))
+    is_single_step = all(abs(state - target_state) == 1 for state in states)
+
+    ecc_servers.update(is_transitioning=True)
+    transaction.on_commit(bump_status_version)  # update() doesn't send the post_save signal
+    mark_busy()
+
+    try:
+        if is_single_step:
+            eccserver_change_state_all_task.delay(experiment.pk, target_state)
+        else:
+            eccserver_transition_all_task.delay(experiment.pk, target_state)
+    except Exception:
+        logger.exception('Failed to submit change_state task for all ECC servers')
 
-    if is_starting:
-        experiment.start_run()
-    elif is_stopping:
-        experiment.stop_run()
-        organize_files_all_task.delay(experiment.pk, experiment.latest_run.pk)
-        backup_config_files_all_task.delay(experiment.pk, experiment.latest_run.pk)
+    # The multi-step task starts or stops the run itself once the last step has succeeded
+    if is_single_step:
+        update_run_for_state(experiment, target_state)
 
     output = get_status(request)
 
@@ -220,6 +368,10 @@ def set_observable_ordering(request):
 
     The request should be submitted via POST, and the request body should be JSON encoded. The content should be
     be dictionary with the key "new_order" mapped to a list of Observable primary keys in the desired order.
+    The list must contain each of the current experiment's observables exactly once.
+
+    The new order is written with a single UPDATE query in a transaction, so the observables are never
+    left partly reordered.
 
     Parameters
     ----------
@@ -243,6 +395,9 @@ def set_observable_ordering(request):
     except KeyError:
         logger.error('Must include new ordering as key "new_order".')
         return HttpResponseBadRequest('Must include new ordering as key "new_order".')
+    except ValueError:
+        logger.exception('Request body was not valid JSON')
+        return HttpResponseBadRequest('Request body was not valid JSON')
 
     try:
         new_order = [int(i) for i in new_order]
@@ -251,16 +406,58 @@ def set_observable_ordering(request):
         return HttpResponseBadRequest('Provided ordering was invalid')
 
     experiment = request.experiment
-    observables = Observable.objects.filter(experiment=experiment)
 
-    for i, pk in enumerate(new_order):
-        obs = observables.get(pk=pk)
-        obs.order = i
-        obs.save()
+    with transaction.atomic():
+        current_pks = set(Observable.objects.filter(experiment=experiment).values_list('pk', flat=True))
+        if len(new_order) != len(current_pks) or set(new_order) != current_pks:
+            logger.error('Provided ordering did not match the observables for this experiment')
+            return HttpResponseBadRequest('Ordering must include each observable for this experiment exactly once')
+
+        bulk_update([Observable(pk=pk, order=i) for i, pk in enumerate(new_order)], ['order'])
+
+    bump_pivot_version()  # The measurement table is in this order, and bulk_update doesn't send signals
 
     return JsonResponse({'success': True})
 
 
+def _optional_int(value):
+    return int(value) if value not in (None, '') else None
+
+
+@login_required
+@needs_experiment
+def measurement_pivot(request):
+    """An AJAX request that returns the measurements of the current experiment as a table.
+
+    The table is built by :func:`~attpcdaq.daq.pivot.get_measurement_pivot` and is cached until a run, observable,
+    or measurement changes. It can be limited with these GET parameters:
+
+    - ``run_min`` and ``run_max`` give the range of run numbers, inclusive.
+    - ``observable`` gives the primary key of an observable to include. It can be repeated.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request.
+
+    Returns
+    -------
+    JsonResponse
+        The table, in the format described in :func:`~attpcdaq.daq.pivot.build_measurement_pivot`. If the
+        parameters aren't integers, a 400 error is returned instead.
+
+    """
+    try:
+        run_min = _optional_int(request.GET.get('run_min'))
+        run_max = _optional_int(request.GET.get('run_max'))
+        observable_pks = [int(pk) for pk in request.GET.getlist('observable')]
+    except ValueError:
+        return HttpResponseBadRequest('Filters must be integers')
+
+    pivot = get_measurement_pivot(request.experiment)
+    return JsonResponse(filter_pivot(pivot, run_min, run_max, observable_pks or None))
+
+
 class PanelTitleMixin(object):
     """A mixin that provides a panel title to be used in a template.
 
@@ -5,7 +5,11 @@ could be shared between multiple views.
 
 """
 
-from ..models import ECCServer, DataRouter
+from django.core.cache import cache
+from django.utils.http import quote_etag
+
+from ..models import ECCServer, DataRouter, RunMetadata
+from ..statuscache import get_status_version
 
 import logging
 logger = logging.getLogger(__name__)
@@ -28,11 +32,11 @@ def calculate_overall_state(request):
         consistent state.
 
     """
-    ecc_server_list = ECCServer.objects.filter(experiment=request.experiment)
+    ecc_server_list = list(ECCServer.objects.filter(experiment=request.experiment))
     if len(set(s.state for s in ecc_server_list)) == 1:
         # All states are the same
-        overall_state = ecc_server_list.first().state
-        overall_state_name = ecc_server_list.first().get_state_display()
+        overall_state = ecc_server_list[0].state
+        overall_state_name = ecc_server_list[0].get_state_display()
     else:
         overall_state = None
         overall_state_name = 'Mixed'
@@ -92,6 +96,10 @@ def get_data_router_statuses(request):
         Whether the router is available.
     'is_clean'
         Whether the staging directory is clean.
+    'organize_files_done'
+        The number of files moved so far by the most recent file organization.
+    'organize_files_total'
+        The number of files to be moved by the most recent file organization.
 
     Returns
     -------
@@ -106,6 +114,8 @@ def get_data_router_statuses(request):
             'pk': router.pk,
             'is_online': router.is_online,
             'is_clean': router.staging_directory_is_clean,
+            'organize_files_done': router.organize_files_done,
+            'organize_files_total': router.organize_files_total,
         }
         data_router_status_list.append(router_res)
 
@@ -184,3 +194,133 @@ def get_status(request):
     }
 
     return output
+
+
+#: The number of seconds that a status snapshot is kept in the cache
+STATUS_SNAPSHOT_TIMEOUT = 300
+
+
+def load_status_snapshot(request, version):
+    """Get the cached status for the given status version, building it with :func:`get_status` if needed.
+
+    The snapshot is stored in the cache under the version number from
+    :func:`~attpcdaq.daq.statuscache.get_status_version`, so it is rebuilt after anything shown on the status
+    page changes. Use :func:`status_from_snapshot` to get the status with the current run duration.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+    version : int
+        The current status version.
+
+    Returns
+    -------
+    dict
+        The snapshot, which holds the status and the start and stop times of the latest run.
+
+    """
+    key = 'daq:status:snapshot:{}:{}'.format(request.experiment.pk, version)
+
+    snapshot = cache.get(key)
+    if snapshot is None:
+        current_run = request.experiment.latest_run
+        snapshot = {
+            'status': get_status(request),
+            'run_start': current_run.start_datetime if current_run is not None else None,
+            'run_stop': current_run.stop_datetime if current_run is not None else None,
+        }
+        cache.set(key, snapshot, STATUS_SNAPSHOT_TIMEOUT)
+
+    return snapshot
+
+
+def status_from_snapshot(request, version, snapshot):
+    """Get the status from a snapshot loaded by :func:`load_status_snapshot`.
+
+    The run duration is the only value that changes on its own. If a run is in progress, it is recalculated from
+    the snapshot's start time each time this is called. This doesn't use the cache or the database.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+    version : int
+        The status version that the snapshot was loaded for.
+    snapshot : dict
+        The snapshot.
+
+    Returns
+    -------
+    etag : str
+        A quoted entity tag that changes whenever the returned status changes.
+    status : dict
+        The status, in the format returned by :func:`get_status`.
+
+    """
+    status = snapshot['status']
+    etag = '{}-{}'.format(request.experiment.pk, version)
+
+    if snapshot['run_start'] is not None and snapshot['run_stop'] is None:
+        duration_str = RunMetadata(start_datetime=snapshot['run_start']).duration_string
+        status = dict(status, run_duration=duration_str)
+        etag += '-' + duration_str.replace(':', '')
+
+    return quote_etag(etag), status
+
+
+def get_status_snapshot(request):
+    """Get the system status from the cache, building it with :func:`get_status` if needed.
+
+    This combines :func:`load_status_snapshot` and :func:`status_from_snapshot` for the current status version.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+
+    Returns
+    -------
+    etag : str
+        A quoted entity tag that changes whenever the returned status changes.
+    status : dict
+        The status, in the format returned by :func:`get_status`.
+
+    """
+    version = get_status_version()
+    return status_from_snapshot(request, version, load_status_snapshot(request, version))
+
+
+def diff_status(old, new):
+    """Find what changed between two statuses returned by :func:`get_status`.
+
+    The top-level values that changed are included in the result as they are. For the lists of ECC server and
+    data router statuses, only the items that changed are included, matched using their ``pk``.
+
+    Parameters
+    ----------
+    old, new : dict
+        The previous and current status.
+
+    Returns
+    -------
+    dict or None
+        The changed values. This is None if the sources in the two lists differ (e.g. if one was added or removed),
+        in which case the whole new status should be used instead.
+
+    """
+    diff = {}
+    for key, value in new.items():
+        if key in ('ecc_server_status_list', 'data_router_status_list'):
+            old_items = {item['pk']: item for item in old.get(key, [])}
+            if set(old_items) != set(item['pk'] for item in value):
+                return None
+
+            changed = [item for item in value if old_items[item['pk']] != item]
+            if changed:
+                diff[key] = changed
+
+        elif key not in old or old[key] != value:
+            diff[key] = value
+
+    return diff
@@ -7,46 +7,141 @@ create entries in the database from it.
 """
 
 from django.shortcuts import render, redirect
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse, HttpResponseBadRequest
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
 from django.core import serializers
 from django.db import transaction
+from django.db.models import Prefetch, Q
+from django.core.serializers.json import DjangoJSONEncoder
 
 from ..models import DataSource, RunMetadata, Observable, Measurement
 from ..forms import DataSourceListUploadForm
 from ..middleware import needs_experiment
 
 import csv
+import json
 
 import logging
 logger = logging.getLogger(__name__)
 
 
+#: The fields of :class:`~attpcdaq.daq.models.RunMetadata` included in the run metadata downloads
+RUN_METADATA_EXPORT_FIELDS = ['run_number', 'run_class', 'title', 'start_datetime', 'stop_datetime', 'config_name']
+
+
+def _iter_runs_with_measurements(experiment, observables, chunk_size=500):
+    """Iterate over the runs in an experiment along with their measurements.
+
+    The runs are fetched ``chunk_size`` at a time, and the measurements of each chunk are fetched together
+    using ``prefetch_related``, so only two queries are made per chunk no matter how many observables there are.
+    Each chunk starts after the run number and primary key of the last run in the previous chunk, rather than at an
+    offset, so that later chunks cost no more than the first one and runs added during the download can't shift
+    rows into or out of a chunk.
+
+    Parameters
+    ----------
+    experiment : attpcdaq.daq.models.Experiment
+        The experiment.
+    observables : list of attpcdaq.daq.models.Observable
+        The experiment's observables.
+    chunk_size : int, optional
+        The number of runs to load at once.
+
+    Yields
+    ------
+    run : attpcdaq.daq.models.RunMetadata
+        A run, in order of run number.
+    values : dict
+        Maps the name of each observable to the value measured in the run. The value is None if the
+        observable wasn't measured.
+
+    """
+    observable_names = {obs.pk: obs.name for obs in observables}
+    runs = RunMetadata.objects.filter(experiment=experiment).order_by('run_number', 'pk')
+    measurements = Prefetch('measurement_set', queryset=Measurement.objects.filter(observable__in=observables))
+
+    remaining = runs
+    while True:
+        chunk = list(remaining[:chunk_size].prefetch_related(measurements))
+
+        for run in chunk:
+            values = {obs.name: None for obs in observables}
+            for measurement in run.measurement_set.all():
+                values[observable_names[measurement.observable_id]] = measurement.value
+            yield run, values
+
+        if len(chunk) < chunk_size:
+            break
+
+        last = chunk[-1]
+        remaining = runs.filter(Q(run_number__gt=last.run_number) | Q(run_number=last.run_number, pk__gt=last.pk))
+
+
+class _Echo(object):
+    """A file-like object that returns what is written to it, so that ``csv.writer`` can be used with a generator."""
+    def write(self, value):
+        return value
+
+
+def _run_metadata_csv(experiment, observables):
+    writer = csv.writer(_Echo())
+    measurement_fields = [obs.name for obs in observables]
+
+    yield writer.writerow([RunMetadata._meta.get_field(f).verbose_name for f in RUN_METADATA_EXPORT_FIELDS]
+                          + measurement_fields)
+
+    for run, values in _iter_runs_with_measurements(experiment, observables):
+        row_items = [getattr(run, field) for field in RUN_METADATA_EXPORT_FIELDS]
+        row_items += [values[field] for field in measurement_fields]
+        yield writer.writerow(row_items)
+
+
+def _run_metadata_json_lines(experiment, observables):
+    for run, values in _iter_runs_with_measurements(experiment, observables):
+        item = {field: getattr(run, field) for field in RUN_METADATA_EXPORT_FIELDS}
+        item['measurements'] = values
+        yield json.dumps(item, cls=DjangoJSONEncoder) + '\n'
+
+
 @login_required
 @needs_experiment
 def download_run_metadata(request):
-    experiment = request.experiment
-    observables = Observable.objects.filter(experiment=experiment)
-
-    run_fields = ['run_number', 'run_class', 'title', 'start_datetime', 'stop_datetime', 'config_name']
-    measurement_fields = [obs.name for obs in observables]
+    """Download the metadata and measurements of all runs in the current experiment.
 
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="{:s} run metadata.csv"'.format(experiment.name)
+    The file is generated while it's being sent using a ``StreamingHttpResponse``, so the whole file is never held
+    in memory. The format is chosen with the ``format`` query parameter:
 
-    writer = csv.writer(response)
-    writer.writerow([RunMetadata._meta.get_field(f).verbose_name for f in run_fields] + measurement_fields)
+    - ``csv`` (the default) gives a CSV file with one row per run and one column per observable.
+    - ``jsonl`` gives a JSON lines file with one object per run. The measurements are in a nested object.
 
-    for run in RunMetadata.objects.order_by('run_number'):
-        measurement_qset = Measurement.objects.filter(run_metadata=run).select_related('observable')
-        measurement_dict = {m.observable.name: m.value for m in measurement_qset}
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object
 
-        row_items = [getattr(run, field) for field in run_fields]
-        row_items += [measurement_dict[field] for field in measurement_fields]
+    Returns
+    -------
+    StreamingHttpResponse
+        The file, as an attachment. If the format is unknown, a 400 error is returned instead.
 
-        writer.writerow(row_items)
+    """
+    experiment = request.experiment
+    observables = list(Observable.objects.filter(experiment=experiment))
+
+    output_format = request.GET.get('format', 'csv')
+    if output_format == 'csv':
+        content = _run_metadata_csv(experiment, observables)
+        content_type = 'text/csv'
+    elif output_format == 'jsonl':
+        content = _run_metadata_json_lines(experiment, observables)
+        content_type = 'application/x-ndjson'
+    else:
+        return HttpResponseBadRequest('Unknown format: {}'.format(output_format))
 
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="{:s} run metadata.{:s}"'.format(experiment.name,
+                                                                                             output_format)
     return response
 
 
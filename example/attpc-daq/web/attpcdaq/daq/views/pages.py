@@ -5,22 +5,24 @@ The views in this module render the pages of the web app.
 """
 
 from django.shortcuts import render, get_object_or_404, redirect
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.urlresolvers import reverse, reverse_lazy
 from django.db import transaction
 from django.views.generic.edit import FormView
 
-from ..models import DataSource, ECCServer, DataRouter, RunMetadata, Observable, Measurement
+from ..models import DataSource, ECCServer, DataRouter, Observable
 from ..forms import ExperimentForm, ConfigSelectionForm, EasySetupForm, ExperimentChoiceForm
-from ..workertasks import WorkerInterface
+from ..logtail import log_tail_registry
+from ..tasks import eccserver_refresh_configs_task
 from ..middleware import needs_experiment, NeedsExperimentMixin
 from .api import PanelTitleMixin
 from .helpers import calculate_overall_state
 
 from attpcdaq.logs.models import LogEntry
 
+import time
 import logging
 logger = logging.getLogger(__name__)
 
@@ -69,7 +71,10 @@ def status(request):
 def choose_config(request, pk):
     """Renders a page for choosing the config for an ECC server.
 
-    This renders the :class:`~attpcdaq.daq.forms.ConfigSelectionForm` to pick the configuration.
+    This renders the :class:`~attpcdaq.daq.forms.ConfigSelectionForm` to pick the configuration. The form lists
+    the configs stored in the database. If the list is older than ``ECC_CONFIG_LIST_TTL`` seconds, it is updated by
+    :func:`~attpcdaq.daq.tasks.eccserver_refresh_configs_task` in the background so the page doesn't wait for the
+    ECC server.
 
     Parameters
     ----------
@@ -91,7 +96,13 @@ def choose_config(request, pk):
         form.save()
         return redirect(reverse('daq/status'))
     else:
-        source.refresh_configs()
+        # Show the configs already in the database, and update them in the background if they're old. They only
+        # need to be fetched here if there are none yet.
+        if not source.configid_set.exists():
+            source.refresh_configs()
+        elif source.configs_are_stale:
+            eccserver_refresh_configs_task.delay(source.pk)
+
         form = ConfigSelectionForm(instance=source)
         return render(request, 'daq/generic_crispy_form.html', context={
             'form': form,
@@ -115,12 +126,48 @@ def experiment_settings(request):
         return render(request, 'daq/experiment_settings.html', {'form': form})
 
 
+def _get_log_location(program, pk):
+    """Find the host and path of the log file for the given program.
+
+    Parameters
+    ----------
+    program : str
+        The program whose logs we want. Must be one of 'ecc' or 'data_router'.
+    pk : int
+        The integer primary key of the ECC server or data router.
+
+    Returns
+    -------
+    ip_address : str
+        The address of the host where the log file is.
+    path : str
+        The path to the log file on that host.
+
+    Raises
+    ------
+    Http404
+        If the object with the given primary key does not exist.
+    ValueError
+        If the program name is invalid.
+
+    """
+    if program == 'ecc':
+        ecc = get_object_or_404(ECCServer, pk=pk)
+        return ecc.ip_address, ecc.log_path
+    elif program == 'data_router':
+        dr = get_object_or_404(DataRouter, pk=pk)
+        return dr.ip_address, dr.log_path
+    else:
+        raise ValueError('Cannot show log for program {}'.format(program))
+
+
 @login_required
 def show_log_page(request, pk, program):
-    """Retrieve and render the log file for the given program.
+    """Render the page that displays the log file for the given program.
 
     This can be used to display the end of the log file for the ECC server process or the
-    data router process.
+    data router process. The page itself doesn't contain the log. Instead, it connects to
+    :func:`stream_log`, which sends the end of the file and then any new lines as they are written.
 
     Parameters
     ----------
@@ -134,25 +181,101 @@ def show_log_page(request, pk, program):
     Returns
     -------
     HttpResponse
-        Renders the ``log_file.html`` template with the given log file as content.
+        Renders the ``log_file.html`` template with the URL of the log stream.
 
     """
-    if program == 'ecc':
-        ecc = get_object_or_404(ECCServer, pk=pk)
-        path = ecc.log_path
-        ip_address = ecc.ip_address
-    elif program == 'data_router':
-        dr = get_object_or_404(DataRouter, pk=pk)
-        path = dr.log_path
-        ip_address = dr.ip_address
-    else:
+    try:
+        _get_log_location(program, pk)
+    except ValueError:
         logger.error('Cannot show log for program %s', program)
         return HttpResponseBadRequest('Bad program name')
 
-    with WorkerInterface(ip_address) as wint:
-        log_content = wint.tail_file(path)
+    stream_url = reverse('daq/stream_log', args=(program, pk))
+    return render(request, 'daq/log_file.html', context={'stream_url': stream_url})
+
+
+#: The maximum number of seconds that a log stream stays open. The browser reconnects automatically after this.
+LOG_STREAM_MAX_DURATION = 300
+
+#: The number of seconds between keepalive comments sent on an idle log stream.
+LOG_STREAM_KEEPALIVE_INTERVAL = 15
 
-    return render(request, 'daq/log_file.html', context={'log_content': log_content})
+
+def _format_log_event(chunk):
+    """Format a piece of log text as a server-sent event, using the offset of its end as the ID."""
+    data_lines = ''.join('data: {}\n'.format(line) for line in chunk.text.rstrip('\n').split('\n'))
+    return 'id: {}\n{}\n'.format(chunk.end, data_lines)
+
+
+@login_required
+def stream_log(request, pk, program):
+    """Stream the log file for the given program as server-sent events.
+
+    The log file is followed using a :class:`~attpcdaq.daq.logtail.RemoteLogTail` from
+    :data:`~attpcdaq.daq.logtail.log_tail_registry`, so all viewers of the same file share one SSH
+    connection. Each event contains one or more lines of the log, and its ID is the byte offset in the file of
+    the end of that text. If the browser reconnects with a ``Last-Event-ID`` header, only the text after that
+    offset is sent (see :meth:`~attpcdaq.daq.logtail.RemoteLogTail.read_from_offset`). This works even if the
+    tail was stopped and started again in the meantime, or if the new connection is handled by another process.
+
+    The stream is closed after :data:`LOG_STREAM_MAX_DURATION` seconds so that it doesn't occupy a server
+    thread forever. Browsers reconnect to event streams automatically.
+
+    Parameters
+    ----------
+    request : HttpRequest
+        The request object.
+    pk : int
+        The integer primary key of the ECC server or data router.
+    program : str
+        The program whose logs we want. Must be one of 'ecc' or 'data_router'.
+
+    Returns
+    -------
+    StreamingHttpResponse
+        The event stream.
+
+    """
+    try:
+        ip_address, path = _get_log_location(program, pk)
+    except ValueError:
+        logger.error('Cannot show log for program %s', program)
+        return HttpResponseBadRequest('Bad program name')
+
+    try:
+        last_offset = int(request.META['HTTP_LAST_EVENT_ID'])
+    except (KeyError, ValueError):
+        last_offset = None
+
+    def event_stream():
+        tail = log_tail_registry.subscribe(ip_address, path)
+        try:
+            deadline = time.monotonic() + LOG_STREAM_MAX_DURATION
+            if last_offset is not None:
+                seq, chunks = tail.read_from_offset(last_offset, timeout=LOG_STREAM_KEEPALIVE_INTERVAL)
+                for chunk in chunks:
+                    yield _format_log_event(chunk)
+            else:
+                seq = 0
+
+            while time.monotonic() < deadline:
+                chunks = tail.read_since(seq, timeout=LOG_STREAM_KEEPALIVE_INTERVAL)
+                if chunks:
+                    for chunk in chunks:
+                        seq = chunk.seq
+                        yield _format_log_event(chunk)
+                elif tail.error is not None:
+                    yield 'event: tail-error\ndata: {}\n\n'.format(tail.error.replace('\n', ' '))
+                    return
+                else:
+                    yield ': keepalive\n\n'
+        finally:
+            log_tail_registry.unsubscribe(tail)
+
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
 
 
 def _make_ip(base, offset):
@@ -346,20 +469,17 @@ class EasySetupPage(LoginRequiredMixin, NeedsExperimentMixin, PanelTitleMixin, F
 @login_required
 @needs_experiment
 def measurement_chart(request):
+    """Renders the table of measurements for the current experiment.
+
+    Only the column headings are rendered here. The measurements are fetched by the page from
+    :func:`~attpcdaq.daq.views.api.measurement_pivot`.
+
+    """
     experiment = request.experiment
     observables = Observable.objects.filter(experiment=experiment)
-    runs = RunMetadata.objects.filter(experiment=experiment)
-
-    all_measurements = {}
-    for run in runs:
-        measurement_qset = Measurement.objects.filter(run_metadata=run).select_related('observable')
-        measurement_dict = {m.observable.name: m.value for m in measurement_qset}
-        all_measurements[run.run_number] = measurement_dict
 
     return render(request, 'daq/measurement_chart.html', context={
         'observables': observables,
-        'runs': runs,
-        'measurements': all_measurements,
     })
 
 
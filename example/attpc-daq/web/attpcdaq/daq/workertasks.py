@@ -9,8 +9,14 @@ from paramiko.client import SSHClient
 from paramiko.config import SSHConfig
 from paramiko.sftp_file import SFTPFile
 from paramiko import AutoAddPolicy
+from django.conf import settings
+from collections import namedtuple
 import os
 import re
+import shlex
+import time
+import threading
+import atexit
 
 
 def mkdir_recursive(sftp, path):
@@ -51,6 +57,271 @@ def mkdir_recursive(sftp, path):
         return
 
 
+#: The result of :meth:`WorkerInterface.probe`.
+ProbeResult = namedtuple('ProbeResult', ['ecc_server_running', 'data_router_running', 'data_router_pid',
+                                         'data_router_cwd', 'graw_count', 'graw_total_size'])
+
+# The shell script run by WorkerInterface.probe. Each section of the output is introduced by a marker line
+# so that the sections can be separated again when the output is parsed. The GRAW files are listed with find rather
+# than a glob so that a large number of them can't overflow the argument list, and the section holds either the
+# number of files and their total size or the word "failed".
+_PROBE_SCRIPT = """\
+echo '@@ps'
+ps -e
+lsof_out=$(lsof -a -d cwd -c dataRouter -Fpcn 2>/dev/null)
+echo '@@lsof'
+printf '%s\\n' "$lsof_out"
+cwd=$(printf '%s\\n' "$lsof_out" | sed -n 's/^n//p' | head -n 1)
+echo '@@graw'
+if [ -z "$cwd" ]; then
+    echo '0 0'
+elif files=$(find "$cwd" -maxdepth 1 -type f -name '*.graw' -exec ls -ln {} +); then
+    printf '%s\\n' "$files" | awk 'NF >= 5 {n += 1; s += $5} END {print n + 0, s + 0}'
+else
+    echo 'failed'
+fi
+exit 0
+"""
+
+# The shell script run by WorkerInterface.organize_files_bulk. The files are moved in batches using xargs, and a
+# line is printed after each batch giving the number of files and bytes moved. Files are never moved over a file with
+# the same name in the run directory; they are left in place and a "@@collision" line is printed for each one.
+_ORGANIZE_SCRIPT = """\
+src={src}
+dest={dest}
+mkdir -p "$dest" || exit 1
+echo "@@total $(find "$src" -maxdepth 1 -type f -name '*.graw' | wc -l)"
+find "$src" -maxdepth 1 -type f -name '*.graw' -print0 | xargs -0 -n {batch_size} sh -c '
+[ $# -gt 0 ] || exit 0
+b=$(ls -ln "$@" | awk "{{s += \\$5}} END {{print s + 0}}")
+mv -n "$@" "$0"
+n=$#
+for f in "$@"; do
+    [ -e "$f" ] || continue
+    [ -e "$0/${{f##*/}}" ] || exit 255
+    echo "@@collision $f"
+    n=$((n - 1))
+    b=$((b - $(ls -ln "$f" | awk "{{print \\$5}}")))
+done
+echo "@@moved $n $b"' "$dest"
+"""
+
+# The shell script run by WorkerInterface.backup_config_files. Each file is copied into a store named by the hash of
+# its contents (unless it is already there), and the backup is made as a hard link to the stored copy. An existing
+# backup may itself be a link to a stored copy, so it is always replaced by a new file rather than written into.
+_BACKUP_SCRIPT = """\
+dest={dest}
+store={store}
+if command -v sha256sum >/dev/null 2>&1; then
+    hash_file() {{ sha256sum "$1" | cut -d ' ' -f 1; }}
+else
+    hash_file() {{ shasum -a 256 "$1" | cut -d ' ' -f 1; }}
+fi
+mkdir -p "$dest" "$store" || exit 1
+for src in {sources}; do
+    name=$(basename "$src")
+    hash=$(hash_file "$src") && [ -n "$hash" ] || exit 2
+    if [ -f "$store/$hash" ]; then
+        action=linked
+    else
+        cp "$src" "$store/$hash.tmp" && mv -f "$store/$hash.tmp" "$store/$hash" || exit 3
+        action=copied
+    fi
+    if ! ln -f "$store/$hash" "$dest/$name" 2>/dev/null; then
+        cp "$store/$hash" "$dest/$name.tmp" && mv -f "$dest/$name.tmp" "$dest/$name" || exit 4
+    fi
+    echo "@@$action $src"
+done
+"""
+
+
+class SSHConnectionPool(object):
+    """A pool of persistent SSH connections to the DAQ worker nodes.
+
+    Opening an SSH connection requires a full handshake with the remote host, which is slow compared to the
+    commands we actually want to run. This class keeps connections open after they are used so that they can
+    be handed out again to the next :class:`WorkerInterface` that needs to talk to the same host.
+
+    Connections are keyed by ``(hostname, port, username)``. Before an idle connection is reused, it is checked
+    by sending an SSH keepalive message; if this fails, the connection is closed and a new one is opened.
+    Connections that have been idle for longer than ``idle_ttl`` seconds are closed.
+
+    The parsed SSH config files are also cached here, so the config file is read only once per process.
+
+    One instance of this class, ``connection_pool``, is shared by all :class:`WorkerInterface` objects in the
+    process. Its TTL can be set using the Django setting ``SSH_CONNECTION_IDLE_TTL``.
+
+    Parameters
+    ----------
+    idle_ttl : float, optional
+        The number of seconds after which an unused connection will be closed.
+    keepalive_interval : int, optional
+        The interval, in seconds, at which the transport sends keepalive packets while the connection is open.
+
+    """
+    def __init__(self, idle_ttl=300, keepalive_interval=30):
+        self.idle_ttl = idle_ttl
+        self.keepalive_interval = keepalive_interval
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._configs = {}
+
+    def _get_config(self, config_path):
+        """Get the parsed SSH config file at the given path. Must be called with the lock held."""
+        try:
+            return self._configs[config_path]
+        except KeyError:
+            config = SSHConfig()
+            with open(config_path) as config_file:
+                config.parse(config_file)
+            self._configs[config_path] = config
+            return config
+
+    def _connect(self, hostname, port, username, config_path):
+        """Open a new SSH connection."""
+        client = SSHClient()
+
+        client.load_system_host_keys()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+
+        with self._lock:
+            config = self._get_config(config_path)
+
+        if hostname in config.get_hostnames():
+            host_cfg = config.lookup(hostname)
+            full_hostname = host_cfg.get('hostname', hostname)
+            if username is None:
+                username = host_cfg.get('user', None)  # If none, it will try the user running the server.
+        else:
+            full_hostname = hostname
+
+        client.connect(full_hostname, port, username=username)
+
+        transport = client.get_transport()
+        if transport is not None:
+            transport.set_keepalive(self.keepalive_interval)
+
+        return client
+
+    @staticmethod
+    def _is_alive(client):
+        """Check that a connection is still usable by sending a keepalive message over it."""
+        transport = client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+
+        return True
+
+    def _prune(self, now):
+        """Remove connections that have been idle for too long. Must be called with the lock held.
+
+        Returns
+        -------
+        list
+            The connections that were removed. These should be closed after releasing the lock.
+        """
+        expired = []
+        for key, idle_list in self._idle.items():
+            fresh = []
+            for client, last_used in idle_list:
+                if now - last_used > self.idle_ttl:
+                    expired.append(client)
+                else:
+                    fresh.append((client, last_used))
+            self._idle[key] = fresh
+        return expired
+
+    def acquire(self, hostname, port=22, username=None, config_path=None):
+        """Get a live connection to the given host, opening a new one if necessary.
+
+        Parameters
+        ----------
+        hostname : str
+            The hostname to connect to.
+        port : int, optional
+            The port that the SSH server is listening on.
+        username : str, optional
+            The username to use. If not given, it will be looked up in the SSH config file.
+        config_path : str, optional
+            The path to the SSH config file. The default is ``~/.ssh/config``.
+
+        Returns
+        -------
+        key : tuple
+            The key identifying this connection in the pool. Pass this to :meth:`release`.
+        client : paramiko.client.SSHClient
+            The connected client.
+
+        """
+        if config_path is None:
+            config_path = os.path.join(os.path.expanduser('~'), '.ssh', 'config')
+
+        key = (hostname, port, username)
+
+        with self._lock:
+            expired = self._prune(time.monotonic())
+
+        for expired_client in expired:
+            expired_client.close()
+
+        while True:
+            with self._lock:
+                idle_list = self._idle.get(key)
+                if not idle_list:
+                    break
+                client, _ = idle_list.pop()
+
+            if self._is_alive(client):
+                return key, client
+            else:
+                client.close()
+
+        client = self._connect(hostname, port, username, config_path)
+
+        return key, client
+
+    def release(self, key, client):
+        """Return a connection to the pool so it can be reused.
+
+        Parameters
+        ----------
+        key : tuple
+            The key returned by :meth:`acquire`.
+        client : paramiko.client.SSHClient
+            The connection to return.
+
+        """
+        with self._lock:
+            self._idle.setdefault(key, []).append((client, time.monotonic()))
+            expired = self._prune(time.monotonic())
+
+        for expired_client in expired:
+            expired_client.close()
+
+    def close_all(self):
+        """Close all idle connections."""
+        with self._lock:
+            clients = [client for idle_list in self._idle.values() for client, _ in idle_list]
+            self._idle.clear()
+
+        for client in clients:
+            client.close()
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(idle_list) for idle_list in self._idle.values())
+
+
+#: The pool of SSH connections shared by all :class:`WorkerInterface` objects in this process
+connection_pool = SSHConnectionPool(idle_ttl=getattr(settings, 'SSH_CONNECTION_IDLE_TTL', 300))
+atexit.register(connection_pool.close_all)
+
+
 class WorkerInterface(object):
     """An interface to perform tasks on the DAQ worker nodes.
 
@@ -61,6 +332,10 @@ class WorkerInterface(object):
     Additionally, the server *must* accept connections authenticated using a public key, and this public key must
     be available in your ``.ssh`` directory.
 
+    Connections are taken from an :class:`SSHConnectionPool`, and they are returned to the pool rather than closed
+    when the interface is closed. This means that a new SSH handshake is only needed the first time a given host
+    is contacted (or after the pooled connection has expired or died).
+
     Parameters
     ----------
     hostname : str
@@ -72,41 +347,72 @@ class WorkerInterface(object):
         is listed there, the name of the user running the code will be used.
     config_path : str, optional
         The path to the SSH config file. The default is ``~/.ssh/config``.
+    pool : SSHConnectionPool, optional
+        The pool to take the connection from. The default is the shared pool ``connection_pool``.
+
+    Attributes
+    ----------
+    data_router_pid : int or None
+        The PID of the data router process, once it has been found.
+    data_router_cwd : str or None
+        The working directory of the data router process, once it has been found.
 
     """
-    def __init__(self, hostname, port=22, username=None, config_path=None):
+    def __init__(self, hostname, port=22, username=None, config_path=None, pool=None):
         self.hostname = hostname
-        self.client = SSHClient()
+        self.pool = pool if pool is not None else connection_pool
+        self._pool_key, self.client = self.pool.acquire(hostname, port, username, config_path)
 
-        self.client.load_system_host_keys()
-        self.client.set_missing_host_key_policy(AutoAddPolicy())
-
-        if config_path is None:
-            config_path = os.path.join(os.path.expanduser('~'), '.ssh', 'config')
-        self.config = SSHConfig()
-        with open(config_path) as config_file:
-            self.config.parse(config_file)
-
-        if hostname in self.config.get_hostnames():
-            host_cfg = self.config.lookup(hostname)
-            full_hostname = host_cfg.get('hostname', hostname)
-            if username is None:
-                username = host_cfg.get('user', None)  # If none, it will try the user running the server.
-        else:
-            full_hostname = hostname
-
-        self.client.connect(full_hostname, port, username=username)
+        self.data_router_pid = None
+        self.data_router_cwd = None
+        self._data_router_verified = False
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self.client.close()
+        self.close()
+
+    def close(self):
+        """Return the connection to the pool. The interface cannot be used after this is called."""
+        if self.client is not None:
+            self.pool.release(self._pool_key, self.client)
+            self.client = None
+
+    def set_cached_data_router(self, pid, cwd):
+        """Provide a previously found data router PID and working directory.
+
+        This can be used to avoid running ``lsof`` again if the location of the data router was already
+        found in an earlier session (for example, if it was stored in the database). The value will be checked
+        the first time :meth:`find_data_router` is called, and it will be discarded if the process with the given
+        PID is no longer the data router.
+
+        Parameters
+        ----------
+        pid : int or None
+            The PID of the data router process. If this is None, nothing is cached.
+        cwd : str or None
+            The working directory of the data router process. If this is None, nothing is cached.
+
+        """
+        if pid is None or not cwd:
+            return
+
+        self.data_router_pid = pid
+        self.data_router_cwd = cwd
+        self._data_router_verified = False
+
+    def _pid_is_data_router(self, pid):
+        """Check whether the process with the given PID is the data router."""
+        _, stdout, _ = self.client.exec_command('ps -p {:d} -o comm='.format(pid))
+        return any(re.search(r'dataRouter', line) for line in stdout)
 
     def find_data_router(self):
         """Find the working directory of the data router process.
 
-        The directory is found using ``lsof``, which must be available on the remote system.
+        The directory is found using ``lsof``, which must be available on the remote system. The result is
+        cached for the lifetime of this object, so ``lsof`` is only run once. If a location was provided using
+        :meth:`set_cached_data_router`, it is used instead as long as the data router's PID has not changed.
 
         Returns
         -------
@@ -119,12 +425,26 @@ class WorkerInterface(object):
             If ``lsof`` finds something strange instead of a process called ``dataRouter``.
 
         """
-        stdin, stdout, stderr = self.client.exec_command('lsof -a -d cwd -c dataRouter -Fcn')
+        if self.data_router_cwd is not None:
+            if self._data_router_verified or self._pid_is_data_router(self.data_router_pid):
+                self._data_router_verified = True
+                return self.data_router_cwd
+
+        self.data_router_pid = None
+        self.data_router_cwd = None
+
+        pid = None
+        stdin, stdout, stderr = self.client.exec_command('lsof -a -d cwd -c dataRouter -Fpcn')
         for line in stdout:
-            if line[0] == 'c' and not re.match('cdataRouter', line):
+            if line[0] == 'p':
+                pid = int(line[1:])
+            elif line[0] == 'c' and not re.match('cdataRouter', line):
                 raise RuntimeError("lsof found {} instead of dataRouter".format(line[1:].strip()))
             elif line[0] == 'n':
-                return line[1:].strip()
+                self.data_router_pid = pid
+                self.data_router_cwd = line[1:].strip()
+                self._data_router_verified = True
+                return self.data_router_cwd
         else:
             raise RuntimeError("lsof didn't find dataRouter")
 
@@ -157,6 +477,78 @@ class WorkerInterface(object):
         """
         return len(self.get_graw_list()) == 0
 
+    def probe(self):
+        """Check the state of the remote node using a single remote command.
+
+        This combines the work of :meth:`check_ecc_server_status`, :meth:`check_data_router_status`,
+        :meth:`find_data_router`, and :meth:`get_graw_list` into one round-trip to the remote host. The
+        command uses ``ps``, ``lsof``, ``find``, and ``ls``, which must be available on the remote system.
+
+        Returns
+        -------
+        ProbeResult
+            A named tuple with the following fields:
+
+            - ``ecc_server_running``: True if ``getEccSoapServer`` is running.
+            - ``data_router_running``: True if ``dataRouter`` is running.
+            - ``data_router_pid``: The PID of the data router, or None if it wasn't found by ``lsof``.
+            - ``data_router_cwd``: The data router's working directory, or None if it wasn't found.
+            - ``graw_count``: The number of GRAW files in the data router's working directory. This is 0 if the
+              directory wasn't found, and None if the files couldn't be listed.
+            - ``graw_total_size``: The total size of these GRAW files, in bytes, or None if they couldn't be listed.
+
+        """
+        _, stdout, _ = self.client.exec_command('sh -c {}'.format(shlex.quote(_PROBE_SCRIPT)))
+
+        sections = {}
+        current = None
+        for line in stdout:
+            line = line.rstrip('\n')
+            if line.startswith('@@'):
+                current = sections.setdefault(line[2:], [])
+            elif current is not None and line:
+                current.append(line)
+
+        ps_lines = sections.get('ps', [])
+        ecc_server_running = any(re.search(r'getEccSoapServer', line) for line in ps_lines)
+        data_router_running = any(re.search(r'dataRouter', line) for line in ps_lines)
+
+        data_router_pid = None
+        data_router_cwd = None
+        for line in sections.get('lsof', []):
+            if line[0] == 'p' and data_router_pid is None:
+                data_router_pid = int(line[1:])
+            elif line[0] == 'c' and not re.match('cdataRouter', line):
+                # lsof found some other program, so we can't trust the directory
+                data_router_pid = None
+                break
+            elif line[0] == 'n':
+                data_router_cwd = line[1:].strip()
+                break
+
+        if data_router_pid is not None and data_router_cwd is not None:
+            self.data_router_pid = data_router_pid
+            self.data_router_cwd = data_router_cwd
+            self._data_router_verified = True
+
+        # If the files couldn't be listed, we don't know whether the directory is clean
+        graw_count = None
+        graw_total_size = None
+        graw_lines = sections.get('graw', [])
+        if graw_lines:
+            fields = graw_lines[0].split()
+            if len(fields) == 2 and all(field.isdigit() for field in fields):
+                graw_count, graw_total_size = (int(field) for field in fields)
+
+        return ProbeResult(
+            ecc_server_running=ecc_server_running,
+            data_router_running=data_router_running,
+            data_router_pid=data_router_pid,
+            data_router_cwd=data_router_cwd,
+            graw_count=graw_count,
+            graw_total_size=graw_total_size,
+        )
+
     def _check_process_status(self, process_name):
         """Checks if the given process is running.
 
@@ -249,11 +641,100 @@ class WorkerInterface(object):
                 destpath = os.path.join(run_dir, srcfile)
                 sftp.rename(srcpath, destpath)
 
-    def backup_config_files(self, experiment_name, run_number, file_paths, backup_root):
+    def organize_files_bulk(self, experiment_name, run_number, batch_size=500, progress_callback=None):
+        """Organize the GRAW files at the end of a run using commands run on the remote host.
+
+        This has the same effect as :meth:`organize_files`, but instead of renaming each file over SFTP, the
+        directory is created with ``mkdir -p`` and the files are moved with ``mv`` in batches of ``batch_size``
+        files by a single remote shell command. This is much faster when there are many files.
+
+        The operation is idempotent: if it is interrupted, calling it again will move the files that remain
+        in the staging directory. Files are never overwritten: if a file with the same name is already in the run
+        directory (for example, if a run number was reused), the file is left in the staging directory, the other
+        files are still moved, and then an error is raised.
+
+        Parameters
+        ----------
+        experiment_name : str
+            A name for the experiment directory.
+        run_number : int
+            The current run number.
+        batch_size : int, optional
+            The maximum number of files moved by each ``mv`` command.
+        progress_callback : callable, optional
+            If given, this is called as ``progress_callback(files_moved, bytes_moved, total_files)`` once before
+            any files are moved and again after each batch. The values are cumulative for this call.
+
+        Returns
+        -------
+        files_moved : int
+            The number of files that were moved.
+        bytes_moved : int
+            The total size of the files that were moved.
+
+        Raises
+        ------
+        RuntimeError
+            If the remote command fails, or if some files weren't moved because they would have overwritten
+            existing files.
+
+        """
+        data_dir = self.find_data_router()
+        run_dir = self.build_run_dir_path(experiment_name, run_number)
+
+        script = _ORGANIZE_SCRIPT.format(src=shlex.quote(data_dir), dest=shlex.quote(run_dir),
+                                         batch_size=int(batch_size))
+        _, stdout, stderr = self.client.exec_command('sh -c {}'.format(shlex.quote(script)))
+
+        total_files = 0
+        files_moved = 0
+        bytes_moved = 0
+        collisions = []
+        for line in stdout:
+            if line.startswith('@@collision '):
+                collisions.append(line.rstrip('\n')[len('@@collision '):])
+                continue
+
+            fields = line.split()
+            if len(fields) == 2 and fields[0] == '@@total':
+                total_files = int(fields[1])
+            elif len(fields) == 3 and fields[0] == '@@moved':
+                files_moved += int(fields[1])
+                bytes_moved += int(fields[2])
+            else:
+                continue
+
+            if progress_callback is not None:
+                progress_callback(files_moved, bytes_moved, total_files)
+
+        exit_status = stdout.channel.recv_exit_status()
+        if exit_status != 0:
+            raise RuntimeError('Organizing files failed with status {}: {}'.format(
+                exit_status, stderr.read().decode('utf-8', errors='replace').strip()))
+
+        if collisions:
+            raise RuntimeError('{} file(s) were left in {} because files with the same names are already in {}: {}'
+                               .format(len(collisions), data_dir, run_dir,
+                                       ', '.join(os.path.basename(path) for path in collisions)))
+
+        return files_moved, bytes_moved
+
+    def backup_config_files(self, experiment_name, run_number, file_paths, backup_root, chunk_size=65536):
         """Makes a copy of the config files on the remote computer.
 
         The files are copied to a subdirectory ``experiment_name/run_name`` of ``backup_root``.
 
+        The copy is done by a shell command on the remote host, so the file contents are not sent over the
+        network. Each file is stored once in the directory ``backup_root/.objects``, named by the SHA-256 hash
+        of its contents, and the backup in the run directory is a hard link to the stored file. Therefore, if
+        the same config files are used for many runs, only one copy of each one is kept. Since the backups
+        share storage, they should not be edited in place.
+
+        If the remote command fails (for example, if neither ``sha256sum`` nor ``shasum`` is available), the files
+        are instead copied over SFTP in chunks of ``chunk_size`` bytes without deduplication. Each file is written
+        to a temporary file that is then renamed over the backup, so existing backups that share storage with
+        other runs are never modified.
+
         Parameters
         ----------
         experiment_name : str
@@ -264,47 +745,165 @@ class WorkerInterface(object):
             The *full* paths to the config files.
         backup_root : str
             Where the backups should be written.
+        chunk_size : int, optional
+            The size of the buffer used when copying over SFTP.
+
+        Returns
+        -------
+        dict
+            A dictionary mapping each source path to 'copied' if a new copy of the file was made or 'linked'
+            if an identical file was already stored.
 
         """
+        file_paths = list(file_paths)
         run_name = 'run_{:04d}'.format(run_number)
         backup_dest = os.path.join(backup_root, experiment_name, run_name)
+        store_dir = os.path.join(backup_root, '.objects')
+
+        if len(file_paths) == 0:
+            return {}
+
+        script = _BACKUP_SCRIPT.format(
+            dest=shlex.quote(backup_dest),
+            store=shlex.quote(store_dir),
+            sources=' '.join(shlex.quote(path) for path in file_paths),
+        )
+        _, stdout, _ = self.client.exec_command('sh -c {}'.format(shlex.quote(script)))
+
+        results = {}
+        for line in stdout:
+            action, _, source_path = line.rstrip('\n').partition(' ')
+            if action in ('@@copied', '@@linked'):
+                results[source_path] = action[2:]
+
+        if stdout.channel.recv_exit_status() == 0:
+            return results
 
         with self.client.open_sftp() as sftp:
             mkdir_recursive(sftp, backup_dest)
             for source_path in file_paths:
                 dest_path = os.path.join(backup_dest, os.path.basename(source_path))
-                with sftp.open(source_path, 'r') as src, sftp.open(dest_path, 'w') as dest:
-                    buffer = src.read()
-                    dest.write(buffer)
+                temp_path = dest_path + '.tmp'
+                with sftp.open(source_path, 'r') as src, sftp.open(temp_path, 'w') as dest:
+                    while True:
+                        buffer = src.read(chunk_size)
+                        if not buffer:
+                            break
+                        dest.write(buffer)
+
+                # An earlier backup at dest_path may be a hard link into the store, so replace it instead of
+                # overwriting its contents
+                sftp.posix_rename(temp_path, dest_path)
+                results[source_path] = 'copied'
 
-    def tail_file(self, path, num_lines=50):
+        return results
+
+    def tail_file(self, path, num_lines=50, max_bytes=1048576, block_size=65536, encoding='utf-8'):
         """Retrieve the tail of a text file on the remote host.
 
-        Note that this assumes the file is ASCII-encoded plain text.
+        The file is read backwards from the end in blocks of ``block_size`` bytes until enough lines have been
+        found or ``max_bytes`` bytes have been read. Bytes that can't be decoded using the given encoding are
+        replaced with a placeholder character.
 
         Parameters
         ----------
         path : str
             Path to the file.
-        num_lines : int
+        num_lines : int, optional
             The number of lines to include.
+        max_bytes : int, optional
+            The maximum number of bytes to read from the end of the file. If this limit is reached, fewer than
+            ``num_lines`` lines may be returned.
+        block_size : int, optional
+            The number of bytes to read at a time.
+        encoding : str, optional
+            The encoding of the file.
 
         Returns
         -------
         str
             The tail of the file's contents.
         """
-        # Based on https://gist.github.com/volker48/3437288
+        return self.follow_file(path, None, num_lines=num_lines, max_bytes=max_bytes,
+                                block_size=block_size, encoding=encoding)[0]
+
+    def follow_file(self, path, offset=None, num_lines=50, max_bytes=1048576, block_size=65536, encoding='utf-8'):
+        """Retrieve the text appended to a file on the remote host since the given offset.
+
+        This can be used to follow a log file as it grows. The first call should pass ``offset=None``, which
+        returns the tail of the file (as :meth:`tail_file` would) and the offset of the end of the file. Passing
+        that offset to the next call returns only the text written since then, along with a new offset.
+
+        Only complete lines are returned when following, so a line that is still being written will be returned
+        by a later call. If the file has become shorter than ``offset`` (for example, because the log was rotated),
+        it is read again from the beginning.
+
+        Parameters
+        ----------
+        path : str
+            Path to the file.
+        offset : int or None, optional
+            The offset, in bytes, returned by the previous call. If None, the tail of the file is returned.
+        num_lines : int, optional
+            The number of lines to include when ``offset`` is None.
+        max_bytes : int, optional
+            The maximum number of bytes to read.
+        block_size : int, optional
+            The number of bytes to read at a time when reading backwards to find the tail.
+        encoding : str or None, optional
+            The encoding of the file. Invalid bytes are replaced with a placeholder character. If None, the bytes
+            read are returned without being decoded.
+
+        Returns
+        -------
+        text : str or bytes
+            The text that was read. This is bytes if ``encoding`` is None.
+        offset : int
+            The offset to pass to the next call.
+        """
         with self.client.open_sftp() as sftp:
             with sftp.open(path, 'r') as f:
-                f.seek(-1, SFTPFile.SEEK_END)
-                lines = 0
-                while lines < num_lines and f.tell() > 0:
-                    char = f.read(1)
-                    if char == b'\n':
-                        lines += 1
-                        if lines == num_lines:
-                            break
-                    f.seek(-2, SFTPFile.SEEK_CUR)
-
-                return f.read().decode('ascii')
+                f.seek(0, SFTPFile.SEEK_END)
+                end = f.tell()
+
+                if offset is None:
+                    data = self._read_tail(f, end, num_lines, max_bytes, block_size)
+                    return self._decode(data, encoding), end
+
+                if offset > end:
+                    offset = 0
+
+                f.seek(offset)
+                data = f.read(min(end - offset, max_bytes))
+
+        # Leave any incomplete final line for the next call, unless it's all we could read
+        last_newline = data.rfind(b'\n')
+        if last_newline >= 0:
+            data = data[:last_newline + 1]
+        elif len(data) < max_bytes:
+            data = b''
+
+        return self._decode(data, encoding), offset + len(data)
+
+    @staticmethod
+    def _decode(data, encoding):
+        return data.decode(encoding, errors='replace') if encoding is not None else data
+
+    @staticmethod
+    def _read_tail(f, end, num_lines, max_bytes, block_size):
+        """Read backwards from ``end`` in blocks until ``num_lines`` complete lines are found."""
+        limit = max(0, end - max_bytes)
+        pos = end
+        data = b''
+        while pos > limit and data.count(b'\n') <= num_lines:
+            read_size = min(block_size, pos - limit)
+            pos -= read_size
+            f.seek(pos)
+            data = f.read(read_size) + data
+
+        lines = data.splitlines(keepends=True)
+        if pos > 0 and len(lines) > 1:
+            # We didn't reach the start of the file, so the first line is probably incomplete
+            lines = lines[1:]
+
+        return b''.join(lines[-num_lines:]) if num_lines > 0 else b''
@@ -1,15 +1,116 @@
 import logging
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
 from datetime import datetime
 
 
 class DjangoDatabaseHandler(logging.Handler):
+    """A logging handler that stores log records in the database as :class:`~attpcdaq.logs.models.LogEntry` objects.
 
-    def __init__(self):
+    Records are not written in the thread that logged them. Instead, they're put in a queue, and a background
+    thread writes them to the database in batches using ``bulk_create``. A batch is written when it reaches
+    ``batch_size`` records or when ``flush_interval`` seconds have passed since its first record arrived.
+
+    If the database can't keep up, the queue fills. Once it's more than half full, only one in ``sample_rate``
+    of the records below the WARNING level is kept, and once it's completely full, every new record is dropped.
+    The number of dropped records is kept in :attr:`dropped_count`, and a warning giving the number dropped is
+    written along with the next batch.
+
+    The background thread is started when the first record arrives, and it's started again if the process forks.
+    Calling :meth:`flush` or :meth:`close` (which :func:`logging.shutdown` does at exit) writes the records
+    still in the queue.
+
+    Records are ignored while the ``LOG_DATABASE_ENABLED`` setting is False.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        The maximum number of records waiting to be written.
+    batch_size : int, optional
+        The maximum number of records written with one query.
+    flush_interval : float, optional
+        The longest time, in seconds, that a record waits before it's written.
+    sample_rate : int, optional
+        Under backpressure, one in this many DEBUG and INFO records is kept.
+    flush_timeout : float, optional
+        The longest time, in seconds, that :meth:`flush` waits for the records to be written.
+
+    Attributes
+    ----------
+    dropped_count : int
+        The total number of records dropped so far.
+
+    """
+
+    def __init__(self, capacity=10000, batch_size=200, flush_interval=1.0, sample_rate=10, flush_timeout=5.0):
         logging.Handler.__init__(self)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sample_rate = sample_rate
+        self.flush_timeout = flush_timeout
+
+        self.dropped_count = 0
+        self._unreported_drops = 0
+        self._sample_counter = 0
+        self._drop_lock = threading.Lock()
+
+        self._queue = queue.Queue(maxsize=capacity)
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        """Start the background thread if it isn't running in this process."""
+        if self._thread is not None and self._pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+
+            if self._pid is not None and self._pid != os.getpid():
+                # This is a forked child, so the parent's queue and thread don't belong to it
+                self._queue = queue.Queue(maxsize=self.capacity)
+
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='DjangoDatabaseHandler', daemon=True)
+            self._thread.start()
+
+    def _should_keep(self, record):
+        """Decide whether a record should be queued given how full the queue is."""
+        if record.levelno >= logging.WARNING or self._queue.qsize() < self.capacity // 2:
+            return True
+
+        with self._drop_lock:
+            self._sample_counter += 1
+            return self._sample_counter % self.sample_rate == 0
+
+    def _record_drop(self):
+        with self._drop_lock:
+            self.dropped_count += 1
+            self._unreported_drops += 1
 
     def emit(self, record):
+        from django.conf import settings
         from .models import LogEntry
         try:
+            if not getattr(settings, 'LOG_DATABASE_ENABLED', True):
+                return
+
+            self._ensure_started()
+
+            if not self._should_keep(record):
+                self._record_drop()
+                return
+
+            if record.exc_info and not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+
             entry = LogEntry(logger_name=record.name,
                              create_time=datetime.fromtimestamp(record.created),
                              level=record.levelno,
@@ -18,6 +119,121 @@ class DjangoDatabaseHandler(logging.Handler):
                              function_name=record.funcName,
                              message=record.getMessage(),
                              traceback=record.exc_text)
-            entry.save()
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._record_drop()
         except Exception:
             self.handleError(record)
+
+    def _dropped_entry(self):
+        """Make an entry reporting the records dropped since the last one, or None if there were none."""
+        from .models import LogEntry
+
+        with self._drop_lock:
+            count, self._unreported_drops = self._unreported_drops, 0
+
+        if count == 0:
+            return None
+
+        return LogEntry(logger_name=__name__,
+                        create_time=datetime.now(),
+                        level=logging.WARNING,
+                        path_name=__file__,
+                        line_num=0,
+                        function_name='_dropped_entry',
+                        message='Dropped {} log records because the database could not keep up'.format(count))
+
+    def _run(self):
+        """Write queued records to the database until told to stop."""
+        stopping = False
+        while not stopping:
+            batch = []
+            waiters = []
+
+            item = self._queue.get()
+            deadline = time.monotonic() + self.flush_interval
+
+            while True:
+                if item is None:
+                    stopping = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+
+                if stopping or waiters or len(batch) >= self.batch_size:
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if waiters or stopping:
+                # Write everything that was queued before the flush was requested
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                    elif isinstance(item, threading.Event):
+                        waiters.append(item)
+                    else:
+                        batch.append(item)
+
+            self._write(batch)
+
+            for event in waiters:
+                event.set()
+
+    def _write(self, batch):
+        from django.db import connection
+        from .models import LogEntry
+
+        dropped = self._dropped_entry()
+        if dropped is not None:
+            batch.append(dropped)
+
+        if not batch:
+            return
+
+        try:
+            for start in range(0, len(batch), self.batch_size):
+                LogEntry.objects.bulk_create(batch[start:start + self.batch_size])
+        except Exception:
+            # Logging this error would just send it back to this handler
+            sys.stderr.write('Failed to write {} log records to the database:\n'.format(len(batch)))
+            traceback.print_exc(file=sys.stderr)
+            connection.close()
+
+    def flush(self):
+        """Wait for the queued records to be written to the database."""
+        if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+            return
+
+        done = threading.Event()
+        try:
+            self._queue.put(done, timeout=self.flush_timeout)
+        except queue.Full:
+            return
+        done.wait(self.flush_timeout)
+
+    def close(self):
+        """Write the queued records and stop the background thread."""
+        try:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                try:
+                    self._queue.put(None, timeout=self.flush_timeout)
+                except queue.Full:
+                    pass
+                else:
+                    self._thread.join(self.flush_timeout)
+            self._thread = None
+        finally:
+            logging.Handler.close(self)
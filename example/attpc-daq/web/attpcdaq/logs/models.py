@@ -6,6 +6,11 @@ class LogEntry(models.Model):
 
     class Meta:
         verbose_name_plural = 'Log entries'
+        indexes = [
+            # The log pages list the newest entries first, and old entries are pruned by age
+            models.Index(fields=['-create_time'], name='logs_create_time_idx'),
+            models.Index(fields=['level', '-create_time'], name='logs_level_create_time_idx'),
+        ]
 
     logger_name = models.CharField(max_length=100)
     create_time = models.DateTimeField()
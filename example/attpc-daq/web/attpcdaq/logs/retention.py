@@ -0,0 +1,148 @@
+"""Pruning and archival of old log entries
+
+Log entries are written for as long as the system runs, so the old ones need to be removed to keep the log pages
+fast. :func:`prune_log_entries` removes the entries that are older than a given age or beyond a given number of
+entries. The entries are deleted a chunk at a time so that the table isn't locked for long, and they can be saved to
+gzipped JSON lines files before they're deleted.
+
+"""
+
+from datetime import datetime
+import gzip
+import json
+import os
+
+from .models import LogEntry
+
+
+class LogArchive(object):
+    """A gzipped JSON lines file that pruned log entries are written to.
+
+    The file is named after the time when the archive was created, and it isn't created until the first entries
+    are written to it.
+
+    Parameters
+    ----------
+    directory : str
+        The directory where the file will be created.
+    now : datetime, optional
+        The time used in the file name. The default is the current time.
+
+    """
+    def __init__(self, directory, now=None):
+        if now is None:
+            now = datetime.now()
+        self.path = os.path.join(directory, 'log_entries_{:%Y%m%d_%H%M%S}.jsonl.gz'.format(now))
+        self.count = 0
+        self._file = None
+
+    def write(self, entries):
+        """Append log entries to the file.
+
+        Parameters
+        ----------
+        entries : iterable of LogEntry
+            The entries to write.
+
+        """
+        if self._file is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._file = gzip.open(self.path, 'at', encoding='utf-8')
+
+        for entry in entries:
+            self._file.write(json.dumps({
+                'id': entry.pk,
+                'logger_name': entry.logger_name,
+                'create_time': entry.create_time.isoformat(),
+                'level': entry.get_level_display(),
+                'path_name': entry.path_name,
+                'line_num': entry.line_num,
+                'function_name': entry.function_name,
+                'message': entry.message,
+                'traceback': entry.traceback,
+            }) + '\n')
+            self.count += 1
+
+        self._file.flush()
+
+    def close(self):
+        """Close the file, if it was opened."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _delete_in_chunks(queryset, chunk_size, archive=None, limit=None):
+    """Delete the entries in ``queryset``, oldest first, ``chunk_size`` at a time.
+
+    At most ``limit`` entries are deleted, if it's given. Returns the number deleted.
+
+    """
+    queryset = queryset.order_by('create_time', 'pk')
+    deleted = 0
+
+    while limit is None or deleted < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - deleted)
+
+        if archive is not None:
+            chunk = list(queryset[:size])
+            archive.write(chunk)
+            pks = [entry.pk for entry in chunk]
+        else:
+            pks = list(queryset.values_list('pk', flat=True)[:size])
+
+        if not pks:
+            break
+
+        LogEntry.objects.filter(pk__in=pks).delete()
+        deleted += len(pks)
+
+    return deleted
+
+
+def prune_log_entries(max_age=None, max_entries=None, archive_dir=None, chunk_size=1000, now=None):
+    """Delete old log entries.
+
+    Entries older than ``max_age`` are deleted first. Then, if more than ``max_entries`` entries remain, the oldest
+    ones are deleted until only that many are left.
+
+    Parameters
+    ----------
+    max_age : timedelta, optional
+        The age of the oldest entries to keep. If None, entries aren't pruned by age.
+    max_entries : int, optional
+        The number of entries to keep. If None, entries aren't pruned by number.
+    archive_dir : str, optional
+        If given, the entries are written to a new gzipped JSON lines file in this directory before they're
+        deleted (see :class:`LogArchive`).
+    chunk_size : int, optional
+        The number of entries deleted by each query.
+    now : datetime, optional
+        The current time, which ``max_age`` is measured from.
+
+    Returns
+    -------
+    int
+        The number of entries deleted.
+
+    """
+    if now is None:
+        now = datetime.now()
+
+    archive = LogArchive(archive_dir, now=now) if archive_dir else None
+    deleted = 0
+
+    try:
+        if max_age is not None:
+            old_entries = LogEntry.objects.filter(create_time__lt=now - max_age)
+            deleted += _delete_in_chunks(old_entries, chunk_size, archive)
+
+        if max_entries is not None:
+            excess = LogEntry.objects.count() - max_entries
+            if excess > 0:
+                deleted += _delete_in_chunks(LogEntry.objects.all(), chunk_size, archive, limit=excess)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    return deleted
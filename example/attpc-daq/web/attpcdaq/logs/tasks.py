@@ -0,0 +1,33 @@
+"""Periodic maintenance of the log entry table"""
+
+from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
+
+from .retention import prune_log_entries
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+@shared_task(soft_time_limit=300, time_limit=330)
+def prune_log_entries_task():
+    """Remove old log entries according to the retention settings.
+
+    This calls :func:`~attpcdaq.logs.retention.prune_log_entries` with the ``LOG_RETENTION_MAX_AGE``,
+    ``LOG_RETENTION_MAX_ENTRIES``, and ``LOG_ARCHIVE_DIR`` settings.
+
+    """
+    try:
+        deleted = prune_log_entries(
+            max_age=getattr(settings, 'LOG_RETENTION_MAX_AGE', None),
+            max_entries=getattr(settings, 'LOG_RETENTION_MAX_ENTRIES', None),
+            archive_dir=getattr(settings, 'LOG_ARCHIVE_DIR', None),
+        )
+    except SoftTimeLimitExceeded:
+        logger.error('Time limit exceeded while pruning log entries')
+    except Exception:
+        logger.exception('Failed to prune log entries')
+    else:
+        if deleted > 0:
+            logger.info('Pruned %d old log entries', deleted)
@@ -0,0 +1,160 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+from unittest.mock import patch
+from datetime import datetime, timedelta
+import tempfile
+import logging
+import gzip
+import json
+import os
+import importlib
+
+from .handler import DjangoDatabaseHandler
+from .models import LogEntry
+from .retention import prune_log_entries
+
+
+def make_record(level=logging.INFO, msg='message'):
+    return logging.LogRecord('attpcdaq.test', level, __file__, 1, msg, None, None, 'func')
+
+
+@override_settings(LOG_DATABASE_ENABLED=True)
+@patch('attpcdaq.logs.models.LogEntry.objects.bulk_create')
+class DjangoDatabaseHandlerTestCase(SimpleTestCase):
+    def setUp(self):
+        self.handler = DjangoDatabaseHandler(capacity=100, batch_size=10, flush_interval=60)
+
+    def tearDown(self):
+        self.handler.close()
+
+    def written_entries(self, mock_bulk_create):
+        return [entry for c in mock_bulk_create.call_args_list for entry in c[0][0]]
+
+    def test_writes_in_batches(self, mock_bulk_create):
+        for i in range(25):
+            self.handler.emit(make_record(msg='message {}'.format(i)))
+        self.handler.flush()
+
+        entries = self.written_entries(mock_bulk_create)
+        self.assertEqual([e.message for e in entries], ['message {}'.format(i) for i in range(25)])
+        self.assertTrue(all(len(c[0][0]) <= 10 for c in mock_bulk_create.call_args_list))
+        self.assertLess(mock_bulk_create.call_count, 25)
+
+    def test_close_writes_queued_records(self, mock_bulk_create):
+        self.handler.emit(make_record())
+        self.handler.close()
+
+        self.assertEqual(len(self.written_entries(mock_bulk_create)), 1)
+
+    def test_info_sampled_under_backpressure(self, mock_bulk_create):
+        with patch.object(self.handler, '_ensure_started'):  # Keep the writer from emptying the queue
+            for i in range(100):
+                self.handler.emit(make_record(logging.INFO))
+            self.handler.emit(make_record(logging.ERROR))
+
+        self.assertGreater(self.handler.dropped_count, 0)
+        self.assertEqual(self.handler._queue.qsize() + self.handler.dropped_count, 101)
+
+        # Warnings and errors are kept while there's room
+        self.assertEqual(self.handler._queue.queue[-1].level, logging.ERROR)
+
+    def test_drops_when_full(self, mock_bulk_create):
+        with patch.object(self.handler, '_ensure_started'):
+            for i in range(150):
+                self.handler.emit(make_record(logging.ERROR))
+
+        self.assertEqual(self.handler._queue.qsize(), 100)
+        self.assertEqual(self.handler.dropped_count, 50)
+
+    def test_reports_dropped_records(self, mock_bulk_create):
+        with patch.object(self.handler, '_ensure_started'):
+            for i in range(150):
+                self.handler.emit(make_record(logging.ERROR))
+
+        self.handler._ensure_started()
+        self.handler.flush()
+
+        messages = [e.message for e in self.written_entries(mock_bulk_create)]
+        self.assertEqual(len(messages), 101)
+        self.assertEqual(len([m for m in messages if m.startswith('Dropped 50 log records')]), 1)
+
+    def test_database_error_does_not_stop_writer(self, mock_bulk_create):
+        mock_bulk_create.side_effect = [RuntimeError('Database is gone'), None]
+
+        with patch('sys.stderr'):
+            self.handler.emit(make_record())
+            self.handler.flush()
+        self.handler.emit(make_record())
+        self.handler.flush()
+
+        self.assertEqual(mock_bulk_create.call_count, 2)
+
+    def test_disabled_by_setting(self, mock_bulk_create):
+        with self.settings(LOG_DATABASE_ENABLED=False):
+            self.handler.emit(make_record())
+        self.handler.flush()
+
+        self.assertEqual(mock_bulk_create.call_count, 0)
+        self.assertIsNone(self.handler._thread)
+
+
+class LoggingSettingsTestCase(SimpleTestCase):
+    def test_database_handler_enabled(self):
+        # The tests run with their own settings, so check the normal ones directly
+        normal_settings = importlib.import_module('attpcdaq.settings')
+
+        self.assertTrue(normal_settings.LOG_DATABASE_ENABLED)
+        self.assertEqual(normal_settings.LOGGING['handlers']['database']['class'],
+                         'attpcdaq.logs.handler.DjangoDatabaseHandler')
+        for logger_name in ('django', 'attpcdaq'):
+            self.assertIn('database', normal_settings.LOGGING['loggers'][logger_name]['handlers'])
+
+
+class PruneLogEntriesTestCase(TestCase):
+    def setUp(self):
+        self.now = datetime(2017, 3, 1, 12, 0, 0)
+        for i in range(10):
+            LogEntry.objects.create(
+                logger_name='attpcdaq.test',
+                create_time=self.now - timedelta(days=i),
+                level=LogEntry.ERROR,
+                path_name=__file__,
+                line_num=i,
+                function_name='func',
+                message='{} days old'.format(i),
+            )
+
+    def remaining_ages(self):
+        return sorted(entry.line_num for entry in LogEntry.objects.all())
+
+    def test_prune_by_age(self):
+        deleted = prune_log_entries(max_age=timedelta(days=4, hours=12), chunk_size=2, now=self.now)
+
+        self.assertEqual(deleted, 5)
+        self.assertEqual(self.remaining_ages(), [0, 1, 2, 3, 4])
+
+    def test_prune_by_count(self):
+        deleted = prune_log_entries(max_entries=3, chunk_size=4, now=self.now)
+
+        self.assertEqual(deleted, 7)
+        self.assertEqual(self.remaining_ages(), [0, 1, 2])
+
+    def test_no_limits(self):
+        self.assertEqual(prune_log_entries(now=self.now), 0)
+        self.assertEqual(LogEntry.objects.count(), 10)
+
+    def test_archive(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            prune_log_entries(max_entries=8, archive_dir=archive_dir, now=self.now)
+
+            archive_files = os.listdir(archive_dir)
+            self.assertEqual(len(archive_files), 1)
+            with gzip.open(os.path.join(archive_dir, archive_files[0]), 'rt') as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual([row['message'] for row in rows], ['9 days old', '8 days old'])
+        self.assertEqual(rows[0]['level'], 'Error')
+
+    def test_no_archive_if_nothing_pruned(self):
+        with tempfile.TemporaryDirectory() as archive_dir:
+            prune_log_entries(max_entries=100, archive_dir=archive_dir, now=self.now)
+            self.assertEqual(os.listdir(archive_dir), [])
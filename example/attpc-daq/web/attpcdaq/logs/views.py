@@ -5,8 +5,10 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.core.urlresolvers import reverse
 from django.http import HttpResponseNotAllowed, HttpResponseBadRequest
+from django.conf import settings
 
 from .models import LogEntry
+from .retention import prune_log_entries
 
 import logging
 logger = logging.getLogger(__name__)
@@ -49,7 +51,8 @@ def clear_all_logs(request):
             logger.error('No "next" url provided in form')
             return HttpResponseBadRequest()
 
-        LogEntry.objects.all().delete()
+        # Delete in chunks, and keep a copy if the entries are being archived
+        prune_log_entries(max_entries=0, archive_dir=getattr(settings, 'LOG_ARCHIVE_DIR', None))
         return redirect(next_url)
 
     else:
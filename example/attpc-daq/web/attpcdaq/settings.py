@@ -11,8 +11,9 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
-from datetime import timedelta
+import tempfile
 import logging
+from datetime import timedelta
 
 IS_PRODUCTION = 'DAQ_IS_PRODUCTION' in os.environ
 
@@ -128,6 +129,14 @@ if IS_PRODUCTION:
         }
     }
     CRISPY_FAIL_SILENTLY = True
+
+    # The cache must be shared by the web server and the Celery workers, which run in different containers
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'attpcdaq_cache',
+        }
+    }
 else:
     DEBUG = True
     ALLOWED_HOSTS = []
@@ -140,6 +149,18 @@ else:
     }
     CRISPY_FAIL_SILENTLY = False
 
+    # The cache must be shared by the development server and the Celery worker
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(tempfile.gettempdir(), 'attpcdaq_cache'),
+        }
+    }
+
+# Log records are stored in the database by the 'database' handler below. Set this to False to turn it off without
+# changing the logging configuration.
+LOG_DATABASE_ENABLED = True
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -157,6 +178,9 @@ LOGGING = {
         'database': {
             'class': 'attpcdaq.logs.handler.DjangoDatabaseHandler',
             'level': 'INFO',
+            'capacity': 10000,      # Records waiting to be written before new ones are dropped
+            'batch_size': 200,      # Records written per query
+            'flush_interval': 1.0,  # Longest time, in seconds, before a record is written
         },
     },
     'loggers': {
@@ -192,18 +216,41 @@ else:
 
 CELERY_RESULT_BACKEND = 'rpc://'
 
-# Periodic tasks
-CELERYBEAT_SCHEDULE = {
-    'update-state-every-5-sec': {
-        'task': 'attpcdaq.daq.tasks.eccserver_refresh_all_task',
-        'schedule': timedelta(seconds=5),
-    },
-    'check-ecc-server-online-every-15-sec': {
-        'task': 'attpcdaq.daq.tasks.check_ecc_server_online_all_task',
-        'schedule': timedelta(seconds=15),
-    },
-    'check-data-router-status-every-15-sec': {
-        'task': 'attpcdaq.daq.tasks.check_data_router_status_all_task',
-        'schedule': timedelta(seconds=15),
-    },
-}
+# Idle SSH connections to the DAQ worker nodes are closed after this many seconds
+SSH_CONNECTION_IDLE_TTL = 300
+
+# Timeouts, in seconds, for loading documents from the ECC servers and for each SOAP request to them
+ECC_SOAP_TIMEOUT = 10
+ECC_SOAP_OPERATION_TIMEOUT = 10
+
+# The number of seconds before the list of configs from an ECC server is fetched again
+ECC_CONFIG_LIST_TTL = 60
+
+# The longest time, in seconds, that the data link XML sent to the ECC servers is cached
+ECC_DATA_LINK_CACHE_TTL = 3600
+
+# The longest time, in seconds, that the ECC servers may take to finish one step of a multi-step transition
+ECC_TRANSITION_STEP_TIMEOUT = 300
+
+# The periodic tasks are scheduled in attpcdaq/celery.py
+
+# Announce changes to the system status through the Celery broker, so open status streams are updated right away
+STATUS_BROADCAST_ENABLED = True
+
+# The number of seconds that the status checks stay at their fastest rate after a transition is requested
+STATUS_POLL_BUSY_DURATION = 30
+
+# The most status checks that run at once, and the time in seconds between each group of them that is started
+STATUS_POLL_MAX_CONCURRENCY = 4
+STATUS_POLL_WAVE_INTERVAL = 2
+
+# The longest random delay, in seconds, added to each status check
+STATUS_POLL_JITTER = 0.5
+
+# Log entries older than this are deleted, and only the newest LOG_RETENTION_MAX_ENTRIES are kept. Set either
+# to None to disable it.
+LOG_RETENTION_MAX_AGE = timedelta(days=30)
+LOG_RETENTION_MAX_ENTRIES = 100000
+
+# If set, deleted log entries are first saved to gzipped JSON lines files in this directory
+LOG_ARCHIVE_DIR = os.environ.get('DAQ_LOG_ARCHIVE_DIR')
@@ -0,0 +1,24 @@
+"""
+Django settings for running the attpcdaq unit tests.
+
+These are the normal settings from :mod:`attpcdaq.settings` with a few changes for the tests. Use them with
+
+    python manage.py test --settings=attpcdaq.test_settings
+"""
+
+from .settings import *
+
+# Each test run starts with an empty cache, and entries aren't culled while the tests depend on them
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    }
+}
+
+# The database log handler writes from a background thread, which can't see or share the transactions the
+# test cases run in, so log records aren't stored in the database during tests.
+LOG_DATABASE_ENABLED = False
+
+# There is no broker during the tests
+STATUS_BROADCAST_ENABLED = False
@@ -18,5 +18,9 @@ make html
 cd ..
 
 python manage.py migrate --noinput             # Prepare the database
+python manage.py createcachetable              # Create the table for the shared cache
 
-gunicorn attpcdaq.wsgi -b :8000                # Start the Django app
+# Start the Django app. Threaded workers are used so that open log and status streams don't block other requests.
+# The status streams only wake up when the status changes, but each holds a thread, so they are limited to 24 of the
+# 32 threads (see STATUS_STREAM_MAX_OPEN in attpcdaq/daq/views/api.py).
+gunicorn attpcdaq.wsgi -b :8000 --worker-class gthread --threads 32